@@ -1,8 +1,42 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import Group
-from .models import Livro, Emprestimo, Usuario
+from .models import Livro, Emprestimo, EmprestimoArquivado, Exclusao, Exemplar, Reserva, Usuario
 
 admin.site.register(Usuario)
 admin.site.register(Livro)
-admin.site.register(Emprestimo) 
\ No newline at end of file
+
+
+@admin.register(Emprestimo)
+class EmprestimoAdmin(admin.ModelAdmin):
+    # __str__ usa livro e usuario; sem isso a listagem faz duas consultas por linha.
+    list_select_related = ('livro', 'usuario')
+
+
+@admin.register(EmprestimoArquivado)
+class EmprestimoArquivadoAdmin(admin.ModelAdmin):
+    list_select_related = ('livro', 'usuario')
+    list_display = ('livro', 'usuario', 'data_emprestimo', 'data_devolucao', 'arquivado_em')
+    date_hierarchy = 'data_devolucao'
+
+
+@admin.register(Reserva)
+class ReservaAdmin(admin.ModelAdmin):
+    list_select_related = ('livro', 'usuario')
+    list_display = ('livro', 'usuario', 'data_reserva', 'status')
+    list_filter = ('status',)
+
+
+@admin.register(Exemplar)
+class ExemplarAdmin(admin.ModelAdmin):
+    list_select_related = ('livro',)
+    list_display = ('livro', 'codigo', 'data_registro')
+
+
+@admin.register(Exclusao)
+class ExclusaoAdmin(admin.ModelAdmin):
+    # Progresso do expurgo: registros_apagados sobe a cada lote confirmado.
+    list_select_related = ('solicitada_por',)
+    list_display = ('descricao', 'tipo', 'solicitada_por', 'solicitada_em', 'registros_apagados', 'registros_total',
+                    'percentual', 'concluida_em')
+    list_filter = ('tipo', ('concluida_em', admin.EmptyFieldListFilter))
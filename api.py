@@ -0,0 +1,225 @@
+import hashlib
+from functools import wraps
+
+from django.db.models import F
+from django.http import JsonResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_safe
+
+from .autorizacao import PERMISSAO_GERENCIAMENTO, papel_do_usuario
+from .busca import buscar_ids_livros, limite_busca
+from .cache_catalogo import CHAVE_VERSAO, CHAVE_VERSAO_RECOMENDACOES, CHAVE_VERSAO_USUARIOS, versao_atual
+from .exportacao import COLUNAS_EMPRESTIMO
+from .models import Emprestimo, Livro, Usuario
+from .orcamento_consultas import orcamento_consultas
+from .paginacao import LIMITE_INTEIRO, paginar_por_chave
+from .recomendacoes import recomendacoes_do_livro
+from .replicas import ler_da_replica
+from .views import filtro_busca_emprestimos, filtro_busca_usuarios
+
+
+VERSAO_API = 'v1'
+ORDENACAO = ('id',)
+
+# (campo no ORM, nome na API); fields= escolhe pelo nome. Sem fields= vão todas.
+COLUNAS_LIVRO = tuple((campo, campo) for campo in (
+    'id', 'titulo', 'autor', 'ano_publicacao', 'genero', 'total_exemplares', 'exemplares_disponiveis',
+    'data_registro',
+))
+COLUNAS_USUARIO = tuple((campo, campo) for campo in (
+    'id', 'login', 'reader_name', 'reader_contact', 'reader_address', 'reader_ref_id', 'email',
+    'tipo_usuario', 'is_active', 'date_joined',
+))
+COLUNAS_EMPRESTIMO_API = COLUNAS_EMPRESTIMO[:1] + (('livro_id', 'livro_id'),) + COLUNAS_EMPRESTIMO[1:]
+COLUNAS_RECOMENDACAO = ('id', 'titulo', 'autor', 'genero', 'exemplares_disponiveis')
+
+PARAMETROS_JSON = {'ensure_ascii': False, 'separators': (',', ':')}
+
+
+class ParametroInvalido(ValueError):
+    pass
+
+
+def _erro(mensagem, status=400):
+    return JsonResponse({'erro': mensagem}, status=status, json_dumps_params=PARAMETROS_JSON)
+
+
+def api_login_requerido(view):
+    # login_required redirecionaria para a página de login; um cliente JSON precisa do 401.
+    @wraps(view)
+    def _view(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return _erro("Autenticação necessária.", status=401)
+        return view(request, *args, **kwargs)
+
+    return _view
+
+
+def _etag(*chaves_versao, por_usuario=True):
+    """ETag pela versão das tabelas lidas (trocada a cada gravação), sem consultar o banco.
+
+    Um If-None-Match que confere vira 304 antes da view rodar. As listas restritas por papel
+    entram com o usuário, para que um cache compartilhado nunca sirva a lista de outra pessoa.
+    """
+    def etag(request, *args, **kwargs):
+        partes = [VERSAO_API, request.get_full_path(), [versao_atual(chave) for chave in chaves_versao]]
+        if por_usuario:
+            partes += [request.user.pk, papel_do_usuario(request.user)]
+        return hashlib.md5(repr(partes).encode(), usedforsecurity=False).hexdigest()
+
+    return etag
+
+
+def _inteiro(request, nome):
+    valor = request.GET.get(nome, '').strip()
+    if not valor:
+        return None
+    try:
+        numero = int(valor)
+    except ValueError:
+        raise ParametroInvalido(f"{nome} deve ser um número inteiro.")
+    if not -LIMITE_INTEIRO <= numero < LIMITE_INTEIRO:
+        raise ParametroInvalido(f"{nome} está fora do intervalo aceito.")
+    return numero
+
+
+def _booleano(request, nome):
+    valor = request.GET.get(nome, '').strip()
+    if not valor:
+        return None
+    if valor not in ('0', '1'):
+        raise ParametroInvalido(f"{nome} deve ser 0 ou 1.")
+    return valor == '1'
+
+
+def _colunas_pedidas(request, colunas):
+    pedido = request.GET.get('fields', '').strip()
+    if not pedido:
+        return colunas
+    por_nome = {nome: campo for campo, nome in colunas}
+    nomes = list(dict.fromkeys(nome.strip() for nome in pedido.split(',') if nome.strip()))
+    desconhecidos = [nome for nome in nomes if nome not in por_nome]
+    if desconhecidos:
+        raise ParametroInvalido(
+            f"Campos desconhecidos: {', '.join(desconhecidos)}. Disponíveis: {', '.join(por_nome)}."
+        )
+    # id vai sempre: é a chave do cursor.
+    return tuple((por_nome[nome], nome) for nome in ['id'] + [nome for nome in nomes if nome != 'id'])
+
+
+def _selecionar(queryset, colunas):
+    # values() devolve dicts já com os nomes da API, sem instanciar modelos, e só faz
+    # JOIN com livro/usuário quando algum campo deles foi pedido.
+    diretos = [campo for campo, nome in colunas if campo == nome]
+    renomeados = {nome: F(campo) for campo, nome in colunas if campo != nome}
+    return queryset.values(*diretos, **renomeados)
+
+
+def _listar(request, queryset, colunas, **extras):
+    pagina = paginar_por_chave(request, _selecionar(queryset, _colunas_pedidas(request, colunas)), ordenacao=ORDENACAO)
+    return JsonResponse({
+        'resultados': pagina.itens,
+        'proxima': request.build_absolute_uri(pagina.url_proxima) if pagina.tem_proxima else None,
+        'anterior': request.build_absolute_uri(pagina.url_anterior) if pagina.tem_anterior else None,
+        **extras,
+    }, json_dumps_params=PARAMETROS_JSON)
+
+
+def parametros_validados(view):
+    @wraps(view)
+    def _view(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except ParametroInvalido as e:
+            return _erro(str(e))
+
+    return _view
+
+
+@require_safe
+@cache_control(public=True, no_cache=True)
+@orcamento_consultas(2)
+@condition(etag_func=_etag(CHAVE_VERSAO, por_usuario=False))
+@parametros_validados
+@ler_da_replica
+def api_livros(request):
+    livros = Livro.objects.all()
+    extras = {}
+    query = request.GET.get('query', '').strip()
+    if query:
+        # Mesmo motor de busca da página de livros, que devolve no máximo limite_busca() livros, os
+        # mais relevantes; a paginação segue pelo id dentro deles. A resposta avisa quando o limite cortou a busca.
+        limite = limite_busca()
+        ids = buscar_ids_livros(query, limite)
+        livros = livros.filter(id__in=ids)
+        extras = {'limite_busca': limite, 'busca_truncada': len(ids) >= limite}
+    genero = request.GET.get('genero', '').strip()
+    if genero:
+        livros = livros.filter(genero=genero)
+    if _booleano(request, 'disponiveis'):
+        livros = livros.disponiveis()
+    return _listar(request, livros, COLUNAS_LIVRO, **extras)
+
+
+@require_safe
+@cache_control(public=True, no_cache=True)
+@orcamento_consultas(2)
+@condition(etag_func=_etag(CHAVE_VERSAO, CHAVE_VERSAO_RECOMENDACOES, por_usuario=False))
+@ler_da_replica
+def api_recomendacoes(request, livro_id):
+    # A lista já está pronta em Recomendacao: sem paginação nem fields=, são no máximo K livros.
+    if not Livro.objects.filter(id=livro_id).exists():
+        return _erro("Livro não encontrado.", status=404)
+    return JsonResponse({
+        'resultados': [
+            {**{campo: getattr(recomendacao.recomendado, campo) for campo in COLUNAS_RECOMENDACAO},
+             'leitores': recomendacao.leitores}
+            for recomendacao in recomendacoes_do_livro(livro_id)
+        ],
+    }, json_dumps_params=PARAMETROS_JSON)
+
+
+@require_safe
+@api_login_requerido
+@cache_control(private=True, no_cache=True)
+@orcamento_consultas(1)
+@condition(etag_func=_etag(CHAVE_VERSAO_USUARIOS))
+@parametros_validados
+@ler_da_replica
+def api_usuarios(request):
+    usuarios = Usuario.objects.all()
+    # Membros veem só o próprio cadastro.
+    if papel_do_usuario(request.user) not in PERMISSAO_GERENCIAMENTO:
+        usuarios = usuarios.filter(id=request.user.pk)
+    query = request.GET.get('query', '').strip()
+    if query:
+        usuarios = usuarios.filter(filtro_busca_usuarios(query))
+    tipo = request.GET.get('tipo', '').strip()
+    if tipo:
+        usuarios = usuarios.filter(tipo_usuario=tipo)
+    return _listar(request, usuarios, COLUNAS_USUARIO)
+
+
+@require_safe
+@api_login_requerido
+@cache_control(private=True, no_cache=True)
+@orcamento_consultas(1)
+@condition(etag_func=_etag(CHAVE_VERSAO, CHAVE_VERSAO_USUARIOS))
+@parametros_validados
+@ler_da_replica
+def api_emprestimos(request):
+    emprestimos = Emprestimo.objects.all()
+    # Membros veem só os próprios empréstimos.
+    if papel_do_usuario(request.user) not in PERMISSAO_GERENCIAMENTO:
+        emprestimos = emprestimos.filter(usuario_id=request.user.pk)
+    query = request.GET.get('query', '').strip()
+    if query:
+        emprestimos = emprestimos.filter(filtro_busca_emprestimos(query))
+    devolvido = _booleano(request, 'devolvido')
+    if devolvido is not None:
+        emprestimos = emprestimos.filter(devolvido=devolvido)
+    for parametro, campo in (('livro', 'livro_id'), ('usuario', 'usuario_id')):
+        valor = _inteiro(request, parametro)
+        if valor is not None:
+            emprestimos = emprestimos.filter(**{campo: valor})
+    return _listar(request, emprestimos, COLUNAS_EMPRESTIMO_API)
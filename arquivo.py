@@ -0,0 +1,84 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .cache_catalogo import invalidar_catalogo
+from .exclusao import apagar_sem_sinais
+from .models import Emprestimo, EmprestimoArquivado
+
+
+IDADE_ARQUIVO_PADRAO = 365
+TAMANHO_LOTE_PADRAO = 1000
+# ids por consulta com IN (...): abaixo do limite de 2100 parâmetros do SQL Server.
+IDS_POR_CONSULTA = 500
+CAMPOS_ARQUIVADOS = (
+    'id', 'livro_id', 'usuario_id', 'data_emprestimo', 'data_devolucao', 'data_devolucao_prevista',
+    'devolvido', 'aviso_atraso_em',
+)
+
+
+class ResultadoArquivamento:
+    def __init__(self):
+        self.arquivados = 0
+        self.lotes = 0
+        self.ultimo_id = 0
+
+
+def idade_padrao():
+    return timedelta(days=getattr(settings, 'BIBLIOTECA_ARQUIVO_IDADE_DIAS', IDADE_ARQUIVO_PADRAO))
+
+
+def emprestimos_a_arquivar(limite):
+    return Emprestimo.objects.filter(devolvido=True, data_devolucao__lt=limite)
+
+
+def _mover(ids, limite, agora):
+    # A condição é conferida de novo com as linhas travadas: um empréstimo reaberto
+    # (editar_emprestimo) entre a seleção dos ids e este ponto fica onde está.
+    linhas = list(
+        emprestimos_a_arquivar(limite).select_for_update().filter(id__in=ids).values(*CAMPOS_ARQUIVADOS)
+    )
+    if linhas:
+        EmprestimoArquivado.objects.bulk_create(EmprestimoArquivado(arquivado_em=agora, **linha) for linha in linhas)
+        # QuerySet.delete() mandaria post_delete para cada empréstimo, e as estatísticas descontariam
+        # empréstimos que só mudaram de tabela.
+        apagar_sem_sinais(Emprestimo, [linha['id'] for linha in linhas])
+        # Nenhum livro muda; só o ETag da API de empréstimos.
+        invalidar_catalogo([])
+    return len(linhas)
+
+
+def arquivar_emprestimos(idade=None, agora=None, tamanho_lote=TAMANHO_LOTE_PADRAO, maximo_lotes=None,
+                         pausa=0, ao_arquivar_lote=None):
+    """Move para EmprestimoArquivado os empréstimos devolvidos há mais de idade (padrão: BIBLIOTECA_ARQUIVO_IDADE_DIAS).
+
+    Cada lote copia e apaga as mesmas linhas numa transação própria: um empréstimo nunca está nas duas
+    tabelas nem em nenhuma, e as estatísticas, que contam as duas, não mudam. Interrompido, basta rodar
+    de novo: o que já foi movido não está mais em Emprestimo. pausa (segundos) alivia o banco entre lotes.
+    """
+    agora = agora or timezone.now()
+    limite = agora - (idade if idade is not None else idade_padrao())
+    resultado = ResultadoArquivamento()
+    while maximo_lotes is None or resultado.lotes < maximo_lotes:
+        ids = list(
+            emprestimos_a_arquivar(limite).filter(id__gt=resultado.ultimo_id)
+            .order_by('id').values_list('id', flat=True)[:tamanho_lote]
+        )
+        if not ids:
+            break
+        with transaction.atomic():
+            movidos = sum(
+                _mover(ids[inicio:inicio + IDS_POR_CONSULTA], limite, agora)
+                for inicio in range(0, len(ids), IDS_POR_CONSULTA)
+            )
+        resultado.arquivados += movidos
+        resultado.lotes += 1
+        resultado.ultimo_id = ids[-1]
+        if ao_arquivar_lote:
+            ao_arquivar_lote(resultado)
+        if pausa:
+            time.sleep(pausa)
+    return resultado
@@ -0,0 +1,64 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+
+from .models import Usuario
+
+
+BACKEND_MODELO = 'django.contrib.auth.backends.ModelBackend'
+BACKEND_PAPEIS = 'biblioteca.autorizacao.BackendPapeis'
+
+_pool_hash = None
+
+
+def pool_hash():
+    # O PBKDF2 do hashlib libera o GIL, então threads calculam hashes em paralelo de verdade.
+    # O limite evita que um pico de logins consuma todos os núcleos da máquina.
+    global _pool_hash
+    if _pool_hash is None:
+        limite = getattr(settings, 'BIBLIOTECA_THREADS_HASH', None) or os.cpu_count() or 4
+        _pool_hash = ThreadPoolExecutor(max_workers=limite, thread_name_prefix='hash-senha')
+    return _pool_hash
+
+
+def backend_autenticacao():
+    # A sessão guarda o caminho do backend, e ele precisa constar em AUTHENTICATION_BACKENDS.
+    if BACKEND_PAPEIS in settings.AUTHENTICATION_BACKENDS:
+        return BACKEND_PAPEIS
+    return BACKEND_MODELO
+
+
+async def executar_hash(funcao, *args):
+    return await asyncio.get_running_loop().run_in_executor(pool_hash(), funcao, *args)
+
+
+async def agerar_hash_senha(senha):
+    return await executar_hash(make_password, senha)
+
+
+async def aautenticar(login, senha):
+    """Equivalente assíncrono de authenticate() para o ModelBackend, sem ocupar o event loop com o hash."""
+    if login is None or senha is None:
+        return None
+    try:
+        usuario = await Usuario.objects.aget(login=login)
+    except Usuario.DoesNotExist:
+        # Calcula um hash mesmo assim, para o tempo de resposta não revelar se o login existe.
+        await agerar_hash_senha(senha)
+        return None
+
+    precisa_atualizar = []
+    valida = await executar_hash(check_password, senha, usuario.password, precisa_atualizar.append)
+    if not valida or not usuario.is_active:
+        return None
+
+    if precisa_atualizar:
+        # O hasher mudou (ex.: mais iterações); regrava o hash fora do event loop.
+        usuario.password = await agerar_hash_senha(senha)
+        await usuario.asave(update_fields=['password'])
+
+    usuario.backend = backend_autenticacao()
+    return usuario
@@ -0,0 +1,163 @@
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db import router
+from django.http import JsonResponse
+from django.shortcuts import redirect
+
+from .cache_catalogo import obter_cache
+
+
+TEMPO_CACHE_USUARIO_PADRAO = 300
+MENSAGEM_SEM_PERMISSAO = "Não tem permissão para aceder a esta página."
+
+PERMISSAO_GERENCIAMENTO = ('admin', 'funcionario')
+PERMISSAO_ADMIN = ('admin',)
+PERMISSAO_LEITOR = ('admin', 'funcionario', 'membro_comum')
+
+# Permissões declaradas no Meta de Livro, Emprestimo e Usuario que cada papel recebe automaticamente,
+# sem precisar de grupos nem de linhas em auth_permission ligadas ao usuário.
+PERMISSOES_MEMBRO = {
+    'biblioteca.can_listar_livro',
+    'biblioteca.can_reservar_livro',
+    'biblioteca.can_cancelar_reserva',
+}
+PERMISSOES_FUNCIONARIO = PERMISSOES_MEMBRO | {
+    'biblioteca.can_cadastrar_livro',
+    'biblioteca.can_atualizar_livro',
+    'biblioteca.can_cadastrar_usuario_comum',
+    'biblioteca.can_listar_usuario_comum',
+    'biblioteca.can_atualizar_usuario',
+    'biblioteca.can_realizar_emprestimo',
+    'biblioteca.can_realizar_devolucao',
+    'biblioteca.can_editar_emprestimo',
+    'biblioteca.can_listar_emprestimos_vencidos',
+    'biblioteca.can_listar_todos_emprestimos',
+}
+PERMISSOES_ADMIN = PERMISSOES_FUNCIONARIO | {
+    'biblioteca.can_excluir_livro',
+}
+PERMISSOES_POR_PAPEL = {
+    'membro_comum': frozenset(PERMISSOES_MEMBRO),
+    'funcionario': frozenset(PERMISSOES_FUNCIONARIO),
+    'admin': frozenset(PERMISSOES_ADMIN),
+}
+
+
+def papel_do_usuario(usuario):
+    return (getattr(usuario, 'tipo_usuario', None) or '').lower()
+
+
+def permissoes_do_papel(papel):
+    return PERMISSOES_POR_PAPEL.get(papel, frozenset())
+
+
+def chave_usuario(usuario_id):
+    return f'biblioteca:usuario:{usuario_id}'
+
+
+def invalidar_usuario(usuario_id):
+    obter_cache().delete(chave_usuario(usuario_id))
+
+
+# O que a autenticação, os papéis e o menu leem de request.user. A senha fica de fora: o cache é
+# compartilhado, e a verificação da sessão usa o hash da sessão guardado junto.
+CAMPOS_CACHE_USUARIO = ('id', 'login', 'reader_name', 'tipo_usuario', 'is_active', 'is_staff', 'is_superuser')
+
+
+def _guardar_usuario(usuario):
+    return {
+        'campos': {campo: getattr(usuario, campo) for campo in CAMPOS_CACHE_USUARIO},
+        'hash_sessao': usuario.get_session_auth_hash(),
+    }
+
+
+def _usuario_guardado(guardado):
+    # Os demais campos ficam adiados: se alguma view os ler, o Django busca no banco só então.
+    modelo = get_user_model()
+    campos = guardado['campos']
+    nomes = [campo.attname for campo in modelo._meta.concrete_fields if campo.attname in campos]
+    usuario = modelo.from_db(router.db_for_read(modelo), nomes, [campos[nome] for nome in nomes])
+    usuario._hash_sessao = guardado['hash_sessao']
+    return usuario
+
+
+class BackendPapeis(ModelBackend):
+    """ModelBackend que guarda os campos de autenticação do usuário no cache e concede as permissões do papel.
+
+    Opcional: ative colocando 'biblioteca.autorizacao.BackendPapeis' em AUTHENTICATION_BACKENDS. O
+    AuthenticationMiddleware passa a montar request.user sem consultar a tabela de usuários;
+    signals.py apaga a entrada sempre que o Usuario é salvo ou excluído. As views não dependem dele:
+    papel_requerido decide pelo tipo_usuario com qualquer backend.
+    """
+
+    def get_user(self, user_id):
+        cache = obter_cache()
+        chave = chave_usuario(user_id)
+        guardado = cache.get(chave)
+        if guardado is None:
+            usuario = super().get_user(user_id)
+            if usuario is not None:
+                cache.set(chave, _guardar_usuario(usuario),
+                          getattr(settings, 'BIBLIOTECA_CACHE_USUARIO_TIMEOUT', TEMPO_CACHE_USUARIO_PADRAO))
+            return usuario
+        usuario = _usuario_guardado(guardado)
+        return usuario if self.user_can_authenticate(usuario) else None
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        return set(permissoes_do_papel(papel_do_usuario(user_obj))) | super().get_all_permissions(user_obj, obj)
+
+    def has_perm(self, user_obj, perm, obj=None):
+        # O papel resolve a maioria dos casos sem tocar nas tabelas de permissões.
+        if user_obj.is_active and obj is None and perm in permissoes_do_papel(papel_do_usuario(user_obj)):
+            return True
+        return super().has_perm(user_obj, perm, obj)
+
+
+def _negar(request, mensagem):
+    messages.error(request, mensagem)
+    return redirect('pagina_inicial')
+
+
+def _negar_json(request, mensagem):
+    return JsonResponse({'erro': mensagem}, status=403)
+
+
+def _decorador_autorizacao(permitido, mensagem, negar=_negar):
+    def decorador(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def _view_async(request, *args, **kwargs):
+                # Carrega o usuário uma vez; templates e a view reaproveitam o mesmo objeto.
+                request.user = await request.auser()
+                if not permitido(request.user):
+                    return negar(request, mensagem)
+                return await view(request, *args, **kwargs)
+
+            return markcoroutinefunction(_view_async)
+
+        @wraps(view)
+        def _view(request, *args, **kwargs):
+            if not permitido(request.user):
+                return negar(request, mensagem)
+            return view(request, *args, **kwargs)
+
+        return _view
+
+    return decorador
+
+
+def papel_requerido(papeis, mensagem=MENSAGEM_SEM_PERMISSAO):
+    """Só deixa passar usuários cujo tipo_usuario está em papeis; os demais voltam à página inicial."""
+    return _decorador_autorizacao(lambda usuario: papel_do_usuario(usuario) in papeis, mensagem)
+
+
+def papel_requerido_json(papeis, mensagem=MENSAGEM_SEM_PERMISSAO):
+    """papel_requerido para endpoints JSON: quem não tem o papel recebe 403 com {'erro': mensagem}."""
+    return _decorador_autorizacao(lambda usuario: papel_do_usuario(usuario) in papeis, mensagem, _negar_json)
@@ -0,0 +1,122 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Emprestimo
+from .paginacao import percorrer_por_chave
+
+
+TAMANHO_LOTE_PADRAO = 2000
+TAMANHO_ENVIO_PADRAO = 100
+INTERVALO_AVISOS_PADRAO = 7
+ASSUNTO_AVISO = "Biblioteca: empréstimos em atraso"
+CAMPOS_AVISO = (
+    'id', 'usuario_id', 'usuario__email', 'usuario__reader_name',
+    'livro__titulo', 'data_devolucao_prevista', 'dias_atraso', 'valor_multa',
+)
+
+
+class ResultadoAvisos:
+    def __init__(self):
+        self.emprestimos = 0
+        self.avisos = 0
+        self.lotes_enviados = 0
+
+
+def intervalo_padrao():
+    dias = getattr(settings, 'BIBLIOTECA_AVISO_ATRASO_INTERVALO_DIAS', INTERVALO_AVISOS_PADRAO)
+    return timedelta(days=dias) if dias else None
+
+
+def emprestimos_a_avisar(agora=None, intervalo=None):
+    """Empréstimos vencidos de usuários com e-mail, ainda sem aviso ou com o último aviso mais antigo que intervalo.
+
+    Com intervalo=None cada empréstimo é avisado uma vez só.
+    """
+    agora = agora or timezone.now()
+    pendentes = Q(aviso_atraso_em__isnull=True)
+    if intervalo is not None:
+        pendentes |= Q(aviso_atraso_em__lte=agora - intervalo)
+    return (
+        Emprestimo.objects.vencidos(agora).filter(pendentes)
+        .exclude(usuario__email__isnull=True).exclude(usuario__email='')
+    )
+
+
+def montar_aviso(emprestimos):
+    """Um e-mail com todos os empréstimos vencidos de um usuário (linhas de CAMPOS_AVISO)."""
+    primeiro = emprestimos[0]
+    linhas = [
+        f"- {emprestimo['livro__titulo']}: devolução prevista em "
+        f"{timezone.localtime(emprestimo['data_devolucao_prevista']).strftime('%d/%m/%Y')}, "
+        f"{emprestimo['dias_atraso']} dia(s) de atraso, multa de R$ {emprestimo['valor_multa']}"
+        for emprestimo in emprestimos
+    ]
+    total = sum(emprestimo['valor_multa'] for emprestimo in emprestimos)
+    corpo = (
+        f"Olá, {primeiro['usuario__reader_name']}.\n\n"
+        "Os empréstimos abaixo passaram da data de devolução:\n\n"
+        + "\n".join(linhas)
+        + f"\n\nMulta total até hoje: R$ {total}. A multa continua correndo até a devolução.\n"
+    )
+    return EmailMessage(ASSUNTO_AVISO, corpo, to=[primeiro['usuario__email']])
+
+
+def _agrupar_por_usuario(lotes):
+    # Os lotes vêm ordenados por (usuario_id, id): um grupo só fecha quando aparece o próximo usuário,
+    # então os empréstimos de um usuário que cruzam a fronteira de um lote continuam no mesmo e-mail.
+    grupo = []
+    for lote in lotes:
+        for emprestimo in lote:
+            if grupo and emprestimo['usuario_id'] != grupo[0]['usuario_id']:
+                yield grupo
+                grupo = []
+            grupo.append(emprestimo)
+    if grupo:
+        yield grupo
+
+
+def enviar_avisos_atraso(agora=None, intervalo=None, tamanho_lote=TAMANHO_LOTE_PADRAO,
+                         tamanho_envio=TAMANHO_ENVIO_PADRAO, conexao=None, ao_enviar_lote=None):
+    """Manda um e-mail por usuário com seus empréstimos vencidos e registra o aviso em cada empréstimo.
+
+    Os empréstimos são lidos em lotes por chave (usuario_id, id), então a memória não cresce com o
+    total de atrasos. Os e-mails saem em grupos de tamanho_envio pela mesma conexão; cada grupo é
+    marcado em aviso_atraso_em logo depois de enviado, e uma nova execução pula o que já foi avisado.
+    Se o processo cair entre o envio e a marcação, aquele grupo é reenviado na próxima execução.
+    """
+    agora = agora or timezone.now()
+    resultado = ResultadoAvisos()
+    pendentes = (
+        emprestimos_a_avisar(agora, intervalo).com_multa(agora)
+        .values(*CAMPOS_AVISO)
+    )
+    lotes = percorrer_por_chave(pendentes, ordenacao=('usuario_id', 'id'), tamanho_lote=tamanho_lote)
+
+    mensagens = []
+    emprestimo_ids = []
+
+    def enviar():
+        resultado.avisos += conexao.send_messages(mensagens) or 0
+        for inicio in range(0, len(emprestimo_ids), 500):
+            Emprestimo.objects.filter(id__in=emprestimo_ids[inicio:inicio + 500]).update(aviso_atraso_em=agora)
+        resultado.emprestimos += len(emprestimo_ids)
+        resultado.lotes_enviados += 1
+        mensagens.clear()
+        emprestimo_ids.clear()
+        if ao_enviar_lote:
+            ao_enviar_lote(resultado)
+
+    conexao = conexao or get_connection()
+    with conexao:
+        for grupo in _agrupar_por_usuario(lotes):
+            mensagens.append(montar_aviso(grupo))
+            emprestimo_ids.extend(emprestimo['id'] for emprestimo in grupo)
+            if len(mensagens) >= tamanho_envio:
+                enviar()
+        if mensagens:
+            enviar()
+    return resultado
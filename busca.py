@@ -0,0 +1,163 @@
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .replicas import banco_de_leitura
+
+
+LIMITE_RESULTADOS_PADRAO = 500
+TABELA_BUSCA_LIVRO = 'biblioteca_livro_busca'
+
+_PADRAO_TERMO = re.compile(r'\w+', re.UNICODE)
+
+
+def normalizar_texto(texto):
+    # Remove acentos e padroniza em minúsculas: "Memórias" -> "memorias".
+    if not texto:
+        return ''
+    decomposto = unicodedata.normalize('NFKD', texto)
+    sem_acentos = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return sem_acentos.casefold()
+
+
+def extrair_termos(texto):
+    return _PADRAO_TERMO.findall(normalizar_texto(texto))
+
+
+class BackendBusca:
+    """Interface comum dos motores de busca do catálogo de livros."""
+
+    def criar_indice(self, cursor):
+        pass
+
+    def indexar(self, livros):
+        pass
+
+    def remover(self, livro_ids):
+        pass
+
+    def reconstruir(self, tamanho_lote=5000):
+        pass
+
+    def buscar(self, query, limite=LIMITE_RESULTADOS_PADRAO):
+        """Retorna os ids dos livros encontrados, do mais ao menos relevante."""
+        raise NotImplementedError
+
+
+class BackendIcontains(BackendBusca):
+    """Busca por LIKE '%termo%', usada quando o banco não tem índice de texto."""
+
+    def buscar(self, query, limite=LIMITE_RESULTADOS_PADRAO):
+        from .models import Livro
+
+        filtro = Q()
+        for termo in query.split():
+            filtro &= Q(titulo__icontains=termo) | Q(autor__icontains=termo)
+        if not filtro:
+            return []
+        return list(Livro.objects.filter(filtro).order_by('titulo').values_list('id', flat=True)[:limite])
+
+
+class BackendFTS5(BackendBusca):
+    """Índice FTS5 do SQLite, sem acentos e com busca por prefixo."""
+
+    # O título pesa mais que o autor no ranking bm25.
+    PESO_TITULO = 10.0
+    PESO_AUTOR = 1.0
+
+    SQL_CRIAR = (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA_BUSCA_LIVRO} "
+        "USING fts5(titulo, autor, tokenize='unicode61 remove_diacritics 2')"
+    )
+    SQL_REMOVER = f"DELETE FROM {TABELA_BUSCA_LIVRO} WHERE rowid = %s"
+    SQL_INSERIR = f"INSERT INTO {TABELA_BUSCA_LIVRO} (rowid, titulo, autor) VALUES (%s, %s, %s)"
+    SQL_BUSCAR = (
+        f"SELECT rowid FROM {TABELA_BUSCA_LIVRO} WHERE {TABELA_BUSCA_LIVRO} MATCH %s "
+        f"ORDER BY bm25({TABELA_BUSCA_LIVRO}, {PESO_TITULO}, {PESO_AUTOR}) LIMIT %s"
+    )
+
+    @staticmethod
+    def montar_consulta(query):
+        # Cada termo vira um prefixo entre aspas ("memo"*), o que também
+        # neutraliza os operadores da sintaxe do FTS5 digitados pelo usuário.
+        return ' AND '.join(f'"{termo}"*' for termo in extrair_termos(query))
+
+    def criar_indice(self, cursor):
+        cursor.execute(self.SQL_CRIAR)
+
+    def indexar(self, livros):
+        linhas = [(livro.id, livro.titulo, livro.autor) for livro in livros]
+        if not linhas:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(self.SQL_REMOVER, [(linha[0],) for linha in linhas])
+            cursor.executemany(self.SQL_INSERIR, linhas)
+
+    def remover(self, livro_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(self.SQL_REMOVER, [(livro_id,) for livro_id in livro_ids])
+
+    def reconstruir(self, tamanho_lote=5000):
+        from .models import Livro
+
+        with connection.cursor() as cursor:
+            self.criar_indice(cursor)
+            cursor.execute(f"DELETE FROM {TABELA_BUSCA_LIVRO}")
+            lote = []
+            for linha in Livro.objects.values_list('id', 'titulo', 'autor').iterator(chunk_size=tamanho_lote):
+                lote.append(linha)
+                if len(lote) >= tamanho_lote:
+                    cursor.executemany(self.SQL_INSERIR, lote)
+                    lote = []
+            if lote:
+                cursor.executemany(self.SQL_INSERIR, lote)
+
+    def buscar(self, query, limite=LIMITE_RESULTADOS_PADRAO):
+        consulta = self.montar_consulta(query)
+        if not consulta:
+            return []
+        # Mesmo banco do in_bulk que vem depois: numa view @ler_da_replica, a réplica.
+        with connections[banco_de_leitura()].cursor() as cursor:
+            cursor.execute(self.SQL_BUSCAR, [consulta, limite])
+            return [linha[0] for linha in cursor.fetchall()]
+
+
+BACKENDS_POR_BANCO = {
+    'sqlite': BackendFTS5,
+}
+
+_backend = None
+
+
+def obter_backend():
+    # BIBLIOTECA_BUSCA_BACKEND permite plugar outro motor (ex.: full-text do SQL Server).
+    global _backend
+    if _backend is None:
+        caminho = getattr(settings, 'BIBLIOTECA_BUSCA_BACKEND', None)
+        if caminho:
+            _backend = import_string(caminho)()
+        else:
+            _backend = BACKENDS_POR_BANCO.get(connection.vendor, BackendIcontains)()
+    return _backend
+
+
+def limite_busca():
+    return getattr(settings, 'BIBLIOTECA_BUSCA_LIMITE', LIMITE_RESULTADOS_PADRAO)
+
+
+def buscar_ids_livros(query, limite=None):
+    if limite is None:
+        limite = limite_busca()
+    return obter_backend().buscar(query, limite)
+
+
+def buscar_livros(query, limite=None):
+    from .models import Livro
+
+    ids = buscar_ids_livros(query, limite)
+    livros_por_id = Livro.objects.in_bulk(ids)
+    return [livros_por_id[livro_id] for livro_id in ids if livro_id in livros_por_id]
@@ -0,0 +1,260 @@
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+
+from .replicas import ler_do_primario
+
+
+TEMPO_CACHE_PADRAO = 300
+# Muda a cada gravação no catálogo ou nos empréstimos; só entra nos ETags da API.
+CHAVE_VERSAO = 'biblioteca:catalogo:versao'
+# Muda quando pode mudar quais livros aparecem numa listagem (cadastro, exclusão, título, autor).
+CHAVE_VERSAO_LISTAGEM = 'biblioteca:catalogo:listagem:versao'
+CHAVE_VERSAO_USUARIOS = 'biblioteca:usuarios:versao'
+CHAVE_VERSAO_RECOMENDACOES = 'biblioteca:recomendacoes:versao'
+# Contador do cache (não o relógio de cada servidor) que ordena as alterações de livros e as páginas geradas.
+CHAVE_SEQUENCIA = 'biblioteca:catalogo:sequencia'
+CHAVE_ACERTOS = 'biblioteca:catalogo:acertos'
+CHAVE_FALHAS = 'biblioteca:catalogo:falhas'
+
+
+def obter_cache():
+    # Localmente basta o locmem/arquivo; em produção aponte o alias para um cache Redis.
+    return caches[getattr(settings, 'BIBLIOTECA_CACHE_ALIAS', 'default')]
+
+
+def _incrementar(chave):
+    cache = obter_cache()
+    try:
+        return cache.incr(chave)
+    except ValueError:
+        cache.add(chave, 0, timeout=None)
+        return cache.incr(chave)
+
+
+async def _aincrementar(chave):
+    cache = obter_cache()
+    try:
+        return await cache.aincr(chave)
+    except ValueError:
+        await cache.aadd(chave, 0, timeout=None)
+        return await cache.aincr(chave)
+
+
+def _versao_inicial():
+    # Se o cache perder a chave, a contagem recomeça acima de qualquer versão já entregue:
+    # um ETag antigo da API nunca volta a valer.
+    return time.time_ns() // 1000
+
+
+def _trocar_versao(chave):
+    cache = obter_cache()
+    try:
+        cache.incr(chave)
+    except ValueError:
+        cache.add(chave, _versao_inicial(), timeout=None)
+
+
+def versao_atual(chave=CHAVE_VERSAO):
+    cache = obter_cache()
+    versao = cache.get(chave)
+    if versao is None:
+        cache.add(chave, _versao_inicial(), timeout=None)
+        versao = cache.get(chave, 1)
+    return versao
+
+
+async def aversao_atual(chave=CHAVE_VERSAO):
+    cache = obter_cache()
+    versao = await cache.aget(chave)
+    if versao is None:
+        await cache.aadd(chave, _versao_inicial(), timeout=None)
+        versao = await cache.aget(chave, 1)
+    return versao
+
+
+def _proxima_sequencia():
+    cache = obter_cache()
+    try:
+        return cache.incr(CHAVE_SEQUENCIA)
+    except ValueError:
+        cache.add(CHAVE_SEQUENCIA, _versao_inicial(), timeout=None)
+        return cache.incr(CHAVE_SEQUENCIA)
+
+
+def chave_livro(livro_id):
+    return f'biblioteca:catalogo:livro:{livro_id}:alterado_em'
+
+
+def _tempo_cache():
+    return getattr(settings, 'BIBLIOTECA_CACHE_CATALOGO_TIMEOUT', TEMPO_CACHE_PADRAO)
+
+
+def _tempo_marcas():
+    # A marca de um livro vive mais que as páginas que dependem dela; sem ela a página é gerada de novo.
+    return 2 * _tempo_cache()
+
+
+def invalidar_catalogo(livro_ids=None):
+    """Registra, quando a transação atual for confirmada, o que mudou no catálogo.
+
+    Com livro_ids, só as páginas que mostram esses livros deixam de valer; sem, pode ter mudado
+    quais livros cada listagem mostra, e nenhuma página guardada vale mais. Uma lista vazia só
+    troca a versão dos ETags. Nada é apagado: as páginas antigas expiram sozinhas.
+    """
+    ids = None if livro_ids is None else list(livro_ids)
+
+    def registrar():
+        _trocar_versao(CHAVE_VERSAO)
+        if ids is None:
+            _trocar_versao(CHAVE_VERSAO_LISTAGEM)
+        elif ids:
+            marca = _proxima_sequencia()
+            obter_cache().set_many({chave_livro(livro_id): marca for livro_id in ids}, timeout=_tempo_marcas())
+
+    transaction.on_commit(registrar)
+
+
+def invalidar_usuarios():
+    # Só a API JSON usa esta versão (no ETag); o HTML das listas de usuários não é guardado.
+    transaction.on_commit(lambda: _trocar_versao(CHAVE_VERSAO_USUARIOS))
+
+
+def invalidar_recomendacoes():
+    # Também só entra no ETag da API; trocá-la não derruba as páginas do catálogo em cache.
+    transaction.on_commit(lambda: _trocar_versao(CHAVE_VERSAO_RECOMENDACOES))
+
+
+def chave_pagina(request, versao):
+    parametros = sorted((nome, valor) for nome, valores in request.GET.lists() for valor in valores)
+    resumo = hashlib.md5(repr((request.path, parametros)).encode(), usedforsecurity=False).hexdigest()
+    return f'biblioteca:catalogo:v{versao}:{resumo}'
+
+
+def exibir_livros(request, livros):
+    """Anota os livros que a página mostra: pagina_em_cache só a guarda sabendo de quais depende."""
+    request.livros_exibidos = [livro.id for livro in livros]
+    return livros
+
+
+def _chaves_livros(livro_ids):
+    return [chave_livro(livro_id) for livro_id in livro_ids]
+
+
+def _ainda_vale(entrada, marcas):
+    # Nenhum dos livros mudou depois que a página começou a ser gerada. Sem a marca de algum
+    # (expirada ou despejada do cache) não há como saber, e a página é gerada de novo.
+    return len(marcas) == len(entrada['livros']) and all(marca <= entrada['gerada_em'] for marca in marcas.values())
+
+
+def _pode_guardar(request, resposta):
+    # Uma página que usou o token CSRF leva o token deste visitante e pede o cookie dele.
+    return (resposta.status_code == 200 and not resposta.streaming
+            and getattr(request, 'livros_exibidos', None) is not None
+            and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE'))
+
+
+def _entrada(request, resposta, gerada_em):
+    return {
+        'conteudo': resposta.content,
+        'cabecalhos': dict(resposta.items()),
+        'gerada_em': gerada_em,
+        'livros': request.livros_exibidos,
+    }
+
+
+def _resposta_guardada(entrada):
+    resposta = HttpResponse(entrada['conteudo'], headers=entrada['cabecalhos'])
+    resposta['X-Cache'] = 'HIT'
+    return resposta
+
+
+def estatisticas():
+    cache = obter_cache()
+    acertos = cache.get(CHAVE_ACERTOS, 0)
+    falhas = cache.get(CHAVE_FALHAS, 0)
+    total = acertos + falhas
+    return {
+        'versao': versao_atual(CHAVE_VERSAO_LISTAGEM),
+        'acertos': acertos,
+        'falhas': falhas,
+        'taxa_acerto': round(acertos / total, 4) if total else None,
+    }
+
+
+def pagina_em_cache(view):
+    """Guarda o HTML da view para visitantes anônimos, por versão da listagem e query string.
+
+    A view informa com exibir_livros quais livros a página mostra; a página guardada deixa de valer
+    quando um deles muda (invalidar_catalogo com os ids), e as demais continuam no cache. A página
+    que vai para o cache é gerada lendo do primário: uma réplica atrasada deixaria guardada, como
+    atual, uma versão anterior à última alteração.
+    Usuários autenticados veem botões de edição e mensagens, então sempre recebem a página nova.
+    Páginas que usaram o token CSRF não são guardadas. Aceita views síncronas e assíncronas.
+    """
+    tempo_cache = _tempo_cache()
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def _view_async(request, *args, **kwargs):
+            usuario = await request.auser()
+            if request.method != 'GET' or usuario.is_authenticated or 'messages' in request.COOKIES:
+                return await view(request, *args, **kwargs)
+
+            cache = obter_cache()
+            chave = chave_pagina(request, await aversao_atual(CHAVE_VERSAO_LISTAGEM))
+            entrada = await cache.aget(chave)
+            if entrada is not None:
+                if _ainda_vale(entrada, await cache.aget_many(_chaves_livros(entrada['livros']))):
+                    await _aincrementar(CHAVE_ACERTOS)
+                    return _resposta_guardada(entrada)
+
+            await _aincrementar(CHAVE_FALHAS)
+            gerada_em = await aversao_atual(CHAVE_SEQUENCIA)
+            with ler_do_primario():
+                resposta = await view(request, *args, **kwargs)
+            if _pode_guardar(request, resposta):
+                chaves = _chaves_livros(request.livros_exibidos)
+                for chave_ausente in set(chaves) - (await cache.aget_many(chaves)).keys():
+                    await cache.aadd(chave_ausente, gerada_em, timeout=_tempo_marcas())
+                await cache.aset(chave, _entrada(request, resposta, gerada_em), tempo_cache)
+                resposta['X-Cache'] = 'MISS'
+            return resposta
+
+        return markcoroutinefunction(_view_async)
+
+    @wraps(view)
+    def _view(request, *args, **kwargs):
+        if request.method != 'GET' or request.user.is_authenticated or 'messages' in request.COOKIES:
+            return view(request, *args, **kwargs)
+
+        cache = obter_cache()
+        chave = chave_pagina(request, versao_atual(CHAVE_VERSAO_LISTAGEM))
+        entrada = cache.get(chave)
+        if entrada is not None:
+            if _ainda_vale(entrada, cache.get_many(_chaves_livros(entrada['livros']))):
+                _incrementar(CHAVE_ACERTOS)
+                return _resposta_guardada(entrada)
+
+        _incrementar(CHAVE_FALHAS)
+        # A sequência lida antes de gerar: uma alteração registrada durante a geração fica acima dela.
+        gerada_em = versao_atual(CHAVE_SEQUENCIA)
+        with ler_do_primario():
+            resposta = view(request, *args, **kwargs)
+        if _pode_guardar(request, resposta):
+            chaves = _chaves_livros(request.livros_exibidos)
+            # Livro sem marca: a página recém-gerada já o mostra como está, então a marca fica na
+            # sequência dela; add() não passa por cima de uma alteração registrada nesse meio tempo.
+            for chave_ausente in set(chaves) - cache.get_many(chaves).keys():
+                cache.add(chave_ausente, gerada_em, timeout=_tempo_marcas())
+            cache.set(chave, _entrada(request, resposta, gerada_em), tempo_cache)
+            resposta['X-Cache'] = 'MISS'
+        return resposta
+
+    return _view
@@ -0,0 +1,326 @@
+import re
+from collections import Counter, defaultdict, deque
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, PositiveIntegerField, When
+from django.utils import timezone
+
+from .cache_catalogo import invalidar_catalogo
+from .estatisticas import registrar_emprestimos
+from .models import Emprestimo, Exemplar, Livro, Reserva, Usuario
+
+
+PRAZO_EMPRESTIMO = timedelta(days=7)
+MAXIMO_DEVOLUCOES_POR_LOTE = 1000
+# ids por consulta com IN (...): abaixo do limite de 2100 parâmetros do SQL Server.
+IDS_POR_CONSULTA = 500
+
+
+class LivroIndisponivel(Exception):
+    pass
+
+
+class ReservaInvalida(Exception):
+    pass
+
+
+class LoteDevolucaoInvalido(Exception):
+    pass
+
+
+def _retirar_exemplar(livro_id, usuario):
+    # O UPDATE condicional é o próprio compare-and-set: só consegue tirar um exemplar quem
+    # encontra o contador acima de zero, e o bloqueio da linha dura até o fim da transação.
+    # O exemplar separado por uma reserva do usuário vem antes da estante: a retirada conclui a
+    # reserva, e o exemplar da estante continua livre para os outros leitores.
+    reservado = Reserva.objects.filter(
+        livro_id=livro_id, usuario=usuario, status=Reserva.DISPONIVEL,
+    ).update(status=Reserva.ATENDIDA)
+    if not reservado:
+        reservado = Livro.objects.filter(id=livro_id, exemplares_disponiveis__gt=0).update(
+            exemplares_disponiveis=F('exemplares_disponiveis') - 1,
+        )
+    if not reservado:
+        titulo = Livro.objects.filter(id=livro_id).values_list('titulo', flat=True).first()
+        if titulo is None:
+            raise Livro.DoesNotExist(f"Livro {livro_id} não encontrado.")
+        raise LivroIndisponivel(f"O livro '{titulo}' não tem exemplares disponíveis para empréstimo.")
+
+
+def emprestar_livro(livro_id, usuario):
+    agora = timezone.now()
+    with transaction.atomic():
+        _retirar_exemplar(livro_id, usuario)
+        # Carregado uma vez: o sinal das estatísticas lê o gênero e a view o título daqui.
+        return Emprestimo.objects.create(
+            livro=Livro.objects.get(id=livro_id),
+            usuario=usuario,
+            data_emprestimo=agora,
+            data_devolucao_prevista=agora + PRAZO_EMPRESTIMO,
+            devolvido=False
+        )
+
+
+def alterar_emprestimo(emprestimo, livro, usuario, devolvido):
+    """Grava a edição de um empréstimo acertando exemplares e reservas, como um empréstimo e uma devolução fariam.
+
+    Trocar o livro de um empréstimo ativo devolve o exemplar antigo (que pode ir para a fila de reservas) e
+    retira um do livro novo; desmarcar a devolução retira um exemplar de novo. Levanta LivroIndisponivel
+    se o livro não tiver exemplar para isso.
+    """
+    with transaction.atomic():
+        # Relido com trava: uma devolução concorrente não pode fazer o exemplar ser devolvido duas vezes.
+        atual = Emprestimo.objects.select_for_update().filter(pk=emprestimo.pk).values('devolvido', 'livro_id').get()
+        ativo = not atual['devolvido']
+        if ativo and livro.id != atual['livro_id']:
+            _retirar_exemplar(livro.id, usuario)
+            Livro(id=atual['livro_id']).liberar()
+        elif not ativo and not devolvido:
+            _retirar_exemplar(livro.id, usuario)
+            emprestimo.data_devolucao = None
+        # A devolução de um empréstimo ativo fica para marcar_como_devolvido; sem outra mudança, não há o que gravar.
+        novo = (livro.id, usuario.id, not ativo and devolvido)
+        if novo != (atual['livro_id'], emprestimo.usuario_id, not ativo):
+            emprestimo.livro = livro
+            emprestimo.usuario = usuario
+            emprestimo.devolvido = novo[2]
+            emprestimo.save()
+        if ativo and devolvido:
+            emprestimo.marcar_como_devolvido()
+    return emprestimo
+
+
+def reservar_livro(livro_id, usuario):
+    """Coloca o usuário no fim da fila de espera de um livro emprestado."""
+    livro = Livro.objects.filter(id=livro_id).only('titulo', 'exemplares_disponiveis').first()
+    if livro is None:
+        raise Livro.DoesNotExist(f"Livro {livro_id} não encontrado.")
+    if livro.disponivel:
+        raise ReservaInvalida(f"O livro '{livro.titulo}' tem exemplares disponíveis; não é preciso reservá-lo.")
+    if Emprestimo.objects.filter(livro_id=livro_id, usuario=usuario, devolvido=False).exists():
+        raise ReservaInvalida(f"O livro '{livro.titulo}' já está emprestado para você.")
+    try:
+        with transaction.atomic():
+            return Reserva.objects.create(livro=livro, usuario=usuario)
+    except IntegrityError:
+        raise ReservaInvalida(f"Você já tem uma reserva aberta para '{livro.titulo}'.")
+
+
+class ItemDevolucao:
+    """Resultado de um identificador do lote de devolução."""
+    EMPRESTIMO = 'emprestimo'
+    LIVRO = 'livro'
+
+    DEVOLVIDO = 'devolvido'
+    JA_DEVOLVIDO = 'ja_devolvido'
+    SEM_EMPRESTIMO_ATIVO = 'sem_emprestimo_ativo'
+    NAO_ENCONTRADO = 'nao_encontrado'
+    REPETIDO = 'repetido'
+    INVALIDO = 'invalido'
+
+    def __init__(self, identificador, tipo):
+        self.identificador = str(identificador).strip()
+        self.tipo = tipo
+        self.situacao = None
+        self.mensagem = ''
+        self.emprestimo_id = None
+        self.livro_id = None
+        self.reserva_id = None
+
+    @property
+    def devolvido(self):
+        return self.situacao == self.DEVOLVIDO
+
+    def concluir(self, situacao, mensagem):
+        self.situacao = situacao
+        self.mensagem = mensagem
+
+    def como_dict(self):
+        return {
+            'identificador': self.identificador,
+            'tipo': self.tipo,
+            'situacao': self.situacao,
+            'mensagem': self.mensagem,
+            'emprestimo_id': self.emprestimo_id,
+            'reserva_id': self.reserva_id,
+        }
+
+
+def _em_partes(ids):
+    ids = list(ids)
+    for inicio in range(0, len(ids), IDS_POR_CONSULTA):
+        yield ids[inicio:inicio + IDS_POR_CONSULTA]
+
+
+def _numero(texto):
+    # Só dígitos ASCII (isdigit() aceita '²') e no máximo 18, para caber num BIGINT.
+    return int(texto) if re.fullmatch(r'\d{1,18}', texto, re.ASCII) else None
+
+
+def _resolver_emprestimos(itens, por_emprestimo):
+    for item in itens:
+        emprestimo_id = _numero(item.identificador)
+        if emprestimo_id is None:
+            item.concluir(item.INVALIDO, "Número de empréstimo inválido.")
+        elif emprestimo_id in por_emprestimo:
+            item.concluir(item.REPETIDO, f"O empréstimo {emprestimo_id} já aparece no lote.")
+        else:
+            item.emprestimo_id = emprestimo_id
+            por_emprestimo[emprestimo_id] = item
+
+
+def _resolver_livros(itens, por_emprestimo):
+    # Código de tombo primeiro; um número que não é tombo de nenhum exemplar é tratado como id do livro.
+    livro_por_codigo = {}
+    for parte in _em_partes({item.identificador for item in itens}):
+        livro_por_codigo.update(Exemplar.objects.filter(codigo__in=parte).values_list('codigo', 'livro_id'))
+    for item in itens:
+        item.livro_id = livro_por_codigo.get(item.identificador) or _numero(item.identificador)
+        if item.livro_id is None:
+            item.concluir(item.NAO_ENCONTRADO, "Nenhum exemplar com este código de tombo.")
+
+    # Cada ocorrência do livro devolve o empréstimo ativo mais antigo que ainda não está no lote.
+    ativos = defaultdict(deque)
+    livro_ids = {item.livro_id for item in itens if item.livro_id is not None}
+    for parte in _em_partes(livro_ids):
+        emprestimos = (
+            Emprestimo.objects.filter(livro_id__in=parte, devolvido=False)
+            .order_by('data_emprestimo', 'id').values_list('livro_id', 'id')
+        )
+        for livro_id, emprestimo_id in emprestimos:
+            if emprestimo_id not in por_emprestimo:
+                ativos[livro_id].append(emprestimo_id)
+
+    sem_emprestimo = []
+    for item in itens:
+        if item.situacao is not None:
+            continue
+        if ativos[item.livro_id]:
+            item.emprestimo_id = ativos[item.livro_id].popleft()
+            por_emprestimo[item.emprestimo_id] = item
+        else:
+            sem_emprestimo.append(item)
+    existentes = set()
+    for parte in _em_partes({item.livro_id for item in sem_emprestimo}):
+        existentes.update(Livro.objects.filter(id__in=parte).values_list('id', flat=True))
+    for item in sem_emprestimo:
+        if item.livro_id in existentes:
+            item.concluir(item.SEM_EMPRESTIMO_ATIVO, "O livro não tem (mais) empréstimos ativos para devolver.")
+        else:
+            item.concluir(item.NAO_ENCONTRADO, "Livro não encontrado.")
+
+
+def _fechar_emprestimos(por_emprestimo, agora):
+    emprestimos = []
+    for parte in _em_partes(por_emprestimo):
+        # Só as linhas de Emprestimo ficam travadas; livros e usuários vêm em consultas à parte.
+        emprestimos.extend(
+            Emprestimo.objects.select_for_update().filter(id__in=parte)
+            .only('livro', 'usuario', 'data_emprestimo', 'data_devolucao', 'data_devolucao_prevista', 'devolvido')
+        )
+    livros = {}
+    usuarios = {}
+    # todos: um exemplar de livro ou leitor com exclusão pendente ainda pode voltar à biblioteca.
+    for parte in _em_partes({emprestimo.livro_id for emprestimo in emprestimos}):
+        livros.update(Livro.todos.only('titulo', 'genero').in_bulk(parte))
+    for parte in _em_partes({emprestimo.usuario_id for emprestimo in emprestimos}):
+        usuarios.update(Usuario.todos.only('reader_name').in_bulk(parte))
+
+    devolvidos, no_prazo_minimo = [], []
+    for emprestimo in emprestimos:
+        emprestimo.livro = livros[emprestimo.livro_id]
+        emprestimo.usuario = usuarios[emprestimo.usuario_id]
+        item = por_emprestimo[emprestimo.id]
+        if emprestimo.devolvido:
+            item.concluir(item.JA_DEVOLVIDO, "Este empréstimo já foi marcado como devolvido.")
+            continue
+        emprestimo.data_devolucao = emprestimo.momento_da_devolucao(agora)
+        emprestimo.devolvido = True
+        devolvidos.append(emprestimo)
+        if emprestimo.data_devolucao != agora:
+            no_prazo_minimo.append(emprestimo)
+        item.concluir(
+            item.DEVOLVIDO,
+            f"Livro '{emprestimo.livro.titulo}' devolvido com sucesso por {emprestimo.usuario.reader_name}.",
+        )
+    for item in por_emprestimo.values():
+        if item.situacao is None:
+            item.concluir(item.NAO_ENCONTRADO, "Empréstimo não encontrado.")
+
+    # Quase todos saem com data_devolucao = agora num UPDATE só; os de menos de um minuto, com bulk_update.
+    comuns = [emprestimo.id for emprestimo in devolvidos if emprestimo.data_devolucao == agora]
+    for parte in _em_partes(comuns):
+        Emprestimo.objects.filter(id__in=parte, devolvido=False).update(devolvido=True, data_devolucao=agora)
+    if no_prazo_minimo:
+        Emprestimo.objects.bulk_update(no_prazo_minimo, ['devolvido', 'data_devolucao'], batch_size=IDS_POR_CONSULTA)
+    return devolvidos
+
+
+def _liberar_exemplares(devolvidos, por_emprestimo, agora):
+    # Livro.liberar em conjunto: cada exemplar vai primeiro para a fila de reservas, o resto volta à estante.
+    por_livro = Counter(emprestimo.livro_id for emprestimo in devolvidos)
+    separadas = defaultdict(list)
+    for parte in _em_partes(por_livro):
+        fila = (
+            Reserva.objects.select_for_update().filter(livro_id__in=parte, status=Reserva.AGUARDANDO)
+            .order_by('data_reserva', 'id').values_list('id', 'livro_id')
+        )
+        for reserva_id, livro_id in fila:
+            if len(separadas[livro_id]) < por_livro[livro_id]:
+                separadas[livro_id].append(reserva_id)
+
+    reserva_ids = [reserva_id for ids in separadas.values() for reserva_id in ids]
+    leitores = {}
+    for parte in _em_partes(reserva_ids):
+        Reserva.objects.filter(id__in=parte).update(status=Reserva.DISPONIVEL, data_disponibilizacao=agora)
+        leitores.update(Reserva.objects.filter(id__in=parte).values_list('id', 'usuario__reader_name'))
+    for emprestimo in devolvidos:
+        if separadas[emprestimo.livro_id]:
+            item = por_emprestimo[emprestimo.id]
+            item.reserva_id = separadas[emprestimo.livro_id].pop(0)
+            item.mensagem += f" Separado para a reserva de {leitores[item.reserva_id]}."
+            por_livro[emprestimo.livro_id] -= 1
+
+    # Um UPDATE por quantidade devolvida (quase sempre 1), limitado ao total como em Livro.liberar.
+    por_quantidade = defaultdict(list)
+    for livro_id, quantidade in por_livro.items():
+        if quantidade:
+            por_quantidade[quantidade].append(livro_id)
+    for quantidade, livro_ids in por_quantidade.items():
+        for parte in _em_partes(livro_ids):
+            Livro.objects.filter(id__in=parte).update(exemplares_disponiveis=Case(
+                When(exemplares_disponiveis__lte=F('total_exemplares') - quantidade,
+                     then=F('exemplares_disponiveis') + quantidade),
+                default=F('total_exemplares'),
+                output_field=PositiveIntegerField(),
+            ))
+
+
+def devolver_em_lote(emprestimos=(), livros=(), agora=None):
+    """Devolve de uma vez os itens da caixa de devolução: um ItemDevolucao por identificador, na ordem recebida.
+
+    emprestimos são ids de empréstimo; livros, códigos de tombo ou ids de livro, e cada ocorrência devolve
+    o empréstimo ativo mais antigo do livro. Numa transação só e com UPDATEs em conjunto, que gravam apenas
+    devolvido, data_devolucao e os contadores, com as mesmas regras de marcar_como_devolvido e Livro.liberar.
+    """
+    agora = agora or timezone.now()
+    itens_emprestimo = [ItemDevolucao(identificador, ItemDevolucao.EMPRESTIMO) for identificador in emprestimos]
+    itens_livro = [ItemDevolucao(identificador, ItemDevolucao.LIVRO) for identificador in livros]
+    itens = [item for item in itens_emprestimo + itens_livro if item.identificador]
+    if not itens:
+        raise LoteDevolucaoInvalido("Informe ao menos um empréstimo ou livro para devolver.")
+    if len(itens) > MAXIMO_DEVOLUCOES_POR_LOTE:
+        raise LoteDevolucaoInvalido(f"Devolva no máximo {MAXIMO_DEVOLUCOES_POR_LOTE} itens por lote.")
+
+    por_emprestimo = {}
+    with transaction.atomic():
+        _resolver_emprestimos([item for item in itens if item.tipo == ItemDevolucao.EMPRESTIMO], por_emprestimo)
+        _resolver_livros([item for item in itens if item.tipo == ItemDevolucao.LIVRO], por_emprestimo)
+        devolvidos = _fechar_emprestimos(por_emprestimo, agora)
+        if devolvidos:
+            _liberar_exemplares(devolvidos, por_emprestimo, agora)
+            # update() e bulk_update não disparam os sinais de Emprestimo.
+            registrar_emprestimos(devolvidos)
+            invalidar_catalogo({emprestimo.livro_id for emprestimo in devolvidos})
+    return itens
@@ -0,0 +1,162 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from .busca import obter_backend
+from .cache_catalogo import invalidar_catalogo, invalidar_usuarios
+from .circulacao import PRAZO_EMPRESTIMO
+from .estatisticas import recalcular_estatisticas
+from .models import Emprestimo, Exemplar, Livro, Usuario
+
+
+TAMANHO_LOTE_PADRAO = 10000
+
+PALAVRAS_TITULO = [
+    'memórias', 'póstumas', 'dom', 'casmurro', 'grande', 'sertão', 'veredas', 'vidas', 'secas',
+    'capitães', 'areia', 'hora', 'estrela', 'cortiço', 'iracema', 'senhora', 'menino', 'engenho',
+    'ensaio', 'cegueira', 'história', 'noite', 'mar', 'cidade', 'sol', 'coração', 'caminho', 'tempo',
+]
+NOMES = ['Ana', 'João', 'Maria', 'José', 'Francisca', 'Antônio', 'Luiza', 'Carlos', 'Paula', 'Pedro']
+SOBRENOMES = ['Silva', 'Santos', 'Oliveira', 'Souza', 'Lima', 'Pereira', 'Ferreira', 'Costa', 'Rodrigues']
+GENEROS = ['Romance', 'Poesia', 'Conto', 'Ensaio', 'Biografia', 'Infantil', 'Técnico', 'História']
+
+# Distribuição dos empréstimos gerados.
+JANELA_HISTORICO = timedelta(days=730)
+CHANCE_ATIVO_RECENTE = 0.35      # empréstimos dos últimos 30 dias ainda não devolvidos
+CHANCE_ATIVO_ANTIGO = 0.02       # empréstimos mais velhos esquecidos (viram atrasados)
+CHANCE_DEVOLUCAO_ATRASADA = 0.15
+
+
+@contextmanager
+def _sem_auto_now_add(modelo, nome_campo):
+    # bulk_create respeita auto_now_add; aqui queremos gravar datas no passado.
+    campo = modelo._meta.get_field(nome_campo)
+    original = campo.auto_now_add
+    campo.auto_now_add = False
+    try:
+        yield
+    finally:
+        campo.auto_now_add = original
+
+
+def _em_lotes(gerador, tamanho):
+    lote = []
+    for item in gerador:
+        lote.append(item)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def gerar_livros(quantidade, aleatorio, tamanho_lote=TAMANHO_LOTE_PADRAO, ao_progresso=None):
+    backend = obter_backend()
+    livros = (
+        Livro(
+            titulo=' '.join(aleatorio.choices(PALAVRAS_TITULO, k=aleatorio.randint(1, 4))).capitalize(),
+            autor=f"{aleatorio.choice(NOMES)} {aleatorio.choice(SOBRENOMES)}",
+            ano_publicacao=aleatorio.randint(1850, 2025),
+            genero=aleatorio.choice(GENEROS),
+            total_exemplares=1,
+            exemplares_disponiveis=1,
+        )
+        for _ in range(quantidade)
+    )
+    criados = 0
+    for lote in _em_lotes(livros, tamanho_lote):
+        with transaction.atomic():
+            Livro.objects.bulk_create(lote)
+            com_id = [livro for livro in lote if livro.id is not None]
+            Exemplar.objects.bulk_create(Exemplar(livro=livro) for livro in com_id)
+            backend.indexar(com_id)
+        criados += len(lote)
+        if ao_progresso:
+            ao_progresso('livros', criados)
+
+
+def gerar_usuarios(quantidade, aleatorio, tamanho_lote=TAMANHO_LOTE_PADRAO, ao_progresso=None):
+    # Todos recebem a mesma senha inutilizável: calcular um hash por usuário levaria horas.
+    senha = make_password(None)
+    inicio = Usuario.objects.count()
+    usuarios = (
+        Usuario(
+            login=f'leitor{inicio + i}',
+            email=f'leitor{inicio + i}@exemplo.org',
+            reader_name=f"{aleatorio.choice(NOMES)} {aleatorio.choice(SOBRENOMES)} {aleatorio.choice(SOBRENOMES)}",
+            reader_contact=f'({aleatorio.randint(11, 99)}) 9{aleatorio.randint(10000000, 99999999)}',
+            password=senha,
+        )
+        for i in range(quantidade)
+    )
+    criados = 0
+    for lote in _em_lotes(usuarios, tamanho_lote):
+        Usuario.objects.bulk_create(lote)
+        criados += len(lote)
+        if ao_progresso:
+            ao_progresso('usuarios', criados)
+
+
+def gerar_emprestimos(quantidade, aleatorio, tamanho_lote=TAMANHO_LOTE_PADRAO, ao_progresso=None):
+    livro_ids = list(Livro.objects.filter(exemplares_disponiveis=1, total_exemplares=1).values_list('id', flat=True))
+    usuario_ids = list(Usuario.objects.values_list('id', flat=True))
+    if not livro_ids or not usuario_ids:
+        return
+
+    agora = timezone.now()
+    janela_segundos = int(JANELA_HISTORICO.total_seconds())
+    # Os livros gerados têm um exemplar só: os empréstimos ativos saem de uma fila embaralhada.
+    livres = livro_ids[:]
+    aleatorio.shuffle(livres)
+    emprestados = []
+
+    def emprestimo():
+        data_emprestimo = agora - timedelta(seconds=aleatorio.randint(0, janela_segundos))
+        prevista = data_emprestimo + PRAZO_EMPRESTIMO
+        recente = agora - data_emprestimo < timedelta(days=30)
+        ativo = aleatorio.random() < (CHANCE_ATIVO_RECENTE if recente else CHANCE_ATIVO_ANTIGO)
+        if ativo and livres:
+            livro_id = livres.pop()
+            emprestados.append(livro_id)
+            return Emprestimo(
+                livro_id=livro_id, usuario_id=aleatorio.choice(usuario_ids), data_emprestimo=data_emprestimo,
+                data_devolucao_prevista=prevista, devolvido=False,
+            )
+        if aleatorio.random() < CHANCE_DEVOLUCAO_ATRASADA:
+            devolucao = prevista + timedelta(hours=aleatorio.expovariate(1 / 96))
+        else:
+            devolucao = data_emprestimo + timedelta(hours=aleatorio.uniform(1, PRAZO_EMPRESTIMO.total_seconds() / 3600))
+        return Emprestimo(
+            livro_id=aleatorio.choice(livro_ids), usuario_id=aleatorio.choice(usuario_ids),
+            data_emprestimo=data_emprestimo, data_devolucao_prevista=prevista,
+            data_devolucao=min(devolucao, agora), devolvido=True,
+        )
+
+    criados = 0
+    with _sem_auto_now_add(Emprestimo, 'data_emprestimo'):
+        for lote in _em_lotes((emprestimo() for _ in range(quantidade)), tamanho_lote):
+            with transaction.atomic():
+                Emprestimo.objects.bulk_create(lote)
+                for inicio in range(0, len(emprestados), 500):
+                    Livro.objects.filter(id__in=emprestados[inicio:inicio + 500]).update(exemplares_disponiveis=0)
+            emprestados.clear()
+            criados += len(lote)
+            if ao_progresso:
+                ao_progresso('emprestimos', criados)
+
+
+def gerar_dados(livros=0, usuarios=0, emprestimos=0, semente=None, tamanho_lote=TAMANHO_LOTE_PADRAO,
+                ao_progresso=None):
+    aleatorio = random.Random(semente)
+    gerar_livros(livros, aleatorio, tamanho_lote, ao_progresso)
+    gerar_usuarios(usuarios, aleatorio, tamanho_lote, ao_progresso)
+    gerar_emprestimos(emprestimos, aleatorio, tamanho_lote, ao_progresso)
+    # bulk_create não dispara os sinais que mantêm as estatísticas.
+    if emprestimos:
+        recalcular_estatisticas()
+    invalidar_catalogo()
+    invalidar_usuarios()
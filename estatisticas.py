@@ -0,0 +1,285 @@
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import (
+    Emprestimo, EmprestimoArquivado, EstatisticaDiaria, EstatisticaGenero, EstatisticaLivro, EstatisticaUsuario, Livro,
+)
+
+
+# Ordem fixa de atualização: duas transações concorrentes travam as linhas na mesma sequência.
+TABELAS = (EstatisticaDiaria, EstatisticaLivro, EstatisticaUsuario, EstatisticaGenero)
+CAMPOS_DIA = ('emprestimos', 'devolucoes', 'vencimentos_pendentes')
+CAMPOS_CONTAGEM = ('emprestimos', 'ativos')
+# As estatísticas cobrem o histórico inteiro, inclusive o que arquivo.py já tirou de Emprestimo.
+MODELOS_CONTADOS = (Emprestimo, EmprestimoArquivado)
+# Chaves por UPDATE ... WHERE pk IN (...): abaixo do limite de 2100 parâmetros do SQL Server.
+CHAVES_POR_UPDATE = 500
+
+
+class _LinhasFaltando(Exception):
+    pass
+
+
+def _dia(momento):
+    # Dias em UTC, os mesmos de calcular_multa e de Emprestimo.objects.vencidos().
+    return momento.astimezone(dt_timezone.utc).date()
+
+
+def _genero(livro_id, emprestimo, generos):
+    if livro_id not in generos:
+        if Emprestimo.livro.is_cached(emprestimo) and emprestimo.livro.id == livro_id:
+            generos[livro_id] = emprestimo.livro.genero
+        else:
+            generos[livro_id] = Livro.todos.filter(id=livro_id).values_list('genero', flat=True).first() or ''
+    return generos[livro_id]
+
+
+def _acumular(incrementos, valores, genero, sinal):
+    livro_id, usuario_id, data_emprestimo, data_devolucao, data_devolucao_prevista, devolvido = valores
+    incrementos[(EstatisticaDiaria, _dia(data_emprestimo))]['emprestimos'] += sinal
+    if devolvido and data_devolucao:
+        incrementos[(EstatisticaDiaria, _dia(data_devolucao))]['devolucoes'] += sinal
+    if not devolvido and data_devolucao_prevista:
+        incrementos[(EstatisticaDiaria, _dia(data_devolucao_prevista))]['vencimentos_pendentes'] += sinal
+    for tabela, chave in ((EstatisticaLivro, livro_id), (EstatisticaUsuario, usuario_id), (EstatisticaGenero, genero)):
+        incrementos[(tabela, chave)]['emprestimos'] += sinal
+        if not devolvido:
+            incrementos[(tabela, chave)]['ativos'] += sinal
+
+
+def _somar(tabela, chave, incrementos):
+    expressoes = {campo: F(campo) + valor for campo, valor in incrementos.items()}
+    if tabela.objects.filter(pk=chave).update(**expressoes):
+        return
+    if any(valor < 0 for valor in incrementos.values()):
+        # Sem a linha, um desconto só pode vir de estatísticas ainda não calculadas; recalcular_estatisticas acerta.
+        return
+    try:
+        with transaction.atomic():
+            tabela.objects.create(pk=chave, **incrementos)
+    except IntegrityError:
+        tabela.objects.filter(pk=chave).update(**expressoes)
+
+
+def _somar_em_conjunto(tabela, chaves, incrementos):
+    # Devoluções em lote: as linhas que recebem o mesmo incremento saem num UPDATE só.
+    expressoes = {campo: F(campo) + valor for campo, valor in incrementos.items()}
+    try:
+        with transaction.atomic():
+            atualizadas = sum(
+                tabela.objects.filter(pk__in=chaves[inicio:inicio + CHAVES_POR_UPDATE]).update(**expressoes)
+                for inicio in range(0, len(chaves), CHAVES_POR_UPDATE)
+            )
+            if atualizadas < len(chaves):
+                raise _LinhasFaltando
+    except _LinhasFaltando:
+        # Alguma linha ainda não existe: desfaz e segue linha a linha, que sabe criá-las.
+        for chave in chaves:
+            _somar(tabela, chave, incrementos)
+
+
+def _aplicar_depois_do_commit(incrementos):
+    # A linha do dia e a do gênero são as mesmas para todos os empréstimos: somadas dentro da transação
+    # do empréstimo, ficariam travadas até o commit dele. Depois do commit, cada soma é uma transação curta.
+    # Se a soma falhar (ou o processo cair antes dela), o empréstimo continua gravado e
+    # recalcular_estatisticas acerta as tabelas.
+    transaction.on_commit(lambda: _aplicar(incrementos), robust=True)
+
+
+def _aplicar(incrementos):
+    ordem = {tabela: posicao for posicao, tabela in enumerate(TABELAS)}
+    grupos = defaultdict(list)
+    for (tabela, chave), campos in incrementos.items():
+        valores = tuple(sorted((campo, valor) for campo, valor in campos.items() if valor))
+        if valores:
+            grupos[(tabela, valores)].append(chave)
+    with transaction.atomic(savepoint=False):
+        for (tabela, valores), chaves in sorted(grupos.items(), key=lambda item: (ordem[item[0][0]], item[0][1])):
+            chaves.sort(key=str)
+            if len(chaves) == 1:
+                _somar(tabela, chaves[0], dict(valores))
+            else:
+                _somar_em_conjunto(tabela, chaves, dict(valores))
+
+
+def carregar_contado(emprestimo):
+    """Para empréstimos salvos sem terem vindo do banco (ou com campos adiados): lê o que já estava contado."""
+    if getattr(emprestimo, '_contado', None) is None and emprestimo.pk is not None:
+        emprestimo._contado = (
+            type(emprestimo).objects.filter(pk=emprestimo.pk).values_list(*Emprestimo.CAMPOS_ESTATISTICAS).first()
+        )
+
+
+def registrar_emprestimo(emprestimo, removido=False):
+    """Aplica às tabelas de estatísticas a diferença entre o que o empréstimo contava e o que conta agora.
+
+    Chamado pelos sinais de Emprestimo: criação (empréstimo), save (devolução, edição) e exclusão.
+    A diferença é calculada na hora e somada às tabelas quando a transação for confirmada.
+    Alterações feitas com QuerySet.update() não passam por aqui; use recalcular_estatisticas.
+    """
+    registrar_emprestimos([emprestimo], removido)
+
+
+def registrar_emprestimos(emprestimos, removido=False):
+    """registrar_emprestimo para vários empréstimos gravados com update()/bulk_update, somando as diferenças."""
+    generos = {}
+    incrementos = defaultdict(lambda: defaultdict(int))
+    alterados = []
+    for emprestimo in emprestimos:
+        anterior = getattr(emprestimo, '_contado', None)
+        atual = None if removido else emprestimo.valores_estatisticas()
+        if removido and anterior is None:
+            anterior = emprestimo.valores_estatisticas()
+        if anterior == atual:
+            continue
+        if anterior is not None:
+            _acumular(incrementos, anterior, _genero(anterior[0], emprestimo, generos), -1)
+        if atual is not None:
+            _acumular(incrementos, atual, _genero(atual[0], emprestimo, generos), 1)
+        alterados.append((emprestimo, atual))
+    if alterados:
+        _aplicar_depois_do_commit(incrementos)
+    for emprestimo, atual in alterados:
+        emprestimo._contado = atual
+
+
+def mover_genero(livro):
+    """Quando o gênero de um livro muda, os empréstimos dele passam a contar no gênero novo."""
+    anterior = getattr(livro, '_genero_carregado', None)
+    livro._genero_carregado = livro.genero
+    if anterior is None or anterior == livro.genero:
+        return
+    livro_id, genero = livro.pk, livro.genero
+
+    def mover():
+        # Depois do commit, na fila dos empréstimos da mesma transação: a contagem lida já inclui as somas deles.
+        contagem = EstatisticaLivro.objects.filter(pk=livro_id).values(*CAMPOS_CONTAGEM).first()
+        if not contagem or not any(contagem.values()):
+            return
+        incrementos = defaultdict(lambda: defaultdict(int))
+        for campo, valor in contagem.items():
+            incrementos[(EstatisticaGenero, anterior)][campo] -= valor
+            incrementos[(EstatisticaGenero, genero)][campo] += valor
+        _aplicar(incrementos)
+
+    transaction.on_commit(mover, robust=True)
+
+
+def calcular_do_zero():
+    """As linhas de cada tabela, calculadas com GROUP BY sobre os empréstimos: {tabela: iterável de (chave, campos)}."""
+    dias = defaultdict(lambda: dict.fromkeys(CAMPOS_DIA, 0))
+    por_dia = (
+        ('data_emprestimo', Q(), 'emprestimos'),
+        ('data_devolucao', Q(devolvido=True, data_devolucao__isnull=False), 'devolucoes'),
+        ('data_devolucao_prevista', Q(devolvido=False, data_devolucao_prevista__isnull=False), 'vencimentos_pendentes'),
+    )
+    for modelo in MODELOS_CONTADOS:
+        for campo_data, filtro, coluna in por_dia:
+            linhas = (
+                modelo.objects.filter(filtro).order_by()
+                .values(dia=TruncDate(campo_data, tzinfo=dt_timezone.utc)).annotate(total=Count('id'))
+            )
+            for linha in linhas:
+                dias[linha['dia']][coluna] += linha['total']
+
+    contagem = {'emprestimos': Count('id'), 'ativos': Count('id', filter=Q(devolvido=False))}
+
+    def agrupar(campo):
+        totais = defaultdict(lambda: dict.fromkeys(CAMPOS_CONTAGEM, 0))
+        for modelo in MODELOS_CONTADOS:
+            for linha in modelo.objects.order_by().values(campo).annotate(**contagem).iterator():
+                for nome in CAMPOS_CONTAGEM:
+                    totais[linha[campo]][nome] += linha[nome]
+        return totais.items()
+
+    return {
+        EstatisticaDiaria: dias.items(),
+        EstatisticaLivro: agrupar('livro_id'),
+        EstatisticaUsuario: agrupar('usuario_id'),
+        EstatisticaGenero: agrupar('livro__genero'),
+    }
+
+
+def _campos(tabela):
+    return CAMPOS_DIA if tabela is EstatisticaDiaria else CAMPOS_CONTAGEM
+
+
+def recalcular_estatisticas(tamanho_lote=5000):
+    """Apaga as tabelas de estatísticas e as preenche de novo a partir de todos os empréstimos."""
+    with transaction.atomic():
+        # Trava as linhas de gênero: empréstimos e devoluções concorrentes esperam a recontagem terminar.
+        list(EstatisticaGenero.objects.select_for_update().values_list('pk', flat=True))
+        totais = {}
+        for tabela, linhas in calcular_do_zero().items():
+            tabela.objects.all().delete()
+            linhas = iter(linhas)
+            totais[tabela] = 0
+            while lote := list(islice(linhas, tamanho_lote)):
+                tabela.objects.bulk_create(tabela(pk=chave, **campos) for chave, campos in lote)
+                totais[tabela] += len(lote)
+    return totais
+
+
+def divergencias(limite=50):
+    """Diferenças entre as tabelas mantidas por evento e uma recontagem do zero: [(tabela, chave, atual, esperado)]."""
+    encontradas = []
+    for tabela, linhas in calcular_do_zero().items():
+        campos = _campos(tabela)
+        atuais = {linha.pop('pk'): linha for linha in tabela.objects.values('pk', *campos)}
+        vazio = dict.fromkeys(campos, 0)
+        for chave, esperado in linhas:
+            atual = atuais.pop(chave, vazio)
+            if atual != esperado:
+                encontradas.append((tabela.__name__, chave, atual, esperado))
+        encontradas.extend((tabela.__name__, chave, atual, vazio) for chave, atual in atuais.items() if atual != vazio)
+    return encontradas[:limite]
+
+
+def resumo_circulacao(agora=None, dias=14, quantidade=5, incluir_leitores=False):
+    """Números do painel da página inicial; cada um é uma consulta pequena nas tabelas de estatísticas."""
+    hoje = _dia(agora or timezone.now())
+    totais = EstatisticaGenero.objects.aggregate(
+        emprestimos=Coalesce(Sum('emprestimos'), 0), ativos=Coalesce(Sum('ativos'), 0),
+    )
+    em_atraso = EstatisticaDiaria.objects.filter(data__lt=hoje).aggregate(
+        total=Coalesce(Sum('vencimentos_pendentes'), 0),
+    )['total']
+
+    inicio = hoje - timedelta(days=dias - 1)
+    registrados = {dia.data: dia for dia in EstatisticaDiaria.objects.filter(data__gte=inicio, data__lte=hoje)}
+    movimento = []
+    for deslocamento in range(dias):
+        data = inicio + timedelta(days=deslocamento)
+        dia = registrados.get(data)
+        movimento.append({
+            'data': data,
+            'emprestimos': dia.emprestimos if dia else 0,
+            'devolucoes': dia.devolucoes if dia else 0,
+        })
+    maior = max([max(dia['emprestimos'], dia['devolucoes']) for dia in movimento] + [1])
+    for dia in movimento:
+        dia['percentual_emprestimos'] = round(100 * dia['emprestimos'] / maior)
+        dia['percentual_devolucoes'] = round(100 * dia['devolucoes'] / maior)
+
+    resumo = {
+        'total_emprestimos': totais['emprestimos'],
+        'emprestimos_ativos': totais['ativos'],
+        'em_atraso': em_atraso,
+        'hoje': movimento[-1],
+        'movimento': movimento,
+        'mais_emprestados': list(
+            EstatisticaLivro.objects.filter(emprestimos__gt=0, livro__excluido_em__isnull=True).select_related('livro').order_by('-emprestimos')[:quantidade]
+        ),
+        'generos': list(EstatisticaGenero.objects.filter(emprestimos__gt=0).order_by('-emprestimos')[:quantidade]),
+    }
+    if incluir_leitores:
+        resumo['leitores'] = list(
+            EstatisticaUsuario.objects.filter(emprestimos__gt=0, usuario__excluido_em__isnull=True).select_related('usuario').order_by('-emprestimos')[:quantidade]
+        )
+    return resumo
@@ -0,0 +1,161 @@
+import time
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .busca import obter_backend
+from .estatisticas import MODELOS_CONTADOS, registrar_emprestimos
+from .models import Emprestimo, EmprestimoArquivado, Exclusao, Exemplar, Livro, Reserva, Usuario
+
+
+TAMANHO_LOTE_PADRAO = 1000
+# ids por consulta com IN (...): abaixo do limite de 2100 parâmetros do SQL Server.
+IDS_POR_CONSULTA = 500
+
+MODELOS = {
+    Exclusao.LIVRO: Livro,
+    Exclusao.USUARIO: Usuario,
+}
+# Tabelas apagadas em lotes antes do registro; o delete() final só encontra o que sobra (estatística, grupos).
+DEPENDENTES = {
+    Exclusao.LIVRO: ((Emprestimo, 'livro_id'), (EmprestimoArquivado, 'livro_id'), (Reserva, 'livro_id'),
+                     (Exemplar, 'livro_id')),
+    Exclusao.USUARIO: ((Emprestimo, 'usuario_id'), (EmprestimoArquivado, 'usuario_id'), (Reserva, 'usuario_id')),
+}
+
+
+class ExclusaoRecusada(Exception):
+    pass
+
+
+class ResultadoExpurgo:
+    def __init__(self):
+        self.exclusoes = 0
+        self.registros = 0
+
+
+def apagar_sem_sinais(modelo, ids):
+    """DELETE ... WHERE id IN (...) direto, sem o Collector nem pre/post_delete.
+
+    Só para tabelas que nenhuma chave estrangeira referencia: não há cascata a fazer.
+    """
+    tabela = connection.ops.quote_name(modelo._meta.db_table)
+    with connection.cursor() as cursor:
+        for inicio in range(0, len(ids), IDS_POR_CONSULTA):
+            parte = ids[inicio:inicio + IDS_POR_CONSULTA]
+            cursor.execute(f"DELETE FROM {tabela} WHERE id IN ({', '.join(['%s'] * len(parte))})", parte)
+
+
+def solicitar_exclusao(objeto, solicitada_por=None, agora=None):
+    """Esconde o livro ou usuário agora e deixa o histórico dele para expurgar_exclusoes.
+
+    O trabalho na requisição não depende de quantos empréstimos o registro tem: marca excluido_em
+    (os gerenciadores "objects" deixam de vê-lo), tira o livro da busca e cancela as reservas
+    abertas do usuário ou do livro. Um livro com exemplares emprestados não é excluído
+    (ExclusaoRecusada): as devoluções precisam ser registradas antes.
+    """
+    agora = agora or timezone.now()
+    tipo = Exclusao.LIVRO if isinstance(objeto, Livro) else Exclusao.USUARIO
+    with transaction.atomic():
+        if tipo == Exclusao.LIVRO:
+            # Travado como no UPDATE de emprestar_livro: nenhum empréstimo começa entre a conferência e a exclusão.
+            Livro.objects.select_for_update().filter(id=objeto.id).values_list('id', flat=True).first()
+            ativos = Emprestimo.objects.filter(livro_id=objeto.id, devolvido=False).count()
+            if ativos:
+                raise ExclusaoRecusada(
+                    f"O livro '{objeto.titulo}' tem {ativos} exemplar(es) emprestado(s); registre as devoluções antes de excluí-lo."
+                )
+        objeto.excluido_em = agora
+        if tipo == Exclusao.USUARIO:
+            # is_active encerra as sessões abertas: ModelBackend recusa usuários inativos.
+            objeto.is_active = False
+            objeto.save(update_fields=['excluido_em', 'is_active'])
+            for reserva in Reserva.objects.abertas().filter(usuario=objeto).select_related('livro'):
+                reserva.cancelar()
+        else:
+            objeto.save(update_fields=['excluido_em'])
+            obter_backend().remover([objeto.id])
+            # Sem o livro não há exemplar a separar nem a devolver à estante: a fila inteira é encerrada.
+            Reserva.objects.abertas().filter(livro=objeto).update(status=Reserva.CANCELADA)
+        return Exclusao.objects.create(
+            tipo=tipo, objeto_id=objeto.pk, descricao=str(objeto)[:300], solicitada_por=solicitada_por,
+            solicitada_em=agora,
+        )
+
+
+def _contar(exclusao):
+    return sum(
+        modelo.objects.filter(**{campo: exclusao.objeto_id}).count()
+        for modelo, campo in DEPENDENTES[exclusao.tipo]
+    )
+
+
+def _apagar_lote(exclusao, modelo, campo, tamanho_lote):
+    consulta = modelo.objects.filter(**{campo: exclusao.objeto_id}).order_by('id')
+    if modelo not in MODELOS_CONTADOS:
+        ids = list(consulta.values_list('id', flat=True)[:tamanho_lote])
+        apagar_sem_sinais(modelo, ids)
+        return len(ids)
+
+    # Travados como no arquivamento: uma devolução no meio do lote não deixa as estatísticas
+    # descontarem valores velhos.
+    emprestimos = list(consulta.select_for_update().only(*Emprestimo.CAMPOS_ESTATISTICAS)[:tamanho_lote])
+    if not emprestimos:
+        return 0
+    apagar_sem_sinais(modelo, [emprestimo.id for emprestimo in emprestimos])
+    registrar_emprestimos(emprestimos, removido=True)
+    if exclusao.tipo == Exclusao.USUARIO:
+        # O exemplar que estava com o usuário volta para a fila de reservas ou para a estante.
+        for emprestimo in emprestimos:
+            if not emprestimo.devolvido:
+                Livro(id=emprestimo.livro_id).liberar()
+    return len(emprestimos)
+
+
+def expurgar(exclusao, tamanho_lote=TAMANHO_LOTE_PADRAO, pausa=0, ao_apagar_lote=None):
+    """Apaga o histórico do registro em lotes de tamanho_lote, um por transação, e por fim o registro.
+
+    Cada lote trava só as linhas que apaga, então empréstimos e devoluções de outros leitores
+    seguem normalmente. Interrompido, basta rodar de novo: o progresso fica em exclusao.
+    """
+    if exclusao.iniciada_em is None:
+        exclusao.iniciada_em = timezone.now()
+        exclusao.registros_total = _contar(exclusao)
+        exclusao.save(update_fields=['iniciada_em', 'registros_total'])
+
+    for modelo, campo in DEPENDENTES[exclusao.tipo]:
+        while True:
+            with transaction.atomic():
+                apagados = _apagar_lote(exclusao, modelo, campo, tamanho_lote)
+                if apagados:
+                    exclusao.registros_apagados += apagados
+                    Exclusao.objects.filter(pk=exclusao.pk).update(registros_apagados=exclusao.registros_apagados)
+            if apagados < tamanho_lote:
+                break
+            if ao_apagar_lote:
+                ao_apagar_lote(exclusao)
+            if pausa:
+                time.sleep(pausa)
+
+    with transaction.atomic():
+        # Sem dependentes, o Collector não tem o que carregar; os sinais de exclusão rodam normalmente.
+        objeto = MODELOS[exclusao.tipo].todos.filter(pk=exclusao.objeto_id).first()
+        if objeto is not None:
+            objeto.delete()
+        exclusao.concluida_em = timezone.now()
+        exclusao.save(update_fields=['concluida_em'])
+    if ao_apagar_lote:
+        ao_apagar_lote(exclusao)
+    return exclusao
+
+
+def expurgar_exclusoes(tamanho_lote=TAMANHO_LOTE_PADRAO, maximo=None, pausa=0, ao_apagar_lote=None):
+    """Expurga as exclusões pendentes, da mais antiga para a mais nova."""
+    resultado = ResultadoExpurgo()
+    pendentes = Exclusao.objects.filter(concluida_em__isnull=True).order_by('solicitada_em', 'id')
+    for exclusao in pendentes[:maximo] if maximo else pendentes:
+        anteriores = exclusao.registros_apagados
+        expurgar(exclusao, tamanho_lote=tamanho_lote, pausa=pausa, ao_apagar_lote=ao_apagar_lote)
+        resultado.exclusoes += 1
+        resultado.registros += exclusao.registros_apagados - anteriores
+    return resultado
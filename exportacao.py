@@ -0,0 +1,95 @@
+import csv
+import json
+import zlib
+
+from django.http import StreamingHttpResponse
+
+
+TAMANHO_CHUNK = 2000
+
+COLUNAS_EMPRESTIMO = (
+    ('id', 'id'),
+    ('livro__titulo', 'livro_titulo'),
+    ('livro__autor', 'livro_autor'),
+    ('usuario_id', 'usuario_id'),
+    ('usuario__reader_name', 'usuario_nome'),
+    ('usuario__reader_contact', 'usuario_contato'),
+    ('data_emprestimo', 'data_emprestimo'),
+    ('data_devolucao_prevista', 'data_devolucao_prevista'),
+    ('data_devolucao', 'data_devolucao'),
+    ('devolvido', 'devolvido'),
+)
+
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson; charset=utf-8', 'ndjson'),
+}
+
+
+class _Eco:
+    # csv.writer precisa de um "arquivo"; este só devolve a linha formatada.
+    def write(self, valor):
+        return valor
+
+
+def _formatar(valor):
+    if hasattr(valor, 'isoformat'):
+        return valor.isoformat()
+    return valor
+
+
+def linhas_csv(cabecalho, linhas):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(cabecalho)
+    for linha in linhas:
+        yield escritor.writerow([_formatar(valor) for valor in linha])
+
+
+def linhas_ndjson(cabecalho, linhas):
+    for linha in linhas:
+        yield json.dumps(dict(zip(cabecalho, map(_formatar, linha))), ensure_ascii=False) + '\n'
+
+
+def _agrupar(partes, tamanho_minimo=64 * 1024):
+    # Junta linhas pequenas em blocos maiores antes de enviá-las ao servidor.
+    buffer = []
+    tamanho = 0
+    for parte in partes:
+        buffer.append(parte)
+        tamanho += len(parte)
+        if tamanho >= tamanho_minimo:
+            yield b''.join(buffer)
+            buffer = []
+            tamanho = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _compactar_gzip(blocos):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for bloco in blocos:
+        compactado = compressor.compress(bloco)
+        if compactado:
+            yield compactado
+    yield compressor.flush()
+
+
+def exportar_queryset(queryset, colunas, formato, nome_arquivo, gzip=False):
+    """Transmite o queryset como CSV ou NDJSON, linha a linha, sem montar o arquivo em memória."""
+    tipo_conteudo, extensao = FORMATOS[formato]
+    campos = [campo for campo, _ in colunas]
+    cabecalho = [nome for _, nome in colunas]
+
+    linhas = queryset.values_list(*campos).iterator(chunk_size=TAMANHO_CHUNK)
+    gerador = linhas_csv if formato == 'csv' else linhas_ndjson
+    blocos = _agrupar(parte.encode('utf-8') for parte in gerador(cabecalho, linhas))
+
+    nome_arquivo = f'{nome_arquivo}.{extensao}'
+    if gzip:
+        blocos = _compactar_gzip(blocos)
+        tipo_conteudo = 'application/gzip'
+        nome_arquivo += '.gz'
+
+    resposta = StreamingHttpResponse(blocos, content_type=tipo_conteudo)
+    resposta['Content-Disposition'] = f'attachment; filename="{nome_arquivo}"'
+    return resposta
@@ -73,10 +73,10 @@ class UsuarioRegistroForm(forms.ModelForm):
         elif not password_confirm:
             self.add_error('password_confirm', 'Confirme a senha.')
 
-        if Usuario.objects.filter(login=login).exists():
+        if Usuario.todos.filter(login=login).exists():
             self.add_error('login', 'Este nome de usuário já está em uso. Por favor, escolha outro.')
 
-        if email and Usuario.objects.filter(email=email).exists():
+        if email and Usuario.todos.filter(email=email).exists():
             self.add_error('email', 'Este e-mail já está cadastrado. Tente fazer login ou use outro e-mail.')
 
         if tipo_usuario == 'membro_comum' and secret_key:
@@ -84,10 +84,13 @@ class UsuarioRegistroForm(forms.ModelForm):
         
         return cleaned_data
     
-    def save(self, commit=True):
+    def save(self, commit=True, senha_hash=None):
         user = super().save(commit=False)
-        password = self.cleaned_data["password"]
-        user.set_password(password) 
+        if senha_hash:
+            user.password = senha_hash
+        else:
+            password = self.cleaned_data["password"]
+            user.set_password(password) 
 
         if user.tipo_usuario == 'admin':
             user.is_staff = True
@@ -0,0 +1,227 @@
+import csv
+import io
+import json
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Lower
+
+from .busca import obter_backend
+from .cache_catalogo import invalidar_catalogo
+from .models import Exemplar, Livro
+
+
+TAMANHO_LOTE_PADRAO = 5000
+CAMPOS_LIVRO = ('titulo', 'autor', 'ano_publicacao', 'genero', 'exemplares')
+# Títulos por consulta com IN (...): abaixo do limite de 2100 parâmetros do SQL Server.
+CHAVES_POR_CONSULTA = 500
+
+
+class DadosLivroInvalidos(ValueError):
+    pass
+
+
+def _texto(campo, valor):
+    # Da importação JSONL podem vir números, listas ou objetos no lugar do texto.
+    if valor is None:
+        return ''
+    if not isinstance(valor, str):
+        raise DadosLivroInvalidos(f"{Livro._meta.get_field(campo).verbose_name} deve ser um texto.")
+    return valor.strip()
+
+
+def validar_dados_livro(titulo, autor, ano_publicacao, genero, exemplares=None):
+    """Regras de cadastro de livro, compartilhadas por salvar_livro e pela importação em lote."""
+    titulo = _texto('titulo', titulo)
+    autor = _texto('autor', autor)
+    genero = _texto('genero', genero)
+
+    if not titulo or not autor:
+        raise DadosLivroInvalidos("Título e autor do livro são obrigatórios.")
+
+    if ano_publicacao in (None, ''):
+        raise DadosLivroInvalidos("Ano de Publicação é obrigatório.")
+    try:
+        ano_publicacao = int(ano_publicacao)
+    except (TypeError, ValueError):
+        raise DadosLivroInvalidos("Ano de Publicação deve ser um número válido.")
+
+    if exemplares in (None, ''):
+        exemplares = 1
+    try:
+        exemplares = int(exemplares)
+    except (TypeError, ValueError):
+        raise DadosLivroInvalidos("Quantidade de exemplares deve ser um número válido.")
+    if exemplares < 1:
+        raise DadosLivroInvalidos("Informe ao menos um exemplar.")
+
+    for campo, valor in (('titulo', titulo), ('autor', autor), ('genero', genero)):
+        field = Livro._meta.get_field(campo)
+        if len(valor) > field.max_length:
+            raise DadosLivroInvalidos(f"{field.verbose_name} excede {field.max_length} caracteres.")
+
+    return {'titulo': titulo, 'autor': autor, 'ano_publicacao': ano_publicacao, 'genero': genero,
+            'exemplares': exemplares}
+
+
+def ler_csv(arquivo_texto):
+    for numero, linha in enumerate(csv.DictReader(arquivo_texto), start=1):
+        yield numero, linha
+
+
+def ler_jsonl(arquivo_texto):
+    numero = 0
+    for texto in arquivo_texto:
+        if not texto.strip():
+            continue
+        numero += 1
+        try:
+            dados = json.loads(texto)
+        except json.JSONDecodeError as e:
+            dados = e
+        yield numero, dados
+
+
+LEITORES = {
+    'csv': ler_csv,
+    'jsonl': ler_jsonl,
+}
+
+
+def detectar_formato(nome_arquivo):
+    extensao = nome_arquivo.rsplit('.', 1)[-1].lower()
+    if extensao in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    return 'csv'
+
+
+def abrir_texto(arquivo_binario):
+    # utf-8-sig descarta o BOM que planilhas costumam gravar no início do CSV.
+    return io.TextIOWrapper(arquivo_binario, encoding='utf-8-sig', newline='')
+
+
+def _chave(titulo, autor, ano_publicacao):
+    # A mesma identidade de Livro.objects.cadastrar: título e autor sem diferença de maiúsculas, e o ano.
+    return titulo.lower(), autor.lower(), ano_publicacao
+
+
+def _livros_por_chave(chaves):
+    """{chave: id do livro mais antigo com essa chave} para as chaves que já estão no acervo."""
+    chaves = sorted(set(chaves))
+    encontrados = {}
+    for inicio in range(0, len(chaves), CHAVES_POR_CONSULTA):
+        parte = chaves[inicio:inicio + CHAVES_POR_CONSULTA]
+        linhas = (
+            Livro.objects.annotate(titulo_minusculo=Lower('titulo'))
+            .filter(titulo_minusculo__in={titulo for titulo, _, _ in parte},
+                    ano_publicacao__in={ano for _, _, ano in parte})
+            .order_by('-id').values_list('id', 'titulo', 'autor', 'ano_publicacao')
+        )
+        procuradas = set(parte)
+        for livro_id, *campos in linhas:
+            chave = _chave(*campos)
+            if chave in procuradas:
+                encontrados[chave] = livro_id
+    return encontrados
+
+
+def _registrar_exemplares(quantidades, tamanho_lote):
+    """Exemplares novos em títulos existentes, {livro_id: quantidade}, como Exemplar.objects.registrar."""
+    Exemplar.objects.bulk_create(
+        (Exemplar(livro_id=livro_id) for livro_id, quantidade in quantidades.items() for _ in range(quantidade)),
+        batch_size=tamanho_lote,
+    )
+    # Os livros que recebem a mesma quantidade saem num UPDATE só.
+    por_quantidade = defaultdict(list)
+    for livro_id, quantidade in quantidades.items():
+        por_quantidade[quantidade].append(livro_id)
+    for quantidade, livro_ids in por_quantidade.items():
+        for inicio in range(0, len(livro_ids), CHAVES_POR_CONSULTA):
+            Livro.objects.filter(id__in=livro_ids[inicio:inicio + CHAVES_POR_CONSULTA]).update(
+                total_exemplares=F('total_exemplares') + quantidade,
+                exemplares_disponiveis=F('exemplares_disponiveis') + quantidade,
+            )
+
+
+class ResultadoImportacao:
+    def __init__(self, ultima_linha=0):
+        self.lidas = 0
+        self.importadas = 0
+        self.titulos_novos = 0
+        self.erros = []
+        self.ultima_linha_gravada = ultima_linha
+
+
+def importar_livros(linhas, tamanho_lote=TAMANHO_LOTE_PADRAO, a_partir_de=0, ao_gravar_lote=None):
+    """Importa livros de um iterável de (número da linha, dados) sem carregar o arquivo inteiro.
+
+    Como em Livro.objects.cadastrar, uma linha com título, autor e ano já cadastrados (no acervo ou
+    antes no mesmo lote) soma exemplares ao título existente em vez de criar outro.
+
+    Cada lote é gravado com bulk_create na sua própria transação; depois de cada lote,
+    ao_gravar_lote(resultado) é chamado com o número da última linha gravada, que pode
+    ser usado como a_partir_de para retomar uma importação interrompida.
+    """
+    resultado = ResultadoImportacao(ultima_linha=a_partir_de)
+    backend = obter_backend()
+    lote = []
+    numero = a_partir_de
+
+    def gravar():
+        # Linhas repetidas no lote viram um título só, com os exemplares somados.
+        por_chave = {}
+        for livro in lote:
+            chave = _chave(livro.titulo, livro.autor, livro.ano_publicacao)
+            if chave in por_chave:
+                por_chave[chave].total_exemplares += livro.total_exemplares
+                por_chave[chave].exemplares_disponiveis += livro.exemplares_disponiveis
+            else:
+                por_chave[chave] = livro
+        with transaction.atomic():
+            existentes = _livros_por_chave(por_chave)
+            _registrar_exemplares(
+                {livro_id: por_chave[chave].total_exemplares for chave, livro_id in existentes.items()}, tamanho_lote,
+            )
+            novos = [livro for chave, livro in por_chave.items() if chave not in existentes]
+            Livro.objects.bulk_create(novos, batch_size=tamanho_lote)
+            sem_id = {_chave(livro.titulo, livro.autor, livro.ano_publicacao): livro for livro in novos if livro.id is None}
+            if sem_id:
+                # Bancos sem RETURNING não devolvem os ids do bulk_create: relê pela chave.
+                for chave, livro_id in _livros_por_chave(sem_id).items():
+                    sem_id.pop(chave).id = livro_id
+                if sem_id:
+                    raise RuntimeError(f"{len(sem_id)} livro(s) importado(s) não foram encontrados depois de gravados.")
+            Exemplar.objects.bulk_create(
+                (Exemplar(livro=livro) for livro in novos for _ in range(livro.total_exemplares)),
+                batch_size=tamanho_lote,
+            )
+            backend.indexar(novos)
+            invalidar_catalogo()
+        resultado.importadas += len(lote)
+        resultado.titulos_novos += len(novos)
+        resultado.ultima_linha_gravada = numero
+        lote.clear()
+        if ao_gravar_lote:
+            ao_gravar_lote(resultado)
+
+    for numero, dados in linhas:
+        if numero <= a_partir_de:
+            continue
+        resultado.lidas += 1
+        try:
+            if not isinstance(dados, dict):
+                raise DadosLivroInvalidos(f"Linha ilegível: {dados}")
+            campos = validar_dados_livro(*(dados.get(campo) for campo in CAMPOS_LIVRO))
+        except DadosLivroInvalidos as e:
+            resultado.erros.append((numero, str(e)))
+            continue
+        exemplares = campos.pop('exemplares')
+        lote.append(Livro(total_exemplares=exemplares, exemplares_disponiveis=exemplares, **campos))
+        if len(lote) >= tamanho_lote:
+            gravar()
+
+    if lote:
+        gravar()
+    resultado.ultima_linha_gravada = numero
+    return resultado
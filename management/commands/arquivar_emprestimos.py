@@ -0,0 +1,59 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from biblioteca.arquivo import TAMANHO_LOTE_PADRAO, arquivar_emprestimos, idade_padrao
+from biblioteca.travas import adquirir_trava, liberar_trava
+
+
+CHAVE_TRAVA = 'biblioteca:arquivo_emprestimos:em_andamento'
+TEMPO_TRAVA = 6 * 60 * 60
+
+
+class Command(BaseCommand):
+    help = (
+        'Move para o arquivo os empréstimos devolvidos há mais de N dias, em lotes com uma transação cada. '
+        'Feito para rodar agendado fora do horário de pico; interrompido, basta rodar de novo.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias', type=int,
+            help='Idade mínima da devolução, em dias. Padrão: BIBLIOTECA_ARQUIVO_IDADE_DIAS ou 365.',
+        )
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE_PADRAO, help='Empréstimos por transação.')
+        parser.add_argument('--maximo-lotes', type=int, help='Para depois de N lotes (o resto fica para a próxima).')
+        parser.add_argument('--pausa', type=float, default=0, help='Segundos de espera entre lotes.')
+
+    def handle(self, *args, **options):
+        idade = timedelta(days=options['dias']) if options['dias'] is not None else idade_padrao()
+
+        dono = adquirir_trava(CHAVE_TRAVA, TEMPO_TRAVA)
+        if dono is None:
+            raise CommandError("Já há um arquivamento em andamento.")
+
+        inicio = time.perf_counter()
+
+        def ao_arquivar_lote(resultado):
+            decorrido = time.perf_counter() - inicio
+            self.stdout.write(
+                f"  lote {resultado.lotes}: {resultado.arquivados} empréstimos arquivados até o id "
+                f"{resultado.ultimo_id} ({resultado.arquivados / decorrido:.0f}/s)"
+            )
+
+        try:
+            resultado = arquivar_emprestimos(
+                idade=idade,
+                tamanho_lote=options['lote'],
+                maximo_lotes=options['maximo_lotes'],
+                pausa=options['pausa'],
+                ao_arquivar_lote=ao_arquivar_lote,
+            )
+        finally:
+            liberar_trava(CHAVE_TRAVA, dono)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado.arquivados} empréstimos devolvidos há mais de {idade.days} dias arquivados "
+            f"em {resultado.lotes} lote(s), {time.perf_counter() - inicio:.1f}s."
+        ))
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from biblioteca.recomendacoes import TAMANHO_LOTE_PADRAO, atualizar_recomendacoes
+from biblioteca.travas import adquirir_trava, liberar_trava
+
+
+# A mesma trava de reconstruir_recomendacoes: as duas gravam as mesmas listas.
+CHAVE_TRAVA = 'biblioteca:recomendacoes:em_andamento'
+TEMPO_TRAVA = 6 * 60 * 60
+
+
+class Command(BaseCommand):
+    help = (
+        'Atualiza as recomendações "leitores também pegaram" com os empréstimos feitos desde a última '
+        'rodada. Feito para rodar agendado a cada poucos minutos; interrompido, basta rodar de novo.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE_PADRAO, help='Empréstimos por transação.')
+        parser.add_argument(
+            '--vizinhos', type=int,
+            help='Livros guardados por lista. Padrão: BIBLIOTECA_RECOMENDACOES_VIZINHOS ou 10.',
+        )
+
+    def handle(self, *args, **options):
+        dono = adquirir_trava(CHAVE_TRAVA, TEMPO_TRAVA)
+        if dono is None:
+            raise CommandError("Já há uma atualização de recomendações em andamento.")
+
+        inicio = time.perf_counter()
+
+        def ao_processar_lote(resultado):
+            self.stdout.write(
+                f"  lote {resultado.lotes}: {resultado.emprestimos} empréstimos, {resultado.pares} pares "
+                f"recontados, {resultado.livros} listas alteradas"
+            )
+
+        try:
+            resultado = atualizar_recomendacoes(
+                quantidade=options['vizinhos'],
+                tamanho_lote=options['lote'],
+                ao_processar_lote=ao_processar_lote,
+            )
+        finally:
+            liberar_trava(CHAVE_TRAVA, dono)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado.emprestimos} empréstimos novos processados, {resultado.livros} listas alteradas, "
+            f"{time.perf_counter() - inicio:.1f}s."
+        ))
@@ -0,0 +1,188 @@
+import json
+import platform
+import statistics
+import time
+
+import django
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from biblioteca import urls
+from biblioteca.busca import buscar_livros, obter_backend
+from biblioteca.circulacao import emprestar_livro
+from biblioteca.dados_sinteticos import gerar_dados
+from biblioteca.management.commands.explicar_consultas import requisicao_simulada
+from biblioteca.models import Emprestimo, Livro, Usuario
+from biblioteca.metricas import observar_consultas
+from biblioteca.orcamento_consultas import RegistroConsultas
+
+
+# Views que só fazem sentido via POST com dados reais, ou que encerram a sessão.
+VIEWS_IGNORADAS = {'salvar_nome_page', 'logout_page', 'reservar_livro', 'cancelar_reserva'}
+
+# Query strings extras, além da página inicial de cada listagem.
+VARIACOES = {
+    'books_page': ['query=memorias cortiço'],
+    'usuarios_page': ['query=silva'],
+    'pesquisar_emprestimos': ['query=silva'],
+    'devolucao_page': ['query=silva'],
+    'autocompletar_livros': ['q=mem&disponiveis=1'],
+    'autocompletar_usuarios': ['q=mar'],
+    'api_livros': ['query=memorias cortiço', 'fields=titulo,exemplares_disponiveis&tamanho=100'],
+    'api_usuarios': ['query=silva'],
+    'api_emprestimos': ['devolvido=0&fields=livro_titulo,usuario_nome&tamanho=100'],
+}
+
+
+def _tamanho(texto):
+    try:
+        livros, usuarios, emprestimos = (int(parte) for parte in texto.split(':'))
+    except ValueError:
+        raise CommandError(f"Tamanho inválido '{texto}': use livros:usuarios:emprestimos, ex. 10000:1000:50000")
+    return livros, usuarios, emprestimos
+
+
+def _medir(funcao, repeticoes):
+    tempos = []
+    registro = None
+    for _ in range(repeticoes):
+        registro = RegistroConsultas()
+        inicio = time.perf_counter()
+        with observar_consultas(registro):
+            funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    tempos.sort()
+    return {
+        'mediana_ms': round(statistics.median(tempos), 3),
+        'p95_ms': round(tempos[min(len(tempos) - 1, int(len(tempos) * 0.95))], 3),
+        'min_ms': round(tempos[0], 3),
+        'consultas': registro.total,
+    }
+
+
+def _consumir(resposta):
+    # Respostas em streaming só fazem o trabalho quando o conteúdo é lido.
+    if getattr(resposta, 'streaming', False):
+        for _ in resposta.streaming_content:
+            pass
+    return resposta
+
+
+def _em_rollback(funcao):
+    def executar():
+        with transaction.atomic():
+            funcao()
+            transaction.set_rollback(True)
+    return executar
+
+
+class Command(BaseCommand):
+    help = (
+        'Gera bases sintéticas de vários tamanhos num banco de teste e mede cada view de urls.py '
+        'e os principais métodos dos modelos, gravando um relatório JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanhos', nargs='+', type=_tamanho, default=[_tamanho('1000:200:5000'),
+                                                                            _tamanho('10000:2000:50000')],
+                            help='Um ou mais livros:usuarios:emprestimos.')
+        parser.add_argument('--repeticoes', type=int, default=10)
+        parser.add_argument('--semente', type=int, default=42)
+        parser.add_argument('--saida', default='benchmark_biblioteca.json')
+
+    def handle(self, *args, **options):
+        relatorio = {
+            'gerado_em': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'banco': connection.vendor,
+            'repeticoes': options['repeticoes'],
+            'resultados': [],
+        }
+
+        nome_original = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            for livros, usuarios, emprestimos in options['tamanhos']:
+                relatorio['resultados'].append(
+                    self._medir_tamanho(livros, usuarios, emprestimos, options['repeticoes'], options['semente'])
+                )
+        finally:
+            connection.creation.destroy_test_db(nome_original, verbosity=0)
+
+        with open(options['saida'], 'w', encoding='utf-8') as arquivo:
+            json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Relatório gravado em {options['saida']}."))
+
+    def _medir_tamanho(self, livros, usuarios, emprestimos, repeticoes, semente):
+        call_command('flush', interactive=False, verbosity=0)
+        obter_backend().reconstruir()
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n{livros} livros, {usuarios} usuários, {emprestimos} empréstimos"))
+        inicio = time.perf_counter()
+        gerar_dados(livros=livros, usuarios=usuarios, emprestimos=emprestimos, semente=semente)
+        admin = Usuario.objects.create_superuser('benchmark', None, reader_name='Benchmark')
+        resultado = {
+            'livros': livros,
+            'usuarios': usuarios,
+            'emprestimos': emprestimos,
+            'geracao_s': round(time.perf_counter() - inicio, 2),
+            'views': {},
+            'metodos': {},
+        }
+
+        ids = {
+            'livro_id': Livro.objects.order_by('id').values_list('id', flat=True).first(),
+            'usuario_id': Usuario.objects.order_by('id').values_list('id', flat=True).first(),
+            'emprestimo_id': Emprestimo.objects.order_by('id').values_list('id', flat=True).first(),
+        }
+
+        vistos = set()
+        for padrao in urls.urlpatterns:
+            nome = padrao.name
+            if nome in VIEWS_IGNORADAS or nome in vistos:
+                continue
+            vistos.add(nome)
+            kwargs = {argumento: ids[argumento] for argumento in padrao.pattern.converters}
+            if None in kwargs.values():
+                continue
+            caminho = reverse(nome, kwargs=kwargs)
+            view = resolve(caminho).func
+            for query_string in [''] + VARIACOES.get(nome, []):
+                chave = f'{nome}?{query_string}' if query_string else nome
+                try:
+                    medicao = _medir(
+                        lambda: _consumir(view(requisicao_simulada(caminho, admin, query_string), **kwargs)),
+                        repeticoes,
+                    )
+                except Exception as e:
+                    resultado['views'][chave] = {'erro': repr(e)}
+                    self.stderr.write(f"  {chave:45} erro: {e!r}")
+                    continue
+                resultado['views'][chave] = medicao
+                self.stdout.write(f"  {chave:45} {medicao['mediana_ms']:9.2f} ms  {medicao['consultas']:3} consultas")
+
+        amostra = list(Emprestimo.objects.all()[:1000])
+        livro_disponivel = Livro.objects.disponiveis().values_list('id', flat=True).first()
+        ativo = Emprestimo.objects.filter(devolvido=False).select_related('livro').first()
+        metodos = {
+            'Emprestimo.calcular_multa x1000': lambda: [emprestimo.calcular_multa() for emprestimo in amostra],
+            'Emprestimo.objects.com_multa().aggregate': lambda: Emprestimo.objects.com_multa().aggregate(Sum('valor_multa')),
+            'Emprestimo.objects.vencidos().count': lambda: Emprestimo.objects.vencidos().count(),
+            'buscar_livros': lambda: buscar_livros('memorias'),
+        }
+        if livro_disponivel:
+            metodos['emprestar_livro'] = _em_rollback(lambda: emprestar_livro(livro_disponivel, admin))
+        if ativo:
+            metodos['Emprestimo.marcar_como_devolvido'] = _em_rollback(
+                lambda: Emprestimo.objects.select_related('livro').get(id=ativo.id).marcar_como_devolvido()
+            )
+        for nome, funcao in metodos.items():
+            medicao = _medir(funcao, repeticoes)
+            resultado['metodos'][nome] = medicao
+            self.stdout.write(f"  {nome:45} {medicao['mediana_ms']:9.2f} ms  {medicao['consultas']:3} consultas")
+        return resultado
@@ -0,0 +1,78 @@
+import random
+import sqlite3
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from biblioteca.busca import BackendFTS5, TABELA_BUSCA_LIVRO
+
+
+PALAVRAS = [
+    'memórias', 'póstumas', 'brás', 'cubas', 'dom', 'casmurro', 'grande', 'sertão', 'veredas',
+    'vidas', 'secas', 'capitães', 'areia', 'hora', 'estrela', 'quincas', 'borba', 'cortiço',
+    'iracema', 'senhora', 'macunaíma', 'menino', 'engenho', 'ensaio', 'cegueira', 'história',
+    'noite', 'mar', 'cidade', 'sol', 'coração', 'caminho', 'tempo', 'vento', 'rio', 'terra',
+]
+AUTORES = [
+    'Machado de Assis', 'Guimarães Rosa', 'Graciliano Ramos', 'Jorge Amado', 'Clarice Lispector',
+    'Aluísio Azevedo', 'José de Alencar', 'Mário de Andrade', 'José Lins do Rego', 'José Saramago',
+]
+CONSULTAS = ['memorias', 'Memórias Póstumas', 'cas', 'sertão veredas', 'machado', 'coração noite']
+
+
+def _sql(instrucao):
+    return instrucao.replace('%s', '?')
+
+
+class Command(BaseCommand):
+    help = 'Compara a latência da busca LIKE com o índice FTS5 em catálogos sintéticos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanhos', type=int, nargs='+', default=[100_000, 1_000_000])
+        parser.add_argument('--repeticoes', type=int, default=20)
+        parser.add_argument('--semente', type=int, default=42)
+
+    def handle(self, *args, **options):
+        aleatorio = random.Random(options['semente'])
+        for tamanho in options['tamanhos']:
+            conexao = self._popular(tamanho, aleatorio)
+            self.stdout.write(f"\n{tamanho} livros")
+            for consulta in CONSULTAS:
+                like = self._medir(conexao, self._consulta_like, consulta, options['repeticoes'])
+                fts = self._medir(conexao, self._consulta_fts, consulta, options['repeticoes'])
+                self.stdout.write(f"  {consulta!r:24} LIKE {like:9.2f} ms   FTS5 {fts:7.2f} ms")
+            conexao.close()
+
+    def _popular(self, tamanho, aleatorio):
+        conexao = sqlite3.connect(':memory:')
+        conexao.execute('CREATE TABLE livro (id INTEGER PRIMARY KEY, titulo TEXT, autor TEXT)')
+        conexao.execute(BackendFTS5.SQL_CRIAR)
+        linhas = (
+            (i, ' '.join(aleatorio.choices(PALAVRAS, k=aleatorio.randint(2, 5))).title(), aleatorio.choice(AUTORES))
+            for i in range(1, tamanho + 1)
+        )
+        conexao.executemany('INSERT INTO livro VALUES (?, ?, ?)', linhas)
+        conexao.execute(f'INSERT INTO {TABELA_BUSCA_LIVRO} (rowid, titulo, autor) SELECT id, titulo, autor FROM livro')
+        conexao.commit()
+        return conexao
+
+    def _consulta_like(self, conexao, consulta):
+        filtros = ' AND '.join('(titulo LIKE ? OR autor LIKE ?)' for _ in consulta.split())
+        parametros = [valor for termo in consulta.split() for valor in (f'%{termo}%', f'%{termo}%')]
+        return conexao.execute(
+            f'SELECT id FROM livro WHERE {filtros} ORDER BY titulo LIMIT ?', parametros + [500]
+        ).fetchall()
+
+    def _consulta_fts(self, conexao, consulta):
+        return conexao.execute(
+            _sql(BackendFTS5.SQL_BUSCAR), [BackendFTS5.montar_consulta(consulta), 500]
+        ).fetchall()
+
+    def _medir(self, conexao, funcao, consulta, repeticoes):
+        tempos = []
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            funcao(conexao, consulta)
+            tempos.append((time.perf_counter() - inicio) * 1000)
+        return statistics.median(tempos)
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import AsyncClient, Client, override_settings
+
+from biblioteca.models import Usuario
+
+
+SENHA = 'senha-do-benchmark'
+
+
+def _resumo(nome, tempos, total_s):
+    tempos.sort()
+    return {
+        'modo': nome,
+        'logins': len(tempos),
+        'logins_por_s': round(len(tempos) / total_s, 1),
+        'mediana_ms': round(statistics.median(tempos), 1),
+        'p95_ms': round(tempos[min(len(tempos) - 1, int(len(tempos) * 0.95))], 1),
+    }
+
+
+def _login_wsgi(login):
+    inicio = time.perf_counter()
+    resposta = Client().post('/login/', {'login': login, 'password': SENHA})
+    connections.close_all()
+    assert resposta.status_code == 302, f'login de {login} falhou ({resposta.status_code})'
+    return (time.perf_counter() - inicio) * 1000
+
+
+def medir_wsgi(logins, workers):
+    # Cada thread faz o papel de um worker síncrono: fica presa no PBKDF2 até o login terminar.
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        tempos = list(pool.map(_login_wsgi, logins))
+    return _resumo(f'WSGI ({workers} workers)', tempos, time.perf_counter() - inicio)
+
+
+async def _medir_asgi(logins, concorrencia):
+    limite = asyncio.Semaphore(concorrencia)
+
+    async def login(nome):
+        async with limite:
+            inicio = time.perf_counter()
+            resposta = await AsyncClient().post('/login/', {'login': nome, 'password': SENHA})
+            assert resposta.status_code == 302, f'login de {nome} falhou ({resposta.status_code})'
+            return (time.perf_counter() - inicio) * 1000
+
+    inicio = time.perf_counter()
+    tempos = await asyncio.gather(*(login(nome) for nome in logins))
+    return _resumo(f'ASGI ({concorrencia} simultâneos)', list(tempos), time.perf_counter() - inicio)
+
+
+def medir_asgi(logins, concorrencia):
+    with override_settings(ROOT_URLCONF='biblioteca.urls_asgi'):
+        return asyncio.run(_medir_asgi(logins, concorrencia))
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara a vazão de logins simultâneos pela view síncrona (urls.py, como sob WSGI) '
+        'e pela assíncrona (urls_asgi.py, como sob ASGI), num banco de teste.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=200, help='Total de logins em cada modo.')
+        parser.add_argument('--usuarios', type=int, default=50)
+        parser.add_argument('--workers', type=int, default=4, help='Workers síncronos simulados no modo WSGI.')
+        parser.add_argument('--concorrencia', type=int, default=50, help='Requisições simultâneas no modo ASGI.')
+
+    def handle(self, *args, **options):
+        nome_original = connection.settings_dict['NAME']
+        arquivo_teste = None
+        if connection.vendor == 'sqlite':
+            # O SQLite em memória não aguenta escritas de várias threads; usa um arquivo temporário.
+            descritor, arquivo_teste = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(descritor)
+            connection.settings_dict['TEST']['NAME'] = arquivo_teste
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            senha = make_password(SENHA)
+            Usuario.objects.bulk_create(
+                Usuario(login=f'bench{i}', email=f'bench{i}@exemplo.org', reader_name=f'Bench {i}', password=senha)
+                for i in range(options['usuarios'])
+            )
+            logins = [f"bench{i % options['usuarios']}" for i in range(options['logins'])]
+            connection.close()
+
+            for resultado in (medir_wsgi(logins, options['workers']), medir_asgi(logins, options['concorrencia'])):
+                self.stdout.write(
+                    f"{resultado['modo']:28} {resultado['logins_por_s']:8.1f} logins/s  "
+                    f"mediana {resultado['mediana_ms']:8.1f} ms  p95 {resultado['p95_ms']:8.1f} ms"
+                )
+        finally:
+            connection.creation.destroy_test_db(nome_original, verbosity=0)
+            if arquivo_teste and os.path.exists(arquivo_teste):
+                os.remove(arquivo_teste)
@@ -0,0 +1,119 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.urls import resolve, reverse
+
+from biblioteca.dados_sinteticos import gerar_dados
+from biblioteca.management.commands.explicar_consultas import requisicao_simulada
+from biblioteca.metricas import MetricasMiddleware, _instalar_medidor, registro
+from biblioteca.models import Usuario
+
+
+VIEWS = {
+    'pagina_inicial': '',
+    'books_page': 'query=memorias',
+    'usuarios_page': '',
+    'devolucao_page': '',
+    'autocompletar_livros': 'q=mem',
+}
+
+
+def _templates_medidos():
+    return [
+        {**motor, 'BACKEND': 'biblioteca.metricas.TemplatesMedidos'}
+        if motor['BACKEND'] == 'django.template.backends.django.DjangoTemplates' else motor
+        for motor in settings.TEMPLATES
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede o custo do MetricasMiddleware: chama as principais views com e sem a medição, alternando as '
+        'duas para diluir o ruído, e compara os pares. Roda num banco de teste com dados sintéticos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticoes', type=int, default=200)
+        parser.add_argument('--livros', type=int, default=5000)
+        parser.add_argument('--emprestimos', type=int, default=20000)
+        parser.add_argument('--limite-us', type=float, default=100.0,
+                            help='Custo mediano aceito por requisição, em microssegundos.')
+        parser.add_argument('--limite-percentual', type=float, default=3.0,
+                            help='Custo aceito em views lentas, em porcentagem do tempo da view.')
+
+    def handle(self, *args, **options):
+        nome_original = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            gerar_dados(livros=options['livros'], usuarios=options['livros'] // 5,
+                        emprestimos=options['emprestimos'], semente=42)
+            admin = Usuario.objects.create_superuser('benchmark', None, reader_name='Benchmark')
+            self._por_consulta()
+            custos = self._por_view(admin, options['repeticoes'])
+        finally:
+            connection.creation.destroy_test_db(nome_original, verbosity=0)
+            registro.limpar()
+
+        # Só reprova o que passa dos dois limites: em views de 100 ms, 100 µs de ruído é comum.
+        acima = [
+            nome for nome, (custo_us, percentual) in custos.items()
+            if custo_us > options['limite_us'] and percentual > options['limite_percentual']
+        ]
+        if acima:
+            raise CommandError(
+                f"Custo da medição acima de {options['limite_us']:.0f} µs e de {options['limite_percentual']}% "
+                f"em: {', '.join(acima)}."
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Custo da medição dentro de {options['limite_us']:.0f} µs ou {options['limite_percentual']}% por requisição."
+        ))
+
+    def _por_consulta(self):
+        # O execute_wrapper fica instalado sempre: fora de requisições medidas ele só repassa a chamada.
+        total = 20000
+        tempos = {}
+        for rotulo, instalado in (('sem wrapper', False), ('wrapper ocioso', True)):
+            if instalado:
+                _instalar_medidor(connection)
+            with connection.cursor() as cursor:
+                inicio = time.perf_counter()
+                for _ in range(total):
+                    cursor.execute('SELECT 1')
+                tempos[rotulo] = (time.perf_counter() - inicio) / total * 1e6
+            self.stdout.write(f"  SELECT 1, {rotulo:17} {tempos[rotulo]:7.2f} µs por consulta")
+
+    def _por_view(self, admin, repeticoes):
+        custos = {}
+        with override_settings(TEMPLATES=_templates_medidos()):
+            for nome, query_string in VIEWS.items():
+                caminho = reverse(nome)
+                correspondencia = resolve(caminho)
+
+                def chamar(request):
+                    request.resolver_match = correspondencia
+                    return correspondencia.func(request)
+
+                medido = MetricasMiddleware(chamar)
+                sem, diferencas = [], []
+                for repeticao in range(repeticoes):
+                    par = {}
+                    # Alterna quem roda primeiro: a segunda chamada do par pega caches mais quentes.
+                    for funcao in (chamar, medido) if repeticao % 2 else (medido, chamar):
+                        request = requisicao_simulada(caminho, admin, query_string)
+                        inicio = time.perf_counter()
+                        funcao(request)
+                        par[funcao] = time.perf_counter() - inicio
+                    sem.append(par[chamar])
+                    diferencas.append(par[medido] - par[chamar])
+                # Mediana das diferenças de cada par: um GC ou uma pausa do SO num lado só não distorce.
+                base_ms = statistics.median(sem) * 1000
+                custo_us = statistics.median(diferencas) * 1e6
+                custos[nome] = (custo_us, custo_us / 10 / base_ms)
+                self.stdout.write(
+                    f"  {nome:25} {base_ms:8.3f} ms  custo {custo_us:+7.1f} µs ({custos[nome][1]:+5.1f}%)"
+                )
+        return custos
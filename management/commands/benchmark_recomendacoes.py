@@ -0,0 +1,142 @@
+import random
+import sqlite3
+import statistics
+import time
+from collections import Counter, defaultdict
+from itertools import accumulate
+
+from django.core.management.base import BaseCommand
+
+from biblioteca.recomendacoes import (
+    LIMITE_LEITOR_PADRAO, VIZINHOS_PADRAO, MatrizLeitura, atualizar_vizinhos, pares_novos,
+)
+
+
+# Uma consulta direta sobre os pares de empréstimos: o JOIN cresce com o quadrado dos leitores do livro.
+SQL_DIRETO = '''
+    SELECT b.livro_id, COUNT(DISTINCT b.usuario_id) AS leitores
+    FROM emprestimo a JOIN emprestimo b ON b.usuario_id = a.usuario_id AND b.livro_id <> a.livro_id
+    WHERE a.livro_id = ?
+    GROUP BY b.livro_id ORDER BY leitores DESC, b.livro_id LIMIT ?
+'''
+SQL_GUARDADO = 'SELECT recomendado_id, leitores FROM recomendacao WHERE livro_id = ? ORDER BY posicao'
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede a matriz de coocorrência das recomendações (reconstrução, atualização incremental e consulta) '
+        'com históricos sintéticos, e compara a consulta guardada com o JOIN direto sobre os empréstimos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--emprestimos', type=int, nargs='+', default=[1_000_000, 3_000_000])
+        parser.add_argument('--livros', type=int, default=50_000)
+        parser.add_argument('--usuarios', type=int, default=100_000)
+        parser.add_argument('--novos', type=int, default=5_000, help='Empréstimos da rodada incremental.')
+        parser.add_argument('--vizinhos', type=int, default=VIZINHOS_PADRAO)
+        parser.add_argument('--consultas', type=int, default=10, help='Livros consultados na comparação com o JOIN.')
+        parser.add_argument('--semente', type=int, default=42)
+
+    def handle(self, *args, **options):
+        aleatorio = random.Random(options['semente'])
+        quantidade = options['vizinhos']
+        for total in options['emprestimos']:
+            self.stdout.write(
+                f"\n{total} empréstimos, {options['livros']} livros, {options['usuarios']} leitores"
+            )
+            pares = self._gerar(total, options['livros'], options['usuarios'], aleatorio)
+            historico, novos = pares[:-options['novos']], pares[-options['novos']:]
+
+            matriz, segundos = self._cronometrar(MatrizLeitura, historico)
+            self.stdout.write(f"  matriz CSR/CSC ({len(matriz)} pares leitor-livro): {segundos:8.2f} s")
+
+            listas, segundos = self._cronometrar(
+                lambda: {livro: matriz.vizinhos(livro, quantidade) for livro in matriz.livros()}
+            )
+            self.stdout.write(
+                f"  top-{quantidade} de {len(listas)} livros:{'':17}{segundos:8.2f} s "
+                f"({segundos / max(len(listas), 1) * 1000:.2f} ms/livro)"
+            )
+
+            (alteradas, livros), segundos = self._cronometrar(
+                self._incremental, matriz, listas, novos, quantidade
+            )
+            self.stdout.write(
+                f"  incremental, {len(novos)} empréstimos novos:{'':5}{segundos:8.2f} s "
+                f"({len(livros)} livros recontados)"
+            )
+
+            completa = MatrizLeitura(historico + novos)
+            divergentes = sum(1 for livro in livros if alteradas[livro] != completa.vizinhos(livro, quantidade))
+            self.stdout.write(f"  incremental x reconstrução: {divergentes} listas divergentes")
+
+            listas.update(alteradas)
+            self._comparar_consultas(historico + novos, listas, quantidade, options['consultas'], aleatorio)
+
+    def _gerar(self, total, livros, usuarios, aleatorio):
+        # Popularidade dos livros em lei de potência; atividade dos leitores exponencial, com a
+        # mesma regra de leitores_ignorados aplicada por último.
+        pesos_livros = list(accumulate(1 / posto ** 0.8 for posto in range(1, livros + 1)))
+        pesos_usuarios = list(accumulate(aleatorio.expovariate(1) for _ in range(usuarios)))
+        livro_ids = aleatorio.choices(range(1, livros + 1), cum_weights=pesos_livros, k=total)
+        usuario_ids = aleatorio.choices(range(1, usuarios + 1), cum_weights=pesos_usuarios, k=total)
+        por_usuario = Counter(usuario_ids)
+        return [
+            (usuario, livro) for usuario, livro in zip(usuario_ids, livro_ids)
+            if por_usuario[usuario] <= LIMITE_LEITOR_PADRAO
+        ]
+
+    def _incremental(self, matriz, listas, novos, quantidade):
+        # O que atualizar_recomendacoes faz com o banco, aqui sobre a matriz em memória.
+        linha_do_usuario = {usuario: linha for linha, usuario in enumerate(matriz.leitores)}
+        historicos = {
+            usuario: set(matriz.livros_da_linha(linha_do_usuario[usuario]))
+            for usuario, _ in novos if usuario in linha_do_usuario
+        }
+        pares = pares_novos(historicos, novos)
+        livros = {livro for par in pares for livro in par}
+        leitores_novos = defaultdict(set)
+        for usuario, livro in novos:
+            leitores_novos[livro].add(usuario)
+        leitores = {livro: matriz.leitores_do_livro(livro) | leitores_novos[livro] for livro in livros}
+        guardadas = {livro: listas.get(livro, []) for livro in livros}
+        return atualizar_vizinhos(guardadas, pares, leitores, quantidade), livros
+
+    def _comparar_consultas(self, pares, listas, quantidade, consultas, aleatorio):
+        conexao = sqlite3.connect(':memory:')
+        conexao.execute('CREATE TABLE emprestimo (usuario_id INTEGER, livro_id INTEGER)')
+        conexao.executemany('INSERT INTO emprestimo VALUES (?, ?)', pares)
+        conexao.execute('CREATE INDEX emprestimo_livro ON emprestimo (livro_id, usuario_id)')
+        conexao.execute('CREATE INDEX emprestimo_usuario ON emprestimo (usuario_id, livro_id)')
+        conexao.execute('CREATE TABLE recomendacao (livro_id INTEGER, posicao INTEGER, recomendado_id INTEGER, '
+                        'leitores INTEGER, PRIMARY KEY (livro_id, posicao))')
+        conexao.executemany('INSERT INTO recomendacao VALUES (?, ?, ?, ?)', (
+            (livro, posicao, recomendado, leitores)
+            for livro, vizinhos in listas.items()
+            for posicao, (recomendado, leitores) in enumerate(vizinhos, 1)
+        ))
+        conexao.commit()
+
+        # Metade entre os livros mais populares (os ids baixos), metade ao acaso.
+        livros = sorted(listas)
+        amostra = livros[:consultas // 2] + aleatorio.sample(livros, consultas - consultas // 2)
+
+        def consultar(sql, *parametros):
+            return self._cronometrar(lambda: conexao.execute(sql, parametros).fetchall())
+
+        direto = [consultar(SQL_DIRETO, livro, quantidade) for livro in amostra]
+        guardado = [consultar(SQL_GUARDADO, livro) for livro in amostra]
+        iguais = all(linhas_d == linhas_g for (linhas_d, _), (linhas_g, _) in zip(direto, guardado))
+        direto = [segundos * 1000 for _, segundos in direto]
+        guardado = [segundos * 1000 for _, segundos in guardado]
+        self.stdout.write(
+            f"  consulta por livro (mediana / pior): JOIN direto {statistics.median(direto):9.2f} / "
+            f"{max(direto):9.2f} ms   guardada {statistics.median(guardado):.3f} / {max(guardado):.3f} ms   "
+            f"mesmas listas: {'sim' if iguais else 'não'}"
+        )
+        conexao.close()
+
+    def _cronometrar(self, funcao, *args):
+        inicio = time.perf_counter()
+        resultado = funcao(*args)
+        return resultado, time.perf_counter() - inicio
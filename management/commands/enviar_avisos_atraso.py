@@ -0,0 +1,63 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from biblioteca.avisos import TAMANHO_ENVIO_PADRAO, TAMANHO_LOTE_PADRAO, enviar_avisos_atraso, intervalo_padrao
+from biblioteca.travas import adquirir_trava, liberar_trava
+
+
+CHAVE_TRAVA = 'biblioteca:avisos_atraso:em_andamento'
+TEMPO_TRAVA = 6 * 60 * 60
+
+
+class Command(BaseCommand):
+    help = (
+        'Envia por e-mail os avisos de empréstimos vencidos, um por usuário, e registra o envio em cada '
+        'empréstimo. Feito para rodar agendado (cron, agendador de tarefas): repetir não reenvia avisos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE_PADRAO, help='Empréstimos lidos por consulta.')
+        parser.add_argument('--envio', type=int, default=TAMANHO_ENVIO_PADRAO, help='E-mails por grupo de envio.')
+        parser.add_argument(
+            '--intervalo-dias', type=int,
+            help='Reavisa empréstimos ainda vencidos depois de N dias (0: avisa uma vez só). '
+                 'Padrão: BIBLIOTECA_AVISO_ATRASO_INTERVALO_DIAS ou 7.',
+        )
+
+    def handle(self, *args, **options):
+        if options['intervalo_dias'] is None:
+            intervalo = intervalo_padrao()
+        else:
+            intervalo = timedelta(days=options['intervalo_dias']) if options['intervalo_dias'] else None
+
+        # Duas execuções ao mesmo tempo mandariam o mesmo aviso duas vezes. A trava fica no banco: com o
+        # cache local de cada processo, duas execuções agendadas nunca se veriam.
+        dono = adquirir_trava(CHAVE_TRAVA, TEMPO_TRAVA)
+        if dono is None:
+            raise CommandError("Já há um envio de avisos em andamento.")
+
+        inicio = time.perf_counter()
+
+        def ao_enviar_lote(resultado):
+            decorrido = time.perf_counter() - inicio
+            self.stdout.write(
+                f"  {resultado.avisos} avisos, {resultado.emprestimos} empréstimos "
+                f"({resultado.avisos / decorrido:.0f} e-mails/s)"
+            )
+
+        try:
+            resultado = enviar_avisos_atraso(
+                intervalo=intervalo,
+                tamanho_lote=options['lote'],
+                tamanho_envio=options['envio'],
+                ao_enviar_lote=ao_enviar_lote,
+            )
+        finally:
+            liberar_trava(CHAVE_TRAVA, dono)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado.avisos} avisos enviados cobrindo {resultado.emprestimos} empréstimos vencidos "
+            f"em {time.perf_counter() - inicio:.1f}s."
+        ))
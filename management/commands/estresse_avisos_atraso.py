@@ -0,0 +1,116 @@
+import time
+import tracemalloc
+from collections import Counter
+from datetime import timedelta
+
+from django.core import mail
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+
+from biblioteca.avisos import TAMANHO_ENVIO_PADRAO, TAMANHO_LOTE_PADRAO, enviar_avisos_atraso
+from biblioteca.models import Emprestimo, Livro, Usuario
+
+
+class Command(BaseCommand):
+    help = (
+        'Gera empréstimos vencidos num banco de teste e roda o envio de avisos com o backend de e-mail '
+        'locmem: confere um e-mail por usuário, que a segunda execução não reenvia nada e o pico de memória.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vencidos', type=int, default=200000)
+        parser.add_argument('--usuarios', type=int, default=50000)
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE_PADRAO)
+        parser.add_argument('--envio', type=int, default=TAMANHO_ENVIO_PADRAO)
+
+    def handle(self, *args, **options):
+        nome_original = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+                mail.outbox = []
+                self._executar(options)
+        finally:
+            connection.creation.destroy_test_db(nome_original, verbosity=0)
+
+    def _popular(self, vencidos, usuarios):
+        Usuario.objects.bulk_create(
+            Usuario(login=f'atraso{i}', reader_name=f'Leitor {i}', password='!',
+                    email=f'atraso{i}@exemplo.org' if i % 10 else None)
+            for i in range(usuarios)
+        )
+        usuario_ids = list(Usuario.objects.order_by('id').values_list('id', flat=True))
+        livro = Livro.objects.create(titulo='Livro atrasado', autor='Autor', ano_publicacao=2000, genero='Romance')
+        agora = timezone.now()
+        for inicio in range(0, vencidos, 10000):
+            Emprestimo.objects.bulk_create(
+                Emprestimo(
+                    livro=livro, usuario_id=usuario_ids[i % len(usuario_ids)],
+                    data_devolucao_prevista=agora - timedelta(days=1 + i % 30),
+                )
+                for i in range(inicio, min(inicio + 10000, vencidos))
+            )
+        # Ruído que não deve gerar aviso: empréstimos no prazo e devolvidos.
+        Emprestimo.objects.bulk_create([
+            Emprestimo(livro=livro, usuario_id=usuario_ids[0], data_devolucao_prevista=agora + timedelta(days=3)),
+            Emprestimo(livro=livro, usuario_id=usuario_ids[1], data_devolucao_prevista=agora - timedelta(days=5),
+                       devolvido=True, data_devolucao=agora),
+        ])
+
+    def _executar(self, options):
+        self.stdout.write(f"Gerando {options['vencidos']} empréstimos vencidos de {options['usuarios']} usuários...")
+        self._popular(options['vencidos'], options['usuarios'])
+        esperados = Emprestimo.objects.vencidos().exclude(usuario__email__isnull=True)
+        emprestimos_esperados = esperados.count()
+        usuarios_esperados = esperados.values('usuario_id').distinct().count()
+
+        destinatarios = Counter()
+        linhas_enviadas = 0
+
+        def ao_enviar_lote(resultado):
+            nonlocal linhas_enviadas
+            # Esvazia a caixa do locmem a cada grupo: a medição de memória é do envio, não da caixa.
+            for mensagem in mail.outbox:
+                destinatarios.update(mensagem.to)
+                linhas_enviadas += mensagem.body.count('\n- ')
+            mail.outbox.clear()
+
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        resultado = enviar_avisos_atraso(
+            tamanho_lote=options['lote'], tamanho_envio=options['envio'], ao_enviar_lote=ao_enviar_lote,
+        )
+        duracao = time.perf_counter() - inicio
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.stdout.write(
+            f"1ª execução: {resultado.avisos} avisos, {resultado.emprestimos} empréstimos em {duracao:.1f}s "
+            f"({resultado.avisos / duracao:.0f} e-mails/s), pico de memória {pico / 1024 / 1024:.1f} MB"
+        )
+        repetidos = [email for email, vezes in destinatarios.items() if vezes > 1]
+        if (resultado.avisos != usuarios_esperados or len(destinatarios) != usuarios_esperados or repetidos
+                or resultado.emprestimos != emprestimos_esperados or linhas_enviadas != emprestimos_esperados):
+            raise CommandError(
+                f"Esperava {usuarios_esperados} avisos cobrindo {emprestimos_esperados} empréstimos; saíram "
+                f"{resultado.avisos} avisos para {len(destinatarios)} destinatários ({len(repetidos)} repetidos) "
+                f"com {linhas_enviadas} empréstimos."
+            )
+
+        segunda = enviar_avisos_atraso(tamanho_lote=options['lote'], tamanho_envio=options['envio'])
+        self.stdout.write(f"2ª execução: {segunda.avisos} avisos")
+        if segunda.avisos or mail.outbox:
+            raise CommandError("A segunda execução reenviou avisos já registrados.")
+
+        reaviso = enviar_avisos_atraso(
+            agora=timezone.now() + timedelta(days=8), intervalo=timedelta(days=7),
+            tamanho_lote=options['lote'], tamanho_envio=options['envio'],
+            ao_enviar_lote=lambda resultado: mail.outbox.clear(),
+        )
+        self.stdout.write(f"Oito dias depois, com intervalo de 7: {reaviso.avisos} avisos")
+        if reaviso.avisos != usuarios_esperados:
+            raise CommandError(f"Esperava reavisar {usuarios_esperados} usuários, saíram {reaviso.avisos}.")
+
+        self.stdout.write(self.style.SUCCESS('Avisos enviados uma vez por usuário e registrados.'))
@@ -0,0 +1,95 @@
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.backends.base import SessionBase
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+
+from biblioteca.models import Usuario
+
+
+# (nome da URL, query string) de cada listagem; a query string exercita os filtros de busca.
+CONSULTAS_POR_VIEW = [
+    ('books_page', ''),
+    ('books_page', 'query=memorias'),
+    ('usuarios_page', ''),
+    ('usuarios_page', 'query=silva'),
+    ('emprestimos_page', ''),
+    ('pesquisar_emprestimos', 'query=silva'),
+    ('devolucao_page', ''),
+    ('emprestimos_vencidos', ''),
+    ('autocompletar_livros', 'q=mem&disponiveis=1'),
+    ('autocompletar_usuarios', 'q=mar'),
+]
+
+
+class _CapturaConsultas:
+    def __init__(self):
+        self.consultas = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            self.consultas.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def requisicao_simulada(caminho, usuario, query_string=''):
+    # Chama a view direto, sem middleware: sessão em memória e mensagens em cookie.
+    request = RequestFactory().get(f'{caminho}?{query_string}' if query_string else caminho)
+    request.user = usuario
+    request.session = SessionBase()
+    request._messages = FallbackStorage(request)
+    return request
+
+
+def _explicar(cursor, sql, params):
+    if connection.vendor == 'sqlite':
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [linha[-1] for linha in cursor.fetchall()]
+    if connection.vendor == 'microsoft':
+        cursor.execute('SET SHOWPLAN_TEXT ON')
+        try:
+            cursor.execute(sql, params)
+            linhas = []
+            while True:
+                linhas.extend(linha[0] for linha in cursor.fetchall())
+                if not cursor.nextset():
+                    break
+            return linhas
+        finally:
+            cursor.execute('SET SHOWPLAN_TEXT OFF')
+    cursor.execute(f'EXPLAIN {sql}', params)
+    return [' | '.join(str(coluna) for coluna in linha) for linha in cursor.fetchall()]
+
+
+class Command(BaseCommand):
+    help = 'Executa cada listagem e mostra o plano (EXPLAIN) de todas as consultas SQL que ela faz.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuario', help='Login usado para acessar as páginas (padrão: primeiro superusuário).')
+        parser.add_argument('--view', action='append', help='Limita às URLs com este nome (pode repetir).')
+
+    def handle(self, *args, **options):
+        if options['usuario']:
+            usuario = Usuario.objects.filter(login=options['usuario']).first()
+        else:
+            usuario = Usuario.objects.filter(is_superuser=True).order_by('id').first()
+        if usuario is None:
+            raise CommandError('Nenhum usuário encontrado; informe --usuario com um administrador.')
+
+        for nome, query_string in CONSULTAS_POR_VIEW:
+            if options['view'] and nome not in options['view']:
+                continue
+            caminho = reverse(nome)
+            request = requisicao_simulada(caminho, usuario, query_string)
+
+            captura = _CapturaConsultas()
+            with connection.execute_wrapper(captura):
+                resolve(caminho).func(request)
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\n{nome} {query_string}'.rstrip()))
+            with connection.cursor() as cursor:
+                for sql, params in captura.consultas:
+                    self.stdout.write(f'  {sql}')
+                    for linha in _explicar(cursor, sql, params):
+                        self.stdout.write(self.style.SUCCESS(f'    -> {linha}'))
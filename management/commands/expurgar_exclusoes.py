@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from biblioteca.exclusao import TAMANHO_LOTE_PADRAO, expurgar_exclusoes
+from biblioteca.travas import adquirir_trava, liberar_trava
+
+
+CHAVE_TRAVA = 'biblioteca:expurgo_exclusoes:em_andamento'
+TEMPO_TRAVA = 6 * 60 * 60
+
+
+class Command(BaseCommand):
+    help = (
+        'Apaga o histórico (empréstimos, reservas, exemplares) dos livros e usuários excluídos, em lotes '
+        'com uma transação cada, e depois os próprios registros. Feito para rodar agendado; interrompido, '
+        'basta rodar de novo.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE_PADRAO, help='Registros apagados por transação.')
+        parser.add_argument('--maximo', type=int, help='Expurga no máximo N exclusões (as demais ficam para a próxima).')
+        parser.add_argument('--pausa', type=float, default=0, help='Segundos de espera entre lotes.')
+
+    def handle(self, *args, **options):
+        dono = adquirir_trava(CHAVE_TRAVA, TEMPO_TRAVA)
+        if dono is None:
+            raise CommandError("Já há um expurgo em andamento.")
+
+        inicio = time.perf_counter()
+
+        def ao_apagar_lote(exclusao):
+            self.stdout.write(
+                f"  {exclusao}: {exclusao.registros_apagados}/{exclusao.registros_total} registros "
+                f"({exclusao.percentual}%)"
+            )
+
+        try:
+            resultado = expurgar_exclusoes(
+                tamanho_lote=options['lote'],
+                maximo=options['maximo'],
+                pausa=options['pausa'],
+                ao_apagar_lote=ao_apagar_lote,
+            )
+        finally:
+            liberar_trava(CHAVE_TRAVA, dono)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado.exclusoes} exclusões concluídas, {resultado.registros} registros apagados "
+            f"em {time.perf_counter() - inicio:.1f}s."
+        ))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from biblioteca.dados_sinteticos import TAMANHO_LOTE_PADRAO, gerar_dados
+
+
+class Command(BaseCommand):
+    help = 'Preenche o banco com livros, usuários e empréstimos sintéticos para testes de escala.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--livros', type=int, default=10000)
+        parser.add_argument('--usuarios', type=int, default=1000)
+        parser.add_argument('--emprestimos', type=int, default=50000)
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE_PADRAO)
+        parser.add_argument('--semente', type=int, default=None)
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+
+        def ao_progresso(tipo, criados):
+            decorrido = time.perf_counter() - inicio
+            self.stdout.write(f"  {criados} {tipo} ({decorrido:.1f}s)")
+
+        gerar_dados(
+            livros=options['livros'],
+            usuarios=options['usuarios'],
+            emprestimos=options['emprestimos'],
+            semente=options['semente'],
+            tamanho_lote=options['lote'],
+            ao_progresso=ao_progresso,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Dados gerados em {time.perf_counter() - inicio:.1f}s."))
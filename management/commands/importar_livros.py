@@ -0,0 +1,75 @@
+import csv
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from biblioteca.importacao import LEITORES, TAMANHO_LOTE_PADRAO, abrir_texto, detectar_formato, importar_livros
+
+
+class Command(BaseCommand):
+    help = 'Importa livros de um arquivo CSV ou JSONL (titulo, autor, ano_publicacao, genero).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo')
+        parser.add_argument('--formato', choices=sorted(LEITORES), help='Padrão: deduzido pela extensão.')
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE_PADRAO, help='Livros gravados por transação.')
+        parser.add_argument(
+            '--checkpoint',
+            help='Arquivo com a última linha gravada. Se existir, a importação continua dali.',
+        )
+        parser.add_argument('--erros', help='Grava as linhas rejeitadas neste CSV (linha, erro).')
+
+    def handle(self, *args, **options):
+        caminho = options['arquivo']
+        if not os.path.exists(caminho):
+            raise CommandError(f"Arquivo não encontrado: {caminho}")
+        formato = options['formato'] or detectar_formato(caminho)
+        checkpoint = options['checkpoint']
+
+        a_partir_de = 0
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as arquivo_checkpoint:
+                a_partir_de = int(arquivo_checkpoint.read().strip() or 0)
+            self.stdout.write(f"Retomando a partir da linha {a_partir_de + 1}.")
+
+        inicio = time.perf_counter()
+
+        def ao_gravar_lote(resultado):
+            if checkpoint:
+                with open(checkpoint, 'w') as arquivo_checkpoint:
+                    arquivo_checkpoint.write(str(resultado.ultima_linha_gravada))
+            decorrido = time.perf_counter() - inicio
+            self.stdout.write(
+                f"  linha {resultado.ultima_linha_gravada}: {resultado.importadas} importados, "
+                f"{len(resultado.erros)} rejeitados ({resultado.importadas / decorrido:.0f} livros/s)"
+            )
+
+        with open(caminho, 'rb') as arquivo:
+            resultado = importar_livros(
+                LEITORES[formato](abrir_texto(arquivo)),
+                tamanho_lote=options['lote'],
+                a_partir_de=a_partir_de,
+                ao_gravar_lote=ao_gravar_lote,
+            )
+
+        if checkpoint:
+            with open(checkpoint, 'w') as arquivo_checkpoint:
+                arquivo_checkpoint.write(str(resultado.ultima_linha_gravada))
+
+        if options['erros'] and resultado.erros:
+            with open(options['erros'], 'w', newline='', encoding='utf-8') as arquivo_erros:
+                escritor = csv.writer(arquivo_erros)
+                escritor.writerow(['linha', 'erro'])
+                escritor.writerows(resultado.erros)
+
+        for numero, erro in resultado.erros[:20]:
+            self.stderr.write(f"  linha {numero}: {erro}")
+        if len(resultado.erros) > 20:
+            self.stderr.write(f"  ... e mais {len(resultado.erros) - 20} linhas rejeitadas.")
+
+        decorrido = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado.importadas} livros importados ({resultado.titulos_novos} títulos novos) e "
+            f"{len(resultado.erros)} rejeitados de {resultado.lidas} linhas em {decorrido:.1f}s."
+        ))
@@ -0,0 +1,67 @@
+import csv
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from biblioteca.importacao import LEITORES, abrir_texto, detectar_formato
+from biblioteca.provisionamento import TAMANHO_LOTE_PADRAO, TIPOS_USUARIO, provisionar_usuarios
+
+
+class Command(BaseCommand):
+    help = (
+        'Cadastra usuários em lote a partir de um arquivo CSV ou JSONL '
+        '(login, email, reader_name, reader_contact, reader_address, reader_ref_id, tipo_usuario, senha).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo')
+        parser.add_argument('--formato', choices=sorted(LEITORES), help='Padrão: deduzido pela extensão.')
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE_PADRAO, help='Usuários gravados por transação.')
+        parser.add_argument('--processos', type=int, help='Processos para calcular os hashes (padrão: núcleos da máquina).')
+        parser.add_argument(
+            '--tipos', nargs='+', choices=sorted(TIPOS_USUARIO), default=['membro_comum'],
+            help='Tipos de usuário aceitos no arquivo; os demais são rejeitados.',
+        )
+        parser.add_argument('--erros', help='Grava as linhas rejeitadas neste CSV (linha, erro).')
+
+    def handle(self, *args, **options):
+        caminho = options['arquivo']
+        if not os.path.exists(caminho):
+            raise CommandError(f"Arquivo não encontrado: {caminho}")
+        formato = options['formato'] or detectar_formato(caminho)
+
+        inicio = time.perf_counter()
+
+        def ao_gravar_lote(resultado):
+            decorrido = time.perf_counter() - inicio
+            self.stdout.write(
+                f"  linha {resultado.ultima_linha_gravada}: {resultado.importadas} cadastrados, "
+                f"{len(resultado.erros)} rejeitados ({resultado.importadas / decorrido:.0f} usuários/s)"
+            )
+
+        with open(caminho, 'rb') as arquivo:
+            resultado = provisionar_usuarios(
+                LEITORES[formato](abrir_texto(arquivo)),
+                tamanho_lote=options['lote'],
+                processos=options['processos'],
+                tipos_permitidos=options['tipos'],
+                ao_gravar_lote=ao_gravar_lote,
+            )
+
+        if options['erros'] and resultado.erros:
+            with open(options['erros'], 'w', newline='', encoding='utf-8') as arquivo_erros:
+                escritor = csv.writer(arquivo_erros)
+                escritor.writerow(['linha', 'erro'])
+                escritor.writerows(resultado.erros)
+
+        for numero, erro in resultado.erros[:20]:
+            self.stderr.write(f"  linha {numero}: {erro}")
+        if len(resultado.erros) > 20:
+            self.stderr.write(f"  ... e mais {len(resultado.erros) - 20} linhas rejeitadas.")
+
+        decorrido = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"{resultado.importadas} usuários cadastrados e {len(resultado.erros)} rejeitados "
+            f"de {resultado.lidas} linhas em {decorrido:.1f}s."
+        ))
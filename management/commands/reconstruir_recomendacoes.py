@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from biblioteca.recomendacoes import reconstruir_recomendacoes
+from biblioteca.travas import adquirir_trava, liberar_trava
+
+
+# A mesma trava de atualizar_recomendacoes: as duas gravam as mesmas listas.
+CHAVE_TRAVA = 'biblioteca:recomendacoes:em_andamento'
+TEMPO_TRAVA = 6 * 60 * 60
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula do zero as recomendações "leitores também pegaram" de todos os livros a partir do '
+        'histórico de empréstimos (inclusive o arquivo). Rode na primeira carga e, de tempos em tempos, '
+        'fora do horário de pico.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--vizinhos', type=int,
+            help='Livros guardados por lista. Padrão: BIBLIOTECA_RECOMENDACOES_VIZINHOS ou 10.',
+        )
+
+    def handle(self, *args, **options):
+        dono = adquirir_trava(CHAVE_TRAVA, TEMPO_TRAVA)
+        if dono is None:
+            raise CommandError("Já há uma atualização de recomendações em andamento.")
+
+        inicio = time.perf_counter()
+
+        def ao_gravar_lote(resultado):
+            self.stdout.write(
+                f"  lote {resultado.lotes}: {resultado.livros} listas gravadas "
+                f"({time.perf_counter() - inicio:.1f}s)"
+            )
+
+        try:
+            resultado = reconstruir_recomendacoes(
+                quantidade=options['vizinhos'],
+                ao_gravar_lote=ao_gravar_lote,
+            )
+        finally:
+            liberar_trava(CHAVE_TRAVA, dono)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Recomendações de {resultado.livros} livros recalculadas a partir de {resultado.pares} pares "
+            f"leitor-livro em {time.perf_counter() - inicio:.1f}s."
+        ))
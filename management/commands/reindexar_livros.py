@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from biblioteca.busca import obter_backend
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói do zero o índice de busca do catálogo de livros.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=5000, help='Livros lidos por lote.')
+
+    def handle(self, *args, **options):
+        backend = obter_backend()
+        backend.reconstruir(tamanho_lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(f"Índice reconstruído com {type(backend).__name__}."))
@@ -0,0 +1,291 @@
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template as TemplateDjango
+
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+REQUISICAO_LENTA_MS_PADRAO = 1000
+CONSULTAS_NO_LOG = 5
+# Nenhum IP por padrão: atrás de um proxy reverso local toda requisição chega de 127.0.0.1.
+IPS_METRICAS_PADRAO = ()
+
+SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONSULTAS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BYTES = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# nome: (tipo, ajuda, faixas do histograma)
+METRICAS = {
+    'biblioteca_requisicoes_total': ('counter', 'Requisições atendidas por view, método e status.', None),
+    'biblioteca_requisicao_duracao_segundos': ('histogram', 'Duração total da requisição.', SEGUNDOS),
+    'biblioteca_sql_consultas': ('histogram', 'Consultas SQL por requisição, somando todos os bancos.', CONSULTAS),
+    'biblioteca_sql_duracao_segundos': ('histogram', 'Tempo gasto em SQL por requisição.', SEGUNDOS),
+    'biblioteca_template_duracao_segundos': ('histogram', 'Tempo de renderização de templates por requisição.', SEGUNDOS),
+    'biblioteca_resposta_tamanho_bytes': ('histogram', 'Tamanho do corpo das respostas que não são streaming.', BYTES),
+    'biblioteca_requisicoes_lentas_total': ('counter', 'Requisições acima de BIBLIOTECA_REQUISICAO_LENTA_MS.', None),
+}
+
+
+class _Histograma:
+    __slots__ = ('faixas', 'contagens', 'soma', 'total')
+
+    def __init__(self, faixas):
+        self.faixas = faixas
+        self.contagens = [0] * (len(faixas) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.contagens[bisect_left(self.faixas, valor)] += 1
+        self.soma += valor
+        self.total += 1
+
+
+def _rotulos(rotulos):
+    def escapar(valor):
+        return str(valor).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return ','.join(f'{nome}="{escapar(valor)}"' for nome, valor in rotulos)
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class RegistroMetricas:
+    """Contadores e histogramas do processo, no formato texto do Prometheus.
+
+    Cada processo (worker do gunicorn, por exemplo) tem o seu registro: configure o Prometheus para
+    coletar de cada um, ou rode um worker só por porta.
+    """
+
+    def __init__(self):
+        self._trava = threading.Lock()
+        self._series = {nome: {} for nome in METRICAS}
+
+    def _observar(self, nome, rotulos, valor):
+        series = self._series[nome]
+        serie = series.get(rotulos)
+        if serie is None:
+            serie = series[rotulos] = _Histograma(METRICAS[nome][2])
+        serie.observar(valor)
+
+    def _incrementar(self, nome, rotulos):
+        series = self._series[nome]
+        series[rotulos] = series.get(rotulos, 0) + 1
+
+    def registrar_requisicao(self, view, metodo, status, duracao, medicao, tamanho=None, lenta=False):
+        por_view = (('view', view),)
+        with self._trava:
+            self._incrementar('biblioteca_requisicoes_total', (('view', view), ('metodo', metodo), ('status', status)))
+            self._observar('biblioteca_requisicao_duracao_segundos', (('view', view), ('metodo', metodo)), duracao)
+            self._observar('biblioteca_sql_consultas', por_view, medicao.consultas)
+            self._observar('biblioteca_sql_duracao_segundos', por_view, medicao.sql)
+            self._observar('biblioteca_template_duracao_segundos', por_view, medicao.template)
+            if tamanho is not None:
+                self._observar('biblioteca_resposta_tamanho_bytes', por_view, tamanho)
+            if lenta:
+                self._incrementar('biblioteca_requisicoes_lentas_total', por_view)
+
+    def exportar(self):
+        linhas = []
+        with self._trava:
+            for nome, (tipo, ajuda, faixas) in METRICAS.items():
+                linhas.append(f'# HELP {nome} {ajuda}')
+                linhas.append(f'# TYPE {nome} {tipo}')
+                for rotulos, serie in sorted(self._series[nome].items()):
+                    if tipo == 'counter':
+                        linhas.append(f'{nome}{{{_rotulos(rotulos)}}} {serie}')
+                        continue
+                    acumulado = 0
+                    for limite, contagem in zip(faixas + ('+Inf',), serie.contagens):
+                        acumulado += contagem
+                        linhas.append(f'{nome}_bucket{{{_rotulos(rotulos + (("le", limite),))}}} {acumulado}')
+                    linhas.append(f'{nome}_sum{{{_rotulos(rotulos)}}} {_numero(serie.soma)}')
+                    linhas.append(f'{nome}_count{{{_rotulos(rotulos)}}} {serie.total}')
+        return '\n'.join(linhas) + '\n'
+
+    def limpar(self):
+        with self._trava:
+            self._series = {nome: {} for nome in METRICAS}
+
+
+registro = RegistroMetricas()
+
+
+class _Medicao:
+    __slots__ = ('consultas', 'sql', 'template', 'mais_lentas')
+
+    def __init__(self):
+        self.consultas = 0
+        self.sql = 0.0
+        self.template = 0.0
+        self.mais_lentas = []
+
+    def registrar_consulta(self, duracao, sql):
+        self.consultas += 1
+        self.sql += duracao
+        if len(self.mais_lentas) < CONSULTAS_NO_LOG:
+            heapq.heappush(self.mais_lentas, (duracao, self.consultas, sql))
+        elif duracao > self.mais_lentas[0][0]:
+            heapq.heapreplace(self.mais_lentas, (duracao, self.consultas, sql))
+
+
+# Medições em andamento. ContextVar em vez de atributo da conexão: sob ASGI as views síncronas
+# rodam noutra thread (com outra conexão), mas herdam o contexto da requisição.
+_medicao = ContextVar('biblioteca_medicao', default=None)
+_observadores = ContextVar('biblioteca_observadores_sql', default=())
+
+
+def medir_sql(execute, sql, params, many, context):
+    """execute_wrapper único, instalado uma vez por conexão.
+
+    Cronometra cada consulta uma vez só e a repassa a todas as medições ativas (a do MetricasMiddleware,
+    a de @orcamento_consultas); sem nenhuma, só repassa a chamada.
+    """
+    observadores = _observadores.get()
+    if not observadores:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duracao = time.perf_counter() - inicio
+        for observador in observadores:
+            observador.registrar_consulta(duracao, sql)
+
+
+def _instalar_medidor(connection):
+    if medir_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(medir_sql)
+
+
+def _instalar_nas_conexoes(**kwargs):
+    # request_started roda na thread que vai usar as conexões, também sob ASGI (como close_old_connections).
+    for conexao in connections.all():
+        _instalar_medidor(conexao)
+
+
+@contextmanager
+def observar_consultas(observador):
+    """Passa a observador.registrar_consulta(duracao, sql) as consultas deste contexto, em todos os bancos."""
+    _instalar_nas_conexoes()
+    token = _observadores.set(_observadores.get() + (observador,))
+    try:
+        yield observador
+    finally:
+        _observadores.reset(token)
+
+
+class _TemplateMedido(TemplateDjango):
+    def render(self, context=None, request=None):
+        medicao = _medicao.get()
+        if medicao is None:
+            return super().render(context, request)
+        inicio = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            medicao.template += time.perf_counter() - inicio
+
+
+class TemplatesMedidos(DjangoTemplates):
+    """Backend de templates do Django que soma o tempo de renderização na requisição medida.
+
+    Em TEMPLATES, troque 'django.template.backends.django.DjangoTemplates' por
+    'biblioteca.metricas.TemplatesMedidos'; sem ele o histograma de templates fica em zero.
+    """
+
+    def from_string(self, template_code):
+        return _TemplateMedido(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return _TemplateMedido(super().get_template(template_name).template, self)
+
+
+def nome_da_view(request):
+    # O nome da rota em urls.py: um rótulo de cardinalidade fixa, ao contrário do caminho.
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match is None or not resolver_match.view_name:
+        return 'nao_resolvida'
+    return resolver_match.view_name
+
+
+def pode_ver_metricas(request):
+    ips = getattr(settings, 'BIBLIOTECA_METRICAS_IPS', IPS_METRICAS_PADRAO)
+    if request.META.get('REMOTE_ADDR') in ips:
+        return True
+    usuario = getattr(request, 'user', None)
+    return bool(usuario and usuario.is_authenticated and usuario.is_superuser)
+
+
+class MetricasMiddleware:
+    """Mede cada requisição: duração, consultas e tempo de SQL, templates e tamanho da resposta.
+
+    Coloque-o primeiro em MIDDLEWARE para que a duração inclua os demais middlewares. Requisições
+    acima de BIBLIOTECA_REQUISICAO_LENTA_MS vão para o log com as consultas mais lentas.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.limite_lenta = getattr(settings, 'BIBLIOTECA_REQUISICAO_LENTA_MS', REQUISICAO_LENTA_MS_PADRAO) / 1000
+        request_started.connect(_instalar_nas_conexoes, dispatch_uid='biblioteca.metricas')
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        medicao = _Medicao()
+        token = _medicao.set(medicao)
+        inicio = time.perf_counter()
+        try:
+            with observar_consultas(medicao):
+                resposta = self.get_response(request)
+        finally:
+            _medicao.reset(token)
+        self._registrar(request, resposta, medicao, time.perf_counter() - inicio)
+        return resposta
+
+    async def __acall__(self, request):
+        medicao = _Medicao()
+        token = _medicao.set(medicao)
+        inicio = time.perf_counter()
+        try:
+            with observar_consultas(medicao):
+                resposta = await self.get_response(request)
+        finally:
+            _medicao.reset(token)
+        self._registrar(request, resposta, medicao, time.perf_counter() - inicio)
+        return resposta
+
+    def _registrar(self, request, resposta, medicao, duracao):
+        view = nome_da_view(request)
+        tamanho = None if resposta.streaming else len(resposta.content)
+        lenta = duracao > self.limite_lenta
+        registro.registrar_requisicao(
+            view, request.method, resposta.status_code, duracao, medicao, tamanho=tamanho, lenta=lenta,
+        )
+        if lenta:
+            consultas = ''.join(
+                f"\n  {duracao_sql * 1000:8.1f} ms  {sql}"
+                for duracao_sql, _, sql in sorted(medicao.mais_lentas, reverse=True)
+            )
+            logger.warning(
+                f"Requisição lenta: {request.method} {request.path} ({view}) em {duracao * 1000:.0f} ms; "
+                f"{medicao.consultas} consultas ({medicao.sql * 1000:.1f} ms), templates {medicao.template * 1000:.1f} ms"
+                + (f"; consultas mais lentas:{consultas}" if consultas else "")
+            )
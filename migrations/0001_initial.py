@@ -0,0 +1,79 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:21
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Livro',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('titulo', models.CharField(max_length=200, verbose_name='Título')),
+                ('autor', models.CharField(max_length=100, verbose_name='Autor')),
+                ('ano_publicacao', models.IntegerField(verbose_name='Ano de Publicação')),
+                ('genero', models.CharField(max_length=50, verbose_name='Gênero')),
+                ('disponivel', models.BooleanField(default=True, verbose_name='Disponível para Empréstimo')),
+                ('data_registro', models.DateTimeField(auto_now_add=True, verbose_name='Data de Registro')),
+            ],
+            options={
+                'verbose_name': 'Livro',
+                'verbose_name_plural': 'Livros',
+                'permissions': [('can_cadastrar_livro', 'Pode cadastrar livro'), ('can_listar_livro', 'Pode listar livro'), ('can_atualizar_livro', 'Pode atualizar livro'), ('can_excluir_livro', 'Pode excluir livro')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Usuario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('reader_ref_id', models.CharField(blank=True, max_length=100, null=True, unique=True, verbose_name='ID de Referência do Leitor')),
+                ('reader_name', models.CharField(max_length=200, verbose_name='Nome Completo')),
+                ('reader_contact', models.CharField(blank=True, max_length=50, null=True, verbose_name='Contato')),
+                ('reader_address', models.TextField(blank=True, null=True, verbose_name='Endereço')),
+                ('email', models.EmailField(blank=True, max_length=254, null=True, unique=True, verbose_name='E-mail')),
+                ('login', models.CharField(max_length=100, unique=True, verbose_name='Nome de Usuário para Login')),
+                ('tipo_usuario', models.CharField(choices=[('admin', 'Administrador'), ('funcionario', 'Funcionário'), ('membro_comum', 'Membro Comum')], default='membro_comum', max_length=20, verbose_name='Tipo de Usuário')),
+                ('is_staff', models.BooleanField(default=False, verbose_name='É da Equipe')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Está Ativo')),
+                ('is_superuser', models.BooleanField(default=False, verbose_name='É Superusuário')),
+                ('date_joined', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Data de Cadastro')),
+                ('groups', models.ManyToManyField(blank=True, help_text='The groups this user belongs to. A user will get all permissions granted to each of their groups.', related_name='user_set', related_query_name='user', to='auth.group', verbose_name='groups')),
+                ('user_permissions', models.ManyToManyField(blank=True, help_text='Specific permissions for this user.', related_name='user_set', related_query_name='user', to='auth.permission', verbose_name='user permissions')),
+            ],
+            options={
+                'verbose_name': 'Usuário',
+                'verbose_name_plural': 'Usuários',
+                'permissions': [('can_cadastrar_usuario_comum', 'Pode cadastrar usuário comum'), ('can_listar_usuario_comum', 'Pode listar usuário comum'), ('can_atualizar_usuario', 'Pode atualizar usuário')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Emprestimo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_emprestimo', models.DateTimeField(auto_now_add=True, verbose_name='Data do Empréstimo')),
+                ('data_devolucao', models.DateTimeField(blank=True, null=True, verbose_name='Data da Devolução Real')),
+                ('data_devolucao_prevista', models.DateTimeField(blank=True, null=True, verbose_name='Data de Devolução Prevista')),
+                ('devolvido', models.BooleanField(default=False, verbose_name='Devolvido')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='emprestimos_feitos', to=settings.AUTH_USER_MODEL, verbose_name='Usuário')),
+                ('livro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='emprestimos', to='biblioteca.livro', verbose_name='Livro')),
+            ],
+            options={
+                'verbose_name': 'Empréstimo',
+                'verbose_name_plural': 'Empréstimos',
+                'ordering': ['-data_emprestimo'],
+                'permissions': [('can_realizar_emprestimo', 'Pode realizar empréstimo'), ('can_realizar_devolucao', 'Pode realizar devolução'), ('can_listar_emprestimos_vencidos', 'Pode listar empréstimos vencidos'), ('can_reservar_livro', 'Pode reservar livro'), ('can_cancelar_reserva', 'Pode cancelar reserva'), ('can_editar_emprestimo', 'Pode editar empréstimo'), ('can_listar_todos_emprestimos', 'Pode listar todos os empréstimos')],
+            },
+        ),
+    ]
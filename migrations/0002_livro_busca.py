@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+def criar_indice_busca(apps, schema_editor):
+    from biblioteca.busca import BackendFTS5
+
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Livro = apps.get_model('biblioteca', 'Livro')
+    with schema_editor.connection.cursor() as cursor:
+        BackendFTS5().criar_indice(cursor)
+        linhas = list(Livro.objects.values_list('id', 'titulo', 'autor'))
+        if linhas:
+            cursor.executemany(BackendFTS5.SQL_INSERIR, linhas)
+
+
+def remover_indice_busca(apps, schema_editor):
+    from biblioteca.busca import TABELA_BUSCA_LIVRO
+
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"DROP TABLE IF EXISTS {TABELA_BUSCA_LIVRO}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indice_busca, remover_indice_busca),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:30
+
+from django.db import migrations, models
+
+
+# No SQLite o LIKE 'abc%' (istartswith) só usa índice se a coluna indexada for COLLATE NOCASE.
+# No SQL Server a collation padrão já é case-insensitive e os índices acima bastam.
+INDICES_PREFIXO_SQLITE = [
+    ('livro_titulo_nocase_idx', 'biblioteca_livro', 'titulo'),
+    ('usuario_nome_nocase_idx', 'biblioteca_usuario', 'reader_name'),
+]
+
+
+def criar_indices_prefixo(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for nome, tabela, coluna in INDICES_PREFIXO_SQLITE:
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS "{nome}" ON "{tabela}" ("{coluna}" COLLATE NOCASE)')
+
+
+def remover_indices_prefixo(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for nome, _, _ in INDICES_PREFIXO_SQLITE:
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{nome}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('biblioteca', '0002_livro_busca'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='emprestimo',
+            index=models.Index(fields=['devolvido', 'data_emprestimo'], name='emprestimo_devolvido_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emprestimo',
+            index=models.Index(condition=models.Q(('devolvido', False)), fields=['data_emprestimo', 'id'], name='emprestimo_ativo_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='emprestimo',
+            index=models.Index(condition=models.Q(('devolvido', False)), fields=['data_devolucao_prevista'], name='emprestimo_ativo_prevista_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='livro',
+            index=models.Index(fields=['disponivel', 'titulo'], name='livro_disponivel_titulo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usuario',
+            index=models.Index(fields=['reader_name', 'id'], name='usuario_nome_idx'),
+        ),
+        migrations.RunPython(criar_indices_prefixo, remover_indices_prefixo),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:42
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca', '0003_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reserva',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_reserva', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Data da Reserva')),
+                ('status', models.CharField(choices=[('aguardando', 'Aguardando'), ('disponivel', 'Disponível para Retirada'), ('atendida', 'Atendida'), ('cancelada', 'Cancelada')], default='aguardando', max_length=20, verbose_name='Situação')),
+                ('data_disponibilizacao', models.DateTimeField(blank=True, null=True, verbose_name='Separado em')),
+                ('livro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='biblioteca.livro', verbose_name='Livro')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to=settings.AUTH_USER_MODEL, verbose_name='Usuário')),
+            ],
+            options={
+                'verbose_name': 'Reserva',
+                'verbose_name_plural': 'Reservas',
+                'ordering': ['data_reserva', 'id'],
+                'indexes': [models.Index(condition=models.Q(('status', 'aguardando')), fields=['livro', 'data_reserva', 'id'], name='reserva_fila_idx'), models.Index(fields=['usuario', 'status'], name='reserva_usuario_status_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['aguardando', 'disponivel'])), fields=('livro', 'usuario'), name='reserva_aberta_unica')],
+            },
+        ),
+    ]
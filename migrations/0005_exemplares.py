@@ -0,0 +1,128 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+TAMANHO_LOTE = 5000
+
+
+def _chave_livro(titulo, autor, ano_publicacao):
+    # Mesmo título, autor e ano, ignorando maiúsculas e espaços repetidos.
+    def normalizar(texto):
+        return ' '.join((texto or '').split()).casefold()
+    return normalizar(titulo), normalizar(autor), ano_publicacao
+
+
+def mesclar_livros_repetidos(apps, schema_editor):
+    """Cada linha de Livro vira um Exemplar; linhas repetidas do mesmo título viram um só Livro."""
+    Livro = apps.get_model('biblioteca', 'Livro')
+    Exemplar = apps.get_model('biblioteca', 'Exemplar')
+    Emprestimo = apps.get_model('biblioteca', 'Emprestimo')
+    Reserva = apps.get_model('biblioteca', 'Reserva')
+
+    # Títulos sem repetição: um exemplar, disponível ou não conforme o campo antigo.
+    Livro.objects.filter(disponivel=True).update(total_exemplares=1, exemplares_disponiveis=1)
+    Livro.objects.filter(disponivel=False).update(total_exemplares=1, exemplares_disponiveis=0)
+
+    grupos = {}
+    for livro_id, titulo, autor, ano_publicacao, disponivel in (
+        Livro.objects.order_by('id').values_list('id', 'titulo', 'autor', 'ano_publicacao', 'disponivel').iterator()
+    ):
+        grupos.setdefault(_chave_livro(titulo, autor, ano_publicacao), []).append((livro_id, disponivel))
+
+    exemplares = []
+    removidos = []
+    for membros in grupos.values():
+        principal = membros[0][0]
+        exemplares.extend(Exemplar(livro_id=principal) for _ in membros)
+        if len(exemplares) >= TAMANHO_LOTE:
+            Exemplar.objects.bulk_create(exemplares)
+            exemplares = []
+        if len(membros) == 1:
+            continue
+
+        repetidos = [livro_id for livro_id, _ in membros[1:]]
+        Livro.objects.filter(id=principal).update(
+            total_exemplares=len(membros),
+            exemplares_disponiveis=sum(1 for _, disponivel in membros if disponivel),
+        )
+        # Um leitor com reserva aberta em duas cópias do mesmo título fica só com a mais antiga.
+        vistos = set()
+        for reserva_id, usuario_id in (
+            Reserva.objects.filter(livro_id__in=[livro_id for livro_id, _ in membros],
+                                   status__in=['aguardando', 'disponivel'])
+            .order_by('data_reserva', 'id').values_list('id', 'usuario_id')
+        ):
+            if usuario_id in vistos:
+                Reserva.objects.filter(id=reserva_id).update(status='cancelada')
+            vistos.add(usuario_id)
+        Emprestimo.objects.filter(livro_id__in=repetidos).update(livro_id=principal)
+        Reserva.objects.filter(livro_id__in=repetidos).update(livro_id=principal)
+        Livro.objects.filter(id__in=repetidos).delete()
+        removidos.extend(repetidos)
+    if exemplares:
+        Exemplar.objects.bulk_create(exemplares)
+
+    if removidos and schema_editor.connection.vendor == 'sqlite':
+        from biblioteca.busca import BackendFTS5
+
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(BackendFTS5.SQL_REMOVER, [(livro_id,) for livro_id in removidos])
+
+
+def restaurar_disponivel(apps, schema_editor):
+    # Os títulos mesclados não voltam a ser separados; só o campo antigo é recalculado.
+    Livro = apps.get_model('biblioteca', 'Livro')
+    Livro.objects.filter(exemplares_disponiveis__gt=0).update(disponivel=True)
+    Livro.objects.filter(exemplares_disponiveis=0).update(disponivel=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca', '0004_reserva'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Exemplar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('codigo', models.CharField(blank=True, max_length=50, null=True, unique=True, verbose_name='Código de Tombo')),
+                ('data_registro', models.DateTimeField(auto_now_add=True, verbose_name='Data de Registro')),
+                ('livro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exemplares', to='biblioteca.livro', verbose_name='Livro')),
+            ],
+            options={
+                'verbose_name': 'Exemplar',
+                'verbose_name_plural': 'Exemplares',
+            },
+        ),
+        migrations.AddField(
+            model_name='livro',
+            name='exemplares_disponiveis',
+            field=models.PositiveIntegerField(default=0, verbose_name='Exemplares Disponíveis'),
+        ),
+        migrations.AddField(
+            model_name='livro',
+            name='total_exemplares',
+            field=models.PositiveIntegerField(default=0, verbose_name='Exemplares'),
+        ),
+        migrations.RunPython(mesclar_livros_repetidos, restaurar_disponivel),
+        migrations.RemoveIndex(
+            model_name='livro',
+            name='livro_disponivel_titulo_idx',
+        ),
+        migrations.RemoveField(
+            model_name='livro',
+            name='disponivel',
+        ),
+        migrations.AddIndex(
+            model_name='livro',
+            index=models.Index(condition=models.Q(('exemplares_disponiveis__gt', 0)), fields=['titulo'], name='livro_disponivel_titulo_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='livro',
+            constraint=models.CheckConstraint(condition=models.Q(('exemplares_disponiveis__lte', models.F('total_exemplares'))), name='livro_disponiveis_ate_total'),
+        ),
+    ]
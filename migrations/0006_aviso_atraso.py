@@ -0,0 +1,22 @@
+# Generated by Django 5.1.7 on 2026-10-18 08:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca', '0005_exemplares'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emprestimo',
+            name='aviso_atraso_em',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Último Aviso de Atraso'),
+        ),
+        migrations.AddIndex(
+            model_name='emprestimo',
+            index=models.Index(condition=models.Q(('devolvido', False)), fields=['usuario', 'id'], name='emprestimo_ativo_usuario_idx'),
+        ),
+    ]
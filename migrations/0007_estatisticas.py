@@ -0,0 +1,104 @@
+# Generated by Django 5.1.7 on 2026-10-18 09:04
+
+import django.db.models.deletion
+from django.conf import settings
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+
+
+def preencher_estatisticas(apps, schema_editor):
+    """Conta o histórico já existente; daqui em diante os sinais de Emprestimo mantêm as tabelas."""
+    Emprestimo = apps.get_model('biblioteca', 'Emprestimo')
+    EstatisticaDiaria = apps.get_model('biblioteca', 'EstatisticaDiaria')
+    EstatisticaLivro = apps.get_model('biblioteca', 'EstatisticaLivro')
+    EstatisticaUsuario = apps.get_model('biblioteca', 'EstatisticaUsuario')
+    EstatisticaGenero = apps.get_model('biblioteca', 'EstatisticaGenero')
+
+    dias = defaultdict(dict)
+    por_dia = (
+        ('data_emprestimo', Q(), 'emprestimos'),
+        ('data_devolucao', Q(devolvido=True, data_devolucao__isnull=False), 'devolucoes'),
+        ('data_devolucao_prevista', Q(devolvido=False, data_devolucao_prevista__isnull=False), 'vencimentos_pendentes'),
+    )
+    for campo_data, filtro, coluna in por_dia:
+        for linha in (Emprestimo.objects.filter(filtro).order_by()
+                      .values(dia=TruncDate(campo_data, tzinfo=dt_timezone.utc)).annotate(total=Count('id'))):
+            dias[linha['dia']][coluna] = linha['total']
+    EstatisticaDiaria.objects.bulk_create(
+        (EstatisticaDiaria(data=dia, **campos) for dia, campos in dias.items()), batch_size=1000,
+    )
+
+    contagem = {'emprestimos': Count('id'), 'ativos': Count('id', filter=Q(devolvido=False))}
+    for modelo, campo in ((EstatisticaLivro, 'livro_id'), (EstatisticaUsuario, 'usuario_id'),
+                          (EstatisticaGenero, 'livro__genero')):
+        linhas = Emprestimo.objects.order_by().values(campo).annotate(**contagem)
+        modelo.objects.bulk_create(
+            (modelo(pk=linha[campo], emprestimos=linha['emprestimos'], ativos=linha['ativos']) for linha in linhas),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca', '0006_aviso_atraso'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstatisticaDiaria',
+            fields=[
+                ('data', models.DateField(primary_key=True, serialize=False, verbose_name='Data')),
+                ('emprestimos', models.IntegerField(default=0, verbose_name='Empréstimos')),
+                ('devolucoes', models.IntegerField(default=0, verbose_name='Devoluções')),
+                ('vencimentos_pendentes', models.IntegerField(default=0, verbose_name='Vencimentos Pendentes')),
+            ],
+            options={
+                'verbose_name': 'Estatística Diária',
+                'verbose_name_plural': 'Estatísticas Diárias',
+            },
+        ),
+        migrations.CreateModel(
+            name='EstatisticaGenero',
+            fields=[
+                ('emprestimos', models.IntegerField(default=0, verbose_name='Empréstimos')),
+                ('ativos', models.IntegerField(default=0, verbose_name='Empréstimos Ativos')),
+                ('genero', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='Gênero')),
+            ],
+            options={
+                'verbose_name': 'Estatística de Gênero',
+                'verbose_name_plural': 'Estatísticas de Gêneros',
+            },
+        ),
+        migrations.CreateModel(
+            name='EstatisticaLivro',
+            fields=[
+                ('emprestimos', models.IntegerField(default=0, verbose_name='Empréstimos')),
+                ('ativos', models.IntegerField(default=0, verbose_name='Empréstimos Ativos')),
+                ('livro', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='estatistica', serialize=False, to='biblioteca.livro', verbose_name='Livro')),
+            ],
+            options={
+                'verbose_name': 'Estatística de Livro',
+                'verbose_name_plural': 'Estatísticas de Livros',
+                'indexes': [models.Index(fields=['-emprestimos'], name='estatistica_livro_top_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='EstatisticaUsuario',
+            fields=[
+                ('emprestimos', models.IntegerField(default=0, verbose_name='Empréstimos')),
+                ('ativos', models.IntegerField(default=0, verbose_name='Empréstimos Ativos')),
+                ('usuario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='estatistica', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Usuário')),
+            ],
+            options={
+                'verbose_name': 'Estatística de Usuário',
+                'verbose_name_plural': 'Estatísticas de Usuários',
+                'indexes': [models.Index(fields=['-emprestimos'], name='estatistica_usuario_top_idx')],
+            },
+        ),
+        migrations.RunPython(preencher_estatisticas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.7 on 2026-10-18 09:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca', '0007_estatisticas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmprestimoArquivado',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('data_emprestimo', models.DateTimeField(verbose_name='Data do Empréstimo')),
+                ('data_devolucao', models.DateTimeField(blank=True, null=True, verbose_name='Data da Devolução Real')),
+                ('data_devolucao_prevista', models.DateTimeField(blank=True, null=True, verbose_name='Data de Devolução Prevista')),
+                ('devolvido', models.BooleanField(default=True, verbose_name='Devolvido')),
+                ('aviso_atraso_em', models.DateTimeField(blank=True, null=True, verbose_name='Último Aviso de Atraso')),
+                ('arquivado_em', models.DateTimeField(verbose_name='Arquivado em')),
+                ('livro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='emprestimos_arquivados', to='biblioteca.livro', verbose_name='Livro')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='emprestimos_arquivados', to=settings.AUTH_USER_MODEL, verbose_name='Usuário')),
+            ],
+            options={
+                'verbose_name': 'Empréstimo Arquivado',
+                'verbose_name_plural': 'Empréstimos Arquivados',
+                'ordering': ['-data_emprestimo'],
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.1.7 on 2026-10-18 09:31
+
+import django.db.models.deletion
+import django.db.models.manager
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca', '0008_emprestimo_arquivado'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='livro',
+            options={'default_manager_name': 'todos', 'permissions': [('can_cadastrar_livro', 'Pode cadastrar livro'), ('can_listar_livro', 'Pode listar livro'), ('can_atualizar_livro', 'Pode atualizar livro'), ('can_excluir_livro', 'Pode excluir livro')], 'verbose_name': 'Livro', 'verbose_name_plural': 'Livros'},
+        ),
+        migrations.AlterModelOptions(
+            name='usuario',
+            options={'default_manager_name': 'todos', 'permissions': [('can_cadastrar_usuario_comum', 'Pode cadastrar usuário comum'), ('can_listar_usuario_comum', 'Pode listar usuário comum'), ('can_atualizar_usuario', 'Pode atualizar usuário')], 'verbose_name': 'Usuário', 'verbose_name_plural': 'Usuários'},
+        ),
+        migrations.AlterModelManagers(
+            name='livro',
+            managers=[
+                ('todos', django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AlterModelManagers(
+            name='usuario',
+            managers=[
+                ('todos', django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='livro',
+            name='excluido_em',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Excluído em'),
+        ),
+        migrations.AddField(
+            model_name='usuario',
+            name='excluido_em',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Excluído em'),
+        ),
+        migrations.CreateModel(
+            name='Exclusao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('livro', 'Livro'), ('usuario', 'Usuário')], max_length=10, verbose_name='Tipo')),
+                ('objeto_id', models.BigIntegerField(verbose_name='ID do Registro')),
+                ('descricao', models.CharField(max_length=300, verbose_name='Descrição')),
+                ('solicitada_em', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Solicitada em')),
+                ('iniciada_em', models.DateTimeField(blank=True, null=True, verbose_name='Expurgo Iniciado em')),
+                ('concluida_em', models.DateTimeField(blank=True, null=True, verbose_name='Concluída em')),
+                ('registros_total', models.PositiveIntegerField(default=0, verbose_name='Registros a Apagar')),
+                ('registros_apagados', models.PositiveIntegerField(default=0, verbose_name='Registros Apagados')),
+                ('solicitada_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='exclusoes_solicitadas', to=settings.AUTH_USER_MODEL, verbose_name='Solicitada por')),
+            ],
+            options={
+                'verbose_name': 'Exclusão',
+                'verbose_name_plural': 'Exclusões',
+                'ordering': ['solicitada_em', 'id'],
+                'indexes': [models.Index(condition=models.Q(('concluida_em__isnull', True)), fields=['solicitada_em', 'id'], name='exclusao_pendente_idx')],
+            },
+        ),
+    ]
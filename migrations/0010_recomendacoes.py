@@ -0,0 +1,43 @@
+# Generated by Django 5.1.7 on 2026-10-18 09:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca', '0009_exclusao_em_segundo_plano'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadoRecomendacoes',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ultimo_emprestimo_id', models.BigIntegerField(default=0, verbose_name='Último Empréstimo Processado')),
+                ('reconstruidas_em', models.DateTimeField(blank=True, null=True, verbose_name='Reconstruídas em')),
+                ('atualizadas_em', models.DateTimeField(blank=True, null=True, verbose_name='Atualizadas em')),
+            ],
+            options={
+                'verbose_name': 'Estado das Recomendações',
+                'verbose_name_plural': 'Estado das Recomendações',
+            },
+        ),
+        migrations.CreateModel(
+            name='Recomendacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('leitores', models.PositiveIntegerField(verbose_name='Leitores em Comum')),
+                ('posicao', models.PositiveSmallIntegerField(verbose_name='Posição')),
+                ('livro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recomendacoes', to='biblioteca.livro', verbose_name='Livro')),
+                ('recomendado', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='biblioteca.livro', verbose_name='Recomendado')),
+            ],
+            options={
+                'verbose_name': 'Recomendação',
+                'verbose_name_plural': 'Recomendações',
+                'ordering': ['livro', 'posicao'],
+                'constraints': [models.UniqueConstraint(fields=('livro', 'posicao'), name='recomendacao_posicao_unica')],
+            },
+        ),
+    ]
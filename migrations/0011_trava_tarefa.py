@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca', '0010_recomendacoes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TravaTarefa',
+            fields=[
+                ('nome', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Tarefa')),
+                ('expira_em', models.DateTimeField(verbose_name='Expira em')),
+            ],
+            options={
+                'verbose_name': 'Trava de Tarefa',
+                'verbose_name_plural': 'Travas de Tarefas',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca', '0011_trava_tarefa'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='travatarefa',
+            name='dono',
+            field=models.CharField(default='', max_length=32, verbose_name='Dono'),
+        ),
+    ]
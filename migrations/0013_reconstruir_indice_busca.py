@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+TAMANHO_LOTE = 5000
+
+
+def reconstruir_indice_busca(apps, schema_editor):
+    # A mescla da 0005 e as demais migrations de dados usam models históricos,
+    # que não disparam os sinais de indexação; o índice é refeito do zero.
+    from biblioteca.busca import TABELA_BUSCA_LIVRO, BackendFTS5
+
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Livro = apps.get_model('biblioteca', 'Livro')
+    with schema_editor.connection.cursor() as cursor:
+        BackendFTS5().criar_indice(cursor)
+        cursor.execute(f"DELETE FROM {TABELA_BUSCA_LIVRO}")
+        livros = Livro.todos.filter(excluido_em__isnull=True).values_list('id', 'titulo', 'autor')
+        lote = []
+        for linha in livros.iterator(chunk_size=TAMANHO_LOTE):
+            lote.append(linha)
+            if len(lote) >= TAMANHO_LOTE:
+                cursor.executemany(BackendFTS5.SQL_INSERIR, lote)
+                lote = []
+        if lote:
+            cursor.executemany(BackendFTS5.SQL_INSERIR, lote)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('biblioteca', '0012_trava_tarefa_dono'),
+    ]
+
+    operations = [
+        migrations.RunPython(reconstruir_indice_busca, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,10 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, Func, IntegerField, Value, When
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.utils import timezone 
-from datetime import timedelta
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from .cache_catalogo import invalidar_catalogo
 
 
 class UsuarioManager(BaseUserManager):
@@ -33,6 +36,17 @@ class UsuarioManager(BaseUserManager):
         return self.create_user(login, password, **extra_fields)
 
 
+class SemExcluidosMixin:
+    # Esconde o que tem exclusão pendente. Validação de unicidade, admin e o expurgo (exclusao.py)
+    # usam o gerenciador "todos".
+    def get_queryset(self):
+        return super().get_queryset().filter(excluido_em__isnull=True)
+
+
+class UsuarioAtivoManager(SemExcluidosMixin, UsuarioManager):
+    pass
+
+
 class Usuario(AbstractBaseUser, PermissionsMixin):
     TIPO_USUARIO_CHOICES = [
         ('admin', 'Administrador'), 
@@ -62,8 +76,10 @@ class Usuario(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True, verbose_name='Está Ativo')
     is_superuser = models.BooleanField(default=False, verbose_name='É Superusuário')
     date_joined = models.DateTimeField(default=timezone.now, verbose_name='Data de Cadastro') 
+    excluido_em = models.DateTimeField(null=True, blank=True, verbose_name='Excluído em')
 
-    objects = UsuarioManager()
+    objects = UsuarioAtivoManager()
+    todos = UsuarioManager()
 
     USERNAME_FIELD = 'login' 
     REQUIRED_FIELDS = ['email', 'reader_name'] 
@@ -77,9 +93,19 @@ class Usuario(AbstractBaseUser, PermissionsMixin):
     def get_short_name(self):
         return self.reader_name
 
+    def get_session_auth_hash(self):
+        # Montado do cache pelo BackendPapeis, o usuário vem sem a senha mas com o hash da sessão pronto.
+        if 'password' not in self.__dict__ and hasattr(self, '_hash_sessao'):
+            return self._hash_sessao
+        return super().get_session_auth_hash()
+
     class Meta:
         verbose_name = 'Usuário'
         verbose_name_plural = 'Usuários'
+        default_manager_name = 'todos'
+        indexes = [
+            models.Index(fields=['reader_name', 'id'], name='usuario_nome_idx'),
+        ]
         permissions = [
             ("can_cadastrar_usuario_comum", "Pode cadastrar usuário comum"),
             ("can_listar_usuario_comum", "Pode listar usuário comum"),
@@ -87,20 +113,90 @@ class Usuario(AbstractBaseUser, PermissionsMixin):
         ]
 
 
+class LivroQuerySet(models.QuerySet):
+    def disponiveis(self):
+        return self.filter(exemplares_disponiveis__gt=0)
+
+    def cadastrar(self, titulo, autor, ano_publicacao, genero, exemplares=1):
+        """Registra exemplares novos no título já existente (mesmo título, autor e ano) ou num título novo."""
+        with transaction.atomic():
+            livro = self.filter(titulo__iexact=titulo, autor__iexact=autor,
+                                ano_publicacao=ano_publicacao).order_by('id').first()
+            criado = livro is None
+            if criado:
+                livro = self.create(titulo=titulo, autor=autor, ano_publicacao=ano_publicacao, genero=genero)
+            Exemplar.objects.registrar(livro, exemplares)
+        return livro, criado
+
+
+class LivroManager(SemExcluidosMixin, models.Manager.from_queryset(LivroQuerySet)):
+    pass
+
+
 class Livro(models.Model):
     titulo = models.CharField(max_length=200, verbose_name='Título')
     autor = models.CharField(max_length=100, verbose_name='Autor')
     ano_publicacao = models.IntegerField(verbose_name='Ano de Publicação')
     genero = models.CharField(max_length=50, verbose_name='Gênero')
-    disponivel = models.BooleanField(default=True, verbose_name='Disponível para Empréstimo')
+    # Contadores mantidos com UPDATEs condicionais e F(): o catálogo nunca conta exemplares por linha.
+    total_exemplares = models.PositiveIntegerField(default=0, verbose_name='Exemplares')
+    exemplares_disponiveis = models.PositiveIntegerField(default=0, verbose_name='Exemplares Disponíveis')
     data_registro = models.DateTimeField(auto_now_add=True, verbose_name='Data de Registro')
+    excluido_em = models.DateTimeField(null=True, blank=True, verbose_name='Excluído em')
+
+    objects = LivroManager()
+    todos = LivroQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.titulo} por {self.autor}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        livro = super().from_db(db, field_names, values)
+        # Gênero lido do banco: se mudar, as estatísticas do livro passam para o gênero novo.
+        livro._genero_carregado = livro.__dict__.get('genero')
+        return livro
+
+    @property
+    def disponivel(self):
+        return self.exemplares_disponiveis > 0
+
+    def liberar(self):
+        """Devolve um exemplar ao acervo: vai para a primeira reserva da fila ou volta à estante."""
+        reserva = Reserva.objects.entregar_ao_proximo(self.id)
+        if reserva is None:
+            # O limite no total impede que uma devolução repetida crie exemplares do nada.
+            Livro.objects.filter(id=self.id, exemplares_disponiveis__lt=F('total_exemplares')).update(
+                exemplares_disponiveis=F('exemplares_disponiveis') + 1,
+            )
+            invalidar_catalogo([self.id])
+        return reserva
+
+    def recalcular_exemplares(self):
+        """Refaz os contadores a partir dos exemplares, dos empréstimos ativos e das reservas separadas."""
+        total = self.exemplares.count()
+        ocupados = (self.emprestimos.filter(devolvido=False).count()
+                    + self.reservas.filter(status=Reserva.DISPONIVEL).count())
+        self.total_exemplares = total
+        self.exemplares_disponiveis = max(total - ocupados, 0)
+        Livro.objects.filter(id=self.id).update(
+            total_exemplares=self.total_exemplares, exemplares_disponiveis=self.exemplares_disponiveis,
+        )
+        invalidar_catalogo([self.id])
+
     class Meta:
         verbose_name = 'Livro'
         verbose_name_plural = 'Livros'
+        default_manager_name = 'todos'
+        indexes = [
+            # Autocompletar de livros disponíveis: WHERE exemplares_disponiveis > 0 ORDER BY titulo.
+            models.Index(fields=['titulo'], condition=models.Q(exemplares_disponiveis__gt=0),
+                         name='livro_disponivel_titulo_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(condition=models.Q(exemplares_disponiveis__lte=F('total_exemplares')),
+                                   name='livro_disponiveis_ate_total'),
+        ]
         permissions = [
             ("can_cadastrar_livro", "Pode cadastrar livro"),
             ("can_listar_livro", "Pode listar livro"),
@@ -108,7 +204,106 @@ class Livro(models.Model):
             ("can_excluir_livro", "Pode excluir livro"), 
         ]
 
+class ExemplarQuerySet(models.QuerySet):
+    def registrar(self, livro, quantidade=1):
+        """Cria exemplares do livro e soma aos dois contadores no mesmo UPDATE."""
+        with transaction.atomic():
+            criados = self.bulk_create(Exemplar(livro=livro) for _ in range(quantidade))
+            Livro.objects.filter(id=livro.id).update(
+                total_exemplares=F('total_exemplares') + quantidade,
+                exemplares_disponiveis=F('exemplares_disponiveis') + quantidade,
+            )
+        livro.total_exemplares += quantidade
+        livro.exemplares_disponiveis += quantidade
+        invalidar_catalogo([livro.id])
+        return criados
+
+
+class Exemplar(models.Model):
+    livro = models.ForeignKey('Livro', on_delete=models.CASCADE, related_name='exemplares', verbose_name='Livro')
+    codigo = models.CharField(max_length=50, unique=True, null=True, blank=True, verbose_name='Código de Tombo')
+    data_registro = models.DateTimeField(auto_now_add=True, verbose_name='Data de Registro')
+
+    objects = ExemplarQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.codigo or f'Exemplar {self.id}'} de '{self.livro.titulo}'"
+
+    class Meta:
+        verbose_name = 'Exemplar'
+        verbose_name_plural = 'Exemplares'
+
+
+class DiasEntre(Func):
+    # Diferença em dias de calendário entre as datas de dois DateTimeFields (fim - inicio),
+    # a mesma conta de (fim.date() - inicio.date()).days feita em Python.
+    output_field = IntegerField()
+
+    def __init__(self, fim, inicio, **extra):
+        super().__init__(fim, inicio, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, template='(CAST(%(expressions)s AS DATE))', arg_joiner=' AS DATE) - CAST(',
+            **extra_context
+        )
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, template='CAST(julianday(date(%(expressions)s)) AS INTEGER)',
+            arg_joiner=')) - julianday(date(', **extra_context
+        )
+
+    def as_microsoft(self, compiler, connection, **extra_context):
+        fim, inicio = self.source_expressions
+        return Func(inicio, fim, function='DATEDIFF', template='DATEDIFF(day, %(expressions)s)').as_sql(
+            compiler, connection, **extra_context
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='DATEDIFF', **extra_context)
+
+
+def _inicio_do_dia_utc(agora):
+    # calcular_multa compara datas em UTC, então "hoje" começa à meia-noite UTC.
+    return datetime.combine(agora.astimezone(dt_timezone.utc).date(), time.min, tzinfo=dt_timezone.utc)
+
+
+class EmprestimoQuerySet(models.QuerySet):
+    def com_multa(self, agora=None):
+        """Anota dias_atraso e valor_multa no próprio SQL, com as mesmas regras de calcular_multa."""
+        agora = agora or timezone.now()
+        hoje = _inicio_do_dia_utc(agora)
+        dias_atraso = Case(
+            When(
+                devolvido=True,
+                data_devolucao__isnull=False,
+                data_devolucao_prevista__isnull=False,
+                data_devolucao__gt=F('data_devolucao_prevista'),
+                then=DiasEntre(F('data_devolucao'), F('data_devolucao_prevista')),
+            ),
+            When(
+                devolvido=False,
+                data_devolucao_prevista__lt=hoje,
+                then=DiasEntre(Value(hoje), F('data_devolucao_prevista')),
+            ),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        return self.annotate(dias_atraso=dias_atraso).annotate(
+            valor_multa=F('dias_atraso') * Value(Emprestimo.VALOR_MULTA_POR_DIA)
+        )
+
+    def vencidos(self, agora=None):
+        return self.filter(devolvido=False, data_devolucao_prevista__lt=_inicio_do_dia_utc(agora or timezone.now()))
+
+
 class Emprestimo(models.Model):
+    VALOR_MULTA_POR_DIA = 2
+    TEMPO_MINIMO_DEVOLUCAO = timedelta(minutes=1)
+    CAMPOS_ESTATISTICAS = ('livro_id', 'usuario_id', 'data_emprestimo', 'data_devolucao',
+                           'data_devolucao_prevista', 'devolvido')
+
     livro = models.ForeignKey('Livro', on_delete=models.CASCADE, related_name='emprestimos',
                               verbose_name='Livro')
     usuario = models.ForeignKey('Usuario', on_delete=models.CASCADE, related_name='emprestimos_feitos',
@@ -119,42 +314,82 @@ class Emprestimo(models.Model):
 
     data_devolucao_prevista = models.DateTimeField(null=True, blank=True, verbose_name='Data de Devolução Prevista')
     devolvido = models.BooleanField(default=False, verbose_name='Devolvido')
+    aviso_atraso_em = models.DateTimeField(null=True, blank=True, verbose_name='Último Aviso de Atraso')
+
+    objects = EmprestimoQuerySet.as_manager()
 
     def __str__(self):
         status = "Devolvido" if self.devolvido else "Ativo"
         return f"Empréstimo de '{self.livro.titulo}' para '{self.usuario.reader_name}' ({status})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        emprestimo = super().from_db(db, field_names, values)
+        # O que as estatísticas já contaram deste empréstimo: ao salvar, só a diferença é aplicada.
+        emprestimo._contado = emprestimo.valores_estatisticas()
+        return emprestimo
+
+    def valores_estatisticas(self):
+        """Campos que decidem em que linhas das estatísticas o empréstimo conta; None se algum foi adiado."""
+        if any(campo not in self.__dict__ for campo in self.CAMPOS_ESTATISTICAS):
+            return None
+        return tuple(self.__dict__[campo] for campo in self.CAMPOS_ESTATISTICAS)
+
+    def momento_da_devolucao(self, agora=None):
+        # A devolução nunca fica registrada antes de TEMPO_MINIMO_DEVOLUCAO depois do empréstimo.
+        return max(agora or timezone.now(), self.data_emprestimo + self.TEMPO_MINIMO_DEVOLUCAO)
+
     def marcar_como_devolvido(self):
-        if not self.devolvido:
-            momento_devolucao_atual = timezone.now()
-            horario_minimo_devolucao = self.data_emprestimo + timedelta(minutes=1)
-            if momento_devolucao_atual < horario_minimo_devolucao:
-                self.data_devolucao = horario_minimo_devolucao
-            else:
-                self.data_devolucao = momento_devolucao_atual         
+        """Devolve o empréstimo; retorna False se ele já estava devolvido, mesmo que por outra requisição."""
+        from .estatisticas import registrar_emprestimos
+
+        if self.devolvido:
+            return False
+        data_devolucao = self.momento_da_devolucao()
+        with transaction.atomic():
+            # UPDATE condicional, como em devolver_em_lote: de duas devoluções simultâneas só uma muda a
+            # linha, e só ela libera o exemplar.
+            alterados = Emprestimo.objects.filter(pk=self.pk, devolvido=False).update(
+                devolvido=True, data_devolucao=data_devolucao,
+            )
+            if alterados != 1:
+                self.refresh_from_db(fields=['devolvido', 'data_devolucao'])
+                return False
             self.devolvido = True
-            self.livro.disponivel = True
-            self.livro.save()
-            self.save()
+            self.data_devolucao = data_devolucao
+            # update() não dispara os sinais de Emprestimo.
+            registrar_emprestimos([self])
+            self.livro.liberar()
+            invalidar_catalogo([self.livro_id])
+        return True
 
     def calcular_multa(self):
         if self.devolvido and self.data_devolucao and self.data_devolucao_prevista:
             if self.data_devolucao > self.data_devolucao_prevista:
                 dias_atraso = (self.data_devolucao.date() - self.data_devolucao_prevista.date()).days
-                valor_multa_por_dia = 2 
-                return dias_atraso * valor_multa_por_dia
+                return dias_atraso * self.VALOR_MULTA_POR_DIA
         elif not self.devolvido and self.data_devolucao_prevista:
             hoje = timezone.now().date()
             if hoje > self.data_devolucao_prevista.date():
                 dias_atraso_potencial = (hoje - self.data_devolucao_prevista.date()).days
-                valor_multa_por_dia = 2
-                return dias_atraso_potencial * valor_multa_por_dia
+                return dias_atraso_potencial * self.VALOR_MULTA_POR_DIA
         return 0 
 
     class Meta:
         verbose_name = 'Empréstimo'
         verbose_name_plural = 'Empréstimos'
         ordering = ['-data_emprestimo']
+        indexes = [
+            models.Index(fields=['devolvido', 'data_emprestimo'], name='emprestimo_devolvido_data_idx'),
+            # Índices parciais só com os empréstimos ativos: ficam pequenos mesmo com anos de histórico.
+            models.Index(fields=['data_emprestimo', 'id'], condition=models.Q(devolvido=False),
+                         name='emprestimo_ativo_data_idx'),
+            models.Index(fields=['data_devolucao_prevista'], condition=models.Q(devolvido=False),
+                         name='emprestimo_ativo_prevista_idx'),
+            # Varredura dos avisos de atraso: empréstimos ativos agrupados por usuário.
+            models.Index(fields=['usuario', 'id'], condition=models.Q(devolvido=False),
+                         name='emprestimo_ativo_usuario_idx'),
+        ]
         permissions = [
             ("can_realizar_emprestimo", "Pode realizar empréstimo"),
             ("can_realizar_devolucao", "Pode realizar devolução"),
@@ -163,4 +398,250 @@ class Emprestimo(models.Model):
             ("can_cancelar_reserva", "Pode cancelar reserva"),
             ("can_editar_emprestimo", "Pode editar empréstimo"),
             ("can_listar_todos_emprestimos", "Pode listar todos os empréstimos"),
-        ]
\ No newline at end of file
+        ]
+
+
+class EmprestimoArquivado(models.Model):
+    """Empréstimo devolvido há muito tempo, movido para fora de Emprestimo por arquivo.arquivar_emprestimos.
+
+    Mantém o id original. Só é lido quando o histórico antigo é pedido explicitamente.
+    """
+    CAMPOS_ESTATISTICAS = Emprestimo.CAMPOS_ESTATISTICAS
+
+    id = models.BigIntegerField(primary_key=True)
+    livro = models.ForeignKey('Livro', on_delete=models.CASCADE, related_name='emprestimos_arquivados',
+                              verbose_name='Livro')
+    usuario = models.ForeignKey('Usuario', on_delete=models.CASCADE, related_name='emprestimos_arquivados',
+                                verbose_name='Usuário')
+    data_emprestimo = models.DateTimeField(verbose_name='Data do Empréstimo')
+    data_devolucao = models.DateTimeField(null=True, blank=True, verbose_name='Data da Devolução Real')
+    data_devolucao_prevista = models.DateTimeField(null=True, blank=True, verbose_name='Data de Devolução Prevista')
+    devolvido = models.BooleanField(default=True, verbose_name='Devolvido')
+    aviso_atraso_em = models.DateTimeField(null=True, blank=True, verbose_name='Último Aviso de Atraso')
+    arquivado_em = models.DateTimeField(verbose_name='Arquivado em')
+
+    objects = EmprestimoQuerySet.as_manager()
+
+    # Excluir um empréstimo arquivado (ou o livro/usuário dele) desconta das estatísticas como em Emprestimo.
+    valores_estatisticas = Emprestimo.valores_estatisticas
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        emprestimo = super().from_db(db, field_names, values)
+        emprestimo._contado = emprestimo.valores_estatisticas()
+        return emprestimo
+
+    def __str__(self):
+        return f"Empréstimo de '{self.livro.titulo}' para '{self.usuario.reader_name}' (Arquivado)"
+
+    class Meta:
+        verbose_name = 'Empréstimo Arquivado'
+        verbose_name_plural = 'Empréstimos Arquivados'
+        ordering = ['-data_emprestimo']
+
+
+class ReservaQuerySet(models.QuerySet):
+    def abertas(self):
+        return self.filter(status__in=Reserva.STATUS_ABERTOS)
+
+    def fila(self, livro_id):
+        # Coincide com o índice parcial reserva_fila_idx: o primeiro da fila sai direto do índice.
+        return self.filter(livro_id=livro_id, status=Reserva.AGUARDANDO).order_by('data_reserva', 'id')
+
+    def entregar_ao_proximo(self, livro_id, agora=None):
+        """Separa o livro para a reserva mais antiga da fila; devolve essa reserva, ou None se não houver fila."""
+        agora = agora or timezone.now()
+        while True:
+            proxima_id = self.fila(livro_id).values_list('id', flat=True).first()
+            if proxima_id is None:
+                return None
+            # Condicional como em emprestar_livro: se a reserva foi cancelada nesse meio tempo, tenta a seguinte.
+            separada = self.filter(id=proxima_id, status=Reserva.AGUARDANDO).update(
+                status=Reserva.DISPONIVEL, data_disponibilizacao=agora,
+            )
+            if separada:
+                return self.select_related('usuario').get(id=proxima_id)
+
+
+class Reserva(models.Model):
+    AGUARDANDO = 'aguardando'
+    DISPONIVEL = 'disponivel'
+    ATENDIDA = 'atendida'
+    CANCELADA = 'cancelada'
+    STATUS_CHOICES = [
+        (AGUARDANDO, 'Aguardando'),
+        (DISPONIVEL, 'Disponível para Retirada'),
+        (ATENDIDA, 'Atendida'),
+        (CANCELADA, 'Cancelada'),
+    ]
+    STATUS_ABERTOS = (AGUARDANDO, DISPONIVEL)
+
+    livro = models.ForeignKey('Livro', on_delete=models.CASCADE, related_name='reservas', verbose_name='Livro')
+    usuario = models.ForeignKey('Usuario', on_delete=models.CASCADE, related_name='reservas', verbose_name='Usuário')
+    data_reserva = models.DateTimeField(default=timezone.now, verbose_name='Data da Reserva')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=AGUARDANDO, verbose_name='Situação')
+    data_disponibilizacao = models.DateTimeField(null=True, blank=True, verbose_name='Separado em')
+
+    objects = ReservaQuerySet.as_manager()
+
+    def __str__(self):
+        return f"Reserva de '{self.livro.titulo}' para '{self.usuario.reader_name}' ({self.get_status_display()})"
+
+    def cancelar(self):
+        """Cancela a reserva; se o livro já estava separado para ela, ele passa para o próximo da fila."""
+        with transaction.atomic():
+            status_anterior = Reserva.objects.select_for_update().filter(id=self.id).values_list('status', flat=True).first()
+            if status_anterior not in self.STATUS_ABERTOS:
+                return False
+            Reserva.objects.filter(id=self.id).update(status=self.CANCELADA)
+            self.status = self.CANCELADA
+            if status_anterior == self.DISPONIVEL:
+                self.livro.liberar()
+        return True
+
+    class Meta:
+        verbose_name = 'Reserva'
+        verbose_name_plural = 'Reservas'
+        ordering = ['data_reserva', 'id']
+        indexes = [
+            # Fila de espera de cada livro (FIFO), só com as reservas que ainda aguardam.
+            models.Index(fields=['livro', 'data_reserva', 'id'], condition=models.Q(status='aguardando'),
+                         name='reserva_fila_idx'),
+            models.Index(fields=['usuario', 'status'], name='reserva_usuario_status_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['livro', 'usuario'], condition=models.Q(status__in=['aguardando', 'disponivel']),
+                                    name='reserva_aberta_unica'),
+        ]
+
+
+class EstatisticaDiaria(models.Model):
+    """Movimento de um dia (em UTC, como calcular_multa), mantido por estatisticas.py a cada evento."""
+    data = models.DateField(primary_key=True, verbose_name='Data')
+    emprestimos = models.IntegerField(default=0, verbose_name='Empréstimos')
+    devolucoes = models.IntegerField(default=0, verbose_name='Devoluções')
+    # Empréstimos ativos com devolução prevista para o dia: a soma dos dias passados é o total em atraso.
+    vencimentos_pendentes = models.IntegerField(default=0, verbose_name='Vencimentos Pendentes')
+
+    class Meta:
+        verbose_name = 'Estatística Diária'
+        verbose_name_plural = 'Estatísticas Diárias'
+
+
+class ContagemEmprestimos(models.Model):
+    emprestimos = models.IntegerField(default=0, verbose_name='Empréstimos')
+    ativos = models.IntegerField(default=0, verbose_name='Empréstimos Ativos')
+
+    class Meta:
+        abstract = True
+
+
+class EstatisticaLivro(ContagemEmprestimos):
+    livro = models.OneToOneField('Livro', on_delete=models.CASCADE, primary_key=True, related_name='estatistica',
+                                 verbose_name='Livro')
+
+    class Meta:
+        verbose_name = 'Estatística de Livro'
+        verbose_name_plural = 'Estatísticas de Livros'
+        indexes = [models.Index(fields=['-emprestimos'], name='estatistica_livro_top_idx')]
+
+
+class EstatisticaUsuario(ContagemEmprestimos):
+    usuario = models.OneToOneField('Usuario', on_delete=models.CASCADE, primary_key=True, related_name='estatistica',
+                                   verbose_name='Usuário')
+
+    class Meta:
+        verbose_name = 'Estatística de Usuário'
+        verbose_name_plural = 'Estatísticas de Usuários'
+        indexes = [models.Index(fields=['-emprestimos'], name='estatistica_usuario_top_idx')]
+
+
+class EstatisticaGenero(ContagemEmprestimos):
+    genero = models.CharField(max_length=50, primary_key=True, verbose_name='Gênero')
+
+    class Meta:
+        verbose_name = 'Estatística de Gênero'
+        verbose_name_plural = 'Estatísticas de Gêneros'
+
+
+class Exclusao(models.Model):
+    """Livro ou usuário já escondido das listagens, à espera do expurgo dos registros que dependem dele."""
+    LIVRO = 'livro'
+    USUARIO = 'usuario'
+    TIPO_CHOICES = [
+        (LIVRO, 'Livro'),
+        (USUARIO, 'Usuário'),
+    ]
+
+    tipo = models.CharField(max_length=10, choices=TIPO_CHOICES, verbose_name='Tipo')
+    objeto_id = models.BigIntegerField(verbose_name='ID do Registro')
+    # O registro some no fim do expurgo; a descrição fica para o histórico.
+    descricao = models.CharField(max_length=300, verbose_name='Descrição')
+    solicitada_por = models.ForeignKey('Usuario', on_delete=models.SET_NULL, null=True, blank=True,
+                                       related_name='exclusoes_solicitadas', verbose_name='Solicitada por')
+    solicitada_em = models.DateTimeField(default=timezone.now, verbose_name='Solicitada em')
+    iniciada_em = models.DateTimeField(null=True, blank=True, verbose_name='Expurgo Iniciado em')
+    concluida_em = models.DateTimeField(null=True, blank=True, verbose_name='Concluída em')
+    registros_total = models.PositiveIntegerField(default=0, verbose_name='Registros a Apagar')
+    registros_apagados = models.PositiveIntegerField(default=0, verbose_name='Registros Apagados')
+
+    def __str__(self):
+        return f"Exclusão de {self.get_tipo_display().lower()} '{self.descricao}'"
+
+    @property
+    def percentual(self):
+        if self.concluida_em:
+            return 100
+        if not self.registros_total:
+            return 0
+        return min(99, 100 * self.registros_apagados // self.registros_total)
+
+    class Meta:
+        verbose_name = 'Exclusão'
+        verbose_name_plural = 'Exclusões'
+        ordering = ['solicitada_em', 'id']
+        indexes = [
+            # Fila do expurgo: só as que ainda não terminaram.
+            models.Index(fields=['solicitada_em', 'id'], condition=models.Q(concluida_em__isnull=True),
+                         name='exclusao_pendente_idx'),
+        ]
+
+
+class Recomendacao(models.Model):
+    """Um dos livros mais emprestados por quem pegou `livro`, mantido por recomendacoes.py."""
+    livro = models.ForeignKey('Livro', on_delete=models.CASCADE, related_name='recomendacoes', verbose_name='Livro')
+    recomendado = models.ForeignKey('Livro', on_delete=models.CASCADE, related_name='+', verbose_name='Recomendado')
+    # Leitores (distintos) que pegaram os dois livros.
+    leitores = models.PositiveIntegerField(verbose_name='Leitores em Comum')
+    posicao = models.PositiveSmallIntegerField(verbose_name='Posição')
+
+    class Meta:
+        verbose_name = 'Recomendação'
+        verbose_name_plural = 'Recomendações'
+        ordering = ['livro', 'posicao']
+        constraints = [
+            # Também é o índice da consulta da página do livro (livro = ? ORDER BY posicao).
+            models.UniqueConstraint(fields=['livro', 'posicao'], name='recomendacao_posicao_unica'),
+        ]
+
+
+class EstadoRecomendacoes(models.Model):
+    """Linha única: até que empréstimo as recomendações já foram atualizadas."""
+    ultimo_emprestimo_id = models.BigIntegerField(default=0, verbose_name='Último Empréstimo Processado')
+    reconstruidas_em = models.DateTimeField(null=True, blank=True, verbose_name='Reconstruídas em')
+    atualizadas_em = models.DateTimeField(null=True, blank=True, verbose_name='Atualizadas em')
+
+    class Meta:
+        verbose_name = 'Estado das Recomendações'
+        verbose_name_plural = 'Estado das Recomendações'
+
+
+class TravaTarefa(models.Model):
+    """Impede que duas execuções da mesma tarefa agendada rodem juntas, mesmo em máquinas diferentes."""
+    nome = models.CharField(max_length=100, primary_key=True, verbose_name='Tarefa')
+    dono = models.CharField(max_length=32, default='', verbose_name='Dono')
+    expira_em = models.DateTimeField(verbose_name='Expira em')
+
+    class Meta:
+        verbose_name = 'Trava de Tarefa'
+        verbose_name_plural = 'Travas de Tarefas'
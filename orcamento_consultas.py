@@ -0,0 +1,102 @@
+import logging
+from collections import namedtuple
+from functools import wraps
+
+from django.conf import settings
+from django.urls import resolve
+
+from .metricas import observar_consultas
+
+
+logger = logging.getLogger(__name__)
+
+Orcamento = namedtuple('Orcamento', ['maximo', 'tempo_maximo_ms'])
+
+
+class OrcamentoConsultasExcedido(Exception):
+    pass
+
+
+class RegistroConsultas:
+    """Conta as consultas SQL e soma o tempo gasto nelas; use com metricas.observar_consultas."""
+
+    def __init__(self):
+        self.total = 0
+        self.tempo_ms = 0.0
+        self.consultas = []
+
+    def registrar_consulta(self, duracao, sql):
+        duracao_ms = duracao * 1000
+        self.total += 1
+        self.tempo_ms += duracao_ms
+        self.consultas.append((duracao_ms, sql))
+
+    def mais_lentas(self, quantidade=5):
+        return sorted(self.consultas, key=lambda consulta: consulta[0], reverse=True)[:quantidade]
+
+    def excede(self, orcamento):
+        if self.total > orcamento.maximo:
+            return True
+        return orcamento.tempo_maximo_ms is not None and self.tempo_ms > orcamento.tempo_maximo_ms
+
+
+def orcamento_consultas(maximo, tempo_maximo_ms=None):
+    """Declara quantas consultas SQL (e, opcionalmente, quantos ms de SQL) a view pode gastar.
+
+    O registro fica em request.consultas_sql. Estourar o orçamento gera um aviso no log,
+    ou uma OrcamentoConsultasExcedido se BIBLIOTECA_ORCAMENTO_ESTRITO estiver ativo.
+    """
+    orcamento = Orcamento(maximo, tempo_maximo_ms)
+
+    def decorador(view):
+        @wraps(view)
+        def _view(request, *args, **kwargs):
+            registro = RegistroConsultas()
+            # Conta em todos os bancos: com réplicas, parte das leituras sai do primário. O mesmo
+            # execute_wrapper do MetricasMiddleware: cada consulta é cronometrada uma vez só.
+            with observar_consultas(registro):
+                resposta = view(request, *args, **kwargs)
+            request.consultas_sql = registro
+
+            if registro.excede(orcamento):
+                mensagem = (
+                    f"{view.__name__} excedeu o orçamento de consultas: {registro.total} consultas "
+                    f"({registro.tempo_ms:.1f} ms), permitido {orcamento.maximo}"
+                    + (f" ({orcamento.tempo_maximo_ms} ms)" if orcamento.tempo_maximo_ms is not None else "")
+                )
+                if getattr(settings, 'BIBLIOTECA_ORCAMENTO_ESTRITO', False):
+                    raise OrcamentoConsultasExcedido(mensagem)
+                logger.warning(mensagem)
+            return resposta
+
+        _view.orcamento_consultas = orcamento
+        return _view
+
+    return decorador
+
+
+class OrcamentoConsultasTestMixin:
+    """Asserções para TestCase: a view chamada deve respeitar o orçamento que declarou."""
+
+    def assertDentroDoOrcamento(self, url, metodo='get', dados=None, verificar_tempo=False, **extra):
+        view = resolve(url.split('?', 1)[0]).func
+        orcamento = getattr(view, 'orcamento_consultas', None)
+        if orcamento is None:
+            self.fail(f"A view de {url} não declara @orcamento_consultas.")
+
+        resposta = getattr(self.client, metodo)(url, dados, **extra)
+        registro = getattr(resposta.wsgi_request, 'consultas_sql', None)
+        if registro is None:
+            self.fail(f"A view de {url} não chegou a executar (status {resposta.status_code}).")
+
+        consultas = '\n'.join(f"{duracao:8.2f} ms  {sql}" for duracao, sql in registro.consultas)
+        self.assertLessEqual(
+            registro.total, orcamento.maximo,
+            f"{url} executou {registro.total} consultas, orçamento {orcamento.maximo}:\n{consultas}",
+        )
+        if verificar_tempo and orcamento.tempo_maximo_ms is not None:
+            self.assertLessEqual(
+                registro.tempo_ms, orcamento.tempo_maximo_ms,
+                f"{url} gastou {registro.tempo_ms:.1f} ms em SQL, orçamento {orcamento.tempo_maximo_ms} ms",
+            )
+        return resposta
@@ -0,0 +1,182 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+TAMANHO_PAGINA_PADRAO = 25
+TAMANHO_PAGINA_MAXIMO = 100
+DIRECOES = ('proxima', 'anterior')
+# Inteiros fora de um BIGINT estouram no driver do banco (OverflowError no SQLite, DataError no PostgreSQL).
+LIMITE_INTEIRO = 2 ** 63
+
+
+def _codificar_cursor(valores, direcao):
+    bruto = json.dumps({'v': valores, 'd': direcao}, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(bruto.encode()).decode().rstrip('=')
+
+
+def _decodificar_cursor(cursor):
+    try:
+        preenchimento = '=' * (-len(cursor) % 4)
+        dados = json.loads(base64.urlsafe_b64decode(cursor + preenchimento))
+        valores, direcao = dados['v'], dados['d']
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        return None, None
+    if not isinstance(valores, list) or direcao not in DIRECOES:
+        return None, None
+    return valores, direcao
+
+
+def _tamanho_pagina(request, tamanho_padrao):
+    tamanho_maximo = getattr(settings, 'BIBLIOTECA_TAMANHO_PAGINA_MAXIMO', TAMANHO_PAGINA_MAXIMO)
+    try:
+        tamanho = int(request.GET.get('tamanho', tamanho_padrao))
+    except (TypeError, ValueError):
+        tamanho = tamanho_padrao
+    return max(1, min(tamanho, tamanho_maximo))
+
+
+def _filtro_apos(campos, valores):
+    # (a, b) > (va, vb)  ==>  a > va OR (a = va AND b > vb), respeitando o sentido de cada campo.
+    filtro = Q()
+    iguais = Q()
+    for campo, valor in zip(campos, valores):
+        nome = campo.lstrip('-')
+        operador = 'lt' if campo.startswith('-') else 'gt'
+        filtro |= iguais & Q(**{f'{nome}__{operador}': valor})
+        iguais &= Q(**{nome: valor})
+    return filtro
+
+
+def _converter_valor(modelo, campo, valor):
+    # Campos anotados (ex.: dias_atraso) não existem no modelo e chegam do JSON já no tipo certo.
+    try:
+        return modelo._meta.get_field(campo).to_python(valor)
+    except FieldDoesNotExist:
+        return valor
+
+
+def _valor_valido(valor):
+    # Um cursor adulterado pode trazer listas, objetos ou inteiros enormes no lugar das chaves.
+    if isinstance(valor, (list, dict)):
+        return False
+    return not isinstance(valor, int) or -LIMITE_INTEIRO <= valor < LIMITE_INTEIRO
+
+
+def _inverter(campos):
+    return [campo[1:] if campo.startswith('-') else f'-{campo}' for campo in campos]
+
+
+class PaginaChave:
+    def __init__(self, request, itens, ordenacao, tem_proxima, tem_anterior):
+        self.request = request
+        self.itens = itens
+        self.ordenacao = ordenacao
+        self.tem_proxima = tem_proxima
+        self.tem_anterior = tem_anterior
+
+    def __iter__(self):
+        return iter(self.itens)
+
+    def __len__(self):
+        return len(self.itens)
+
+    def _chave(self, item):
+        # Aceita instâncias e dicts de values().
+        if isinstance(item, dict):
+            return [item[campo.lstrip('-')] for campo in self.ordenacao]
+        return [getattr(item, campo.lstrip('-')) for campo in self.ordenacao]
+
+    def _url(self, item, direcao):
+        parametros = self.request.GET.copy()
+        parametros['cursor'] = _codificar_cursor(self._chave(item), direcao)
+        return f'?{parametros.urlencode()}'
+
+    @property
+    def url_proxima(self):
+        return self._url(self.itens[-1], 'proxima') if self.tem_proxima else None
+
+    @property
+    def url_anterior(self):
+        return self._url(self.itens[0], 'anterior') if self.tem_anterior else None
+
+
+def _consulta_pagina(request, queryset, ordenacao, tamanho_padrao):
+    tamanho = _tamanho_pagina(request, tamanho_padrao)
+    valores, direcao = _decodificar_cursor(request.GET.get('cursor', ''))
+
+    try:
+        if valores is None or len(valores) != len(ordenacao):
+            raise ValidationError('cursor inválido')
+        valores = [
+            _converter_valor(queryset.model, campo.lstrip('-'), valor)
+            for campo, valor in zip(ordenacao, valores)
+        ]
+        if not all(_valor_valido(valor) for valor in valores):
+            raise ValidationError('cursor inválido')
+    except (ValidationError, TypeError, OverflowError):
+        # Cursor que não decodifica para as chaves da ordenação: volta à primeira página.
+        valores, direcao = None, None
+
+    if direcao == 'anterior':
+        ordem_invertida = _inverter(ordenacao)
+        consulta = queryset.filter(_filtro_apos(ordem_invertida, valores)).order_by(*ordem_invertida)
+    elif valores is not None:
+        consulta = queryset.filter(_filtro_apos(ordenacao, valores)).order_by(*ordenacao)
+    else:
+        consulta = queryset.order_by(*ordenacao)
+    return consulta[:tamanho + 1], tamanho, direcao, valores
+
+
+def _montar_pagina(request, linhas, ordenacao, tamanho, direcao, valores):
+    if direcao == 'anterior':
+        itens = linhas[:tamanho][::-1]
+        return PaginaChave(request, itens, ordenacao, tem_proxima=bool(itens), tem_anterior=len(linhas) > tamanho)
+
+    itens = linhas[:tamanho]
+    return PaginaChave(request, itens, ordenacao, tem_proxima=len(linhas) > tamanho,
+                       tem_anterior=valores is not None and bool(itens))
+
+
+def paginar_por_chave(request, queryset, ordenacao=('id',), tamanho_padrao=TAMANHO_PAGINA_PADRAO):
+    """Pagina por cursor (keyset): cada página é um WHERE sobre a última chave vista,
+    sem OFFSET, então o custo não cresce com a posição na listagem.
+
+    A ordenação precisa terminar num campo único (normalmente "id") para ser estável.
+    """
+    ordenacao = list(ordenacao)
+    consulta, tamanho, direcao, valores = _consulta_pagina(request, queryset, ordenacao, tamanho_padrao)
+    return _montar_pagina(request, list(consulta), ordenacao, tamanho, direcao, valores)
+
+
+async def apaginar_por_chave(request, queryset, ordenacao=('id',), tamanho_padrao=TAMANHO_PAGINA_PADRAO):
+    """Versão de paginar_por_chave para views assíncronas, usando o ORM assíncrono."""
+    ordenacao = list(ordenacao)
+    consulta, tamanho, direcao, valores = _consulta_pagina(request, queryset, ordenacao, tamanho_padrao)
+    linhas = [item async for item in consulta]
+    return _montar_pagina(request, linhas, ordenacao, tamanho, direcao, valores)
+
+
+def percorrer_por_chave(queryset, ordenacao=('id',), tamanho_lote=1000):
+    """Percorre o queryset inteiro em lotes de tamanho_lote, pela mesma chave da paginação.
+
+    Para tarefas em segundo plano: a memória fica limitada a um lote e cada consulta retoma
+    depois da última chave vista, então linhas alteradas entre um lote e outro não são puladas.
+    Aceita querysets de modelos ou de values().
+    """
+    ordenacao = list(ordenacao)
+    campos = [campo.lstrip('-') for campo in ordenacao]
+    consulta = queryset.order_by(*ordenacao)
+    valores = None
+    while True:
+        lote = list((consulta if valores is None else consulta.filter(_filtro_apos(ordenacao, valores)))[:tamanho_lote])
+        if lote:
+            yield lote
+        if len(lote) < tamanho_lote:
+            return
+        ultimo = lote[-1]
+        valores = [ultimo[campo] if isinstance(ultimo, dict) else getattr(ultimo, campo) for campo in campos]
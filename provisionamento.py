@@ -0,0 +1,192 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+
+from .cache_catalogo import invalidar_usuarios
+from .importacao import ResultadoImportacao
+from .models import Usuario
+
+
+TAMANHO_LOTE_PADRAO = 1000
+CAMPOS_USUARIO = ('login', 'email', 'reader_name', 'reader_contact', 'reader_address', 'reader_ref_id', 'tipo_usuario')
+CAMPOS_UNICOS = ('login', 'email', 'reader_ref_id')
+TIPOS_USUARIO = {tipo for tipo, _ in Usuario.TIPO_USUARIO_CHOICES}
+
+
+class DadosUsuarioInvalidos(ValueError):
+    pass
+
+
+def validar_dados_usuario(dados, tipos_permitidos=('membro_comum',)):
+    """Normaliza e valida uma linha de cadastro; a unicidade é verificada depois, para o lote inteiro."""
+    campos = {campo: (str(dados.get(campo) or '')).strip() for campo in CAMPOS_USUARIO}
+
+    if not campos['login']:
+        raise DadosUsuarioInvalidos("O campo de login é obrigatório.")
+    if not campos['reader_name']:
+        raise DadosUsuarioInvalidos("O nome completo é obrigatório.")
+
+    campos['tipo_usuario'] = campos['tipo_usuario'].lower() or 'membro_comum'
+    if campos['tipo_usuario'] not in TIPOS_USUARIO:
+        raise DadosUsuarioInvalidos(f"Tipo de usuário desconhecido: {campos['tipo_usuario']}.")
+    if campos['tipo_usuario'] not in tipos_permitidos:
+        raise DadosUsuarioInvalidos(f"Tipo de usuário não permitido nesta importação: {campos['tipo_usuario']}.")
+
+    if campos['email']:
+        campos['email'] = Usuario.objects.normalize_email(campos['email'])
+        try:
+            validate_email(campos['email'])
+        except ValidationError:
+            raise DadosUsuarioInvalidos(f"E-mail inválido: {campos['email']}.")
+
+    for campo, valor in campos.items():
+        field = Usuario._meta.get_field(campo)
+        if field.max_length and len(valor) > field.max_length:
+            raise DadosUsuarioInvalidos(f"{field.verbose_name} excede {field.max_length} caracteres.")
+
+    # Campos opcionais ficam nulos, não vazios: email e reader_ref_id são únicos.
+    for campo in ('email', 'reader_ref_id', 'reader_contact', 'reader_address'):
+        campos[campo] = campos[campo] or None
+
+    campos['is_staff'] = campos['tipo_usuario'] in ('admin', 'funcionario')
+    campos['is_superuser'] = campos['tipo_usuario'] == 'admin'
+    campos['senha'] = dados.get('senha') or dados.get('password') or None
+    return campos
+
+
+def _iniciar_processo():
+    # Com o método "spawn" o processo filho começa sem o Django configurado.
+    django.setup()
+
+
+class PoolHash:
+    """Calcula hashes de senha em processos separados, usando todos os núcleos."""
+
+    def __init__(self, processos=None):
+        self.processos = processos or os.cpu_count() or 1
+        self._pool = None
+        if self.processos > 1:
+            self._pool = ProcessPoolExecutor(max_workers=self.processos, initializer=_iniciar_processo)
+
+    def gerar(self, senhas):
+        if self._pool is None:
+            return [make_password(senha) for senha in senhas]
+        pedaco = max(1, len(senhas) // (self.processos * 4))
+        return list(self._pool.map(make_password, senhas, chunksize=pedaco))
+
+    def fechar(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+
+def _conflitos_no_banco(linhas):
+    """Uma consulta por campo único para o lote inteiro, no lugar de dois exists() por usuário."""
+    existentes = {}
+    for campo in CAMPOS_UNICOS:
+        valores = {campos[campo] for _, campos in linhas if campos[campo]}
+        existentes[campo] = set(
+            Usuario.todos.filter(**{f'{campo}__in': valores}).values_list(campo, flat=True)
+        ) if valores else set()
+    return existentes
+
+
+def _separar_conflitos(linhas, resultado):
+    vistos = {campo: set() for campo in CAMPOS_UNICOS}
+    existentes = _conflitos_no_banco(linhas)
+    aceitas = []
+    for numero, campos in linhas:
+        motivo = None
+        for campo in CAMPOS_UNICOS:
+            valor = campos[campo]
+            if not valor:
+                continue
+            rotulo = Usuario._meta.get_field(campo).verbose_name
+            if valor in existentes[campo]:
+                motivo = f"{rotulo} já cadastrado: {valor}."
+            elif valor in vistos[campo]:
+                motivo = f"{rotulo} repetido no arquivo: {valor}."
+            if motivo:
+                break
+        if motivo:
+            resultado.erros.append((numero, motivo))
+            continue
+        for campo in CAMPOS_UNICOS:
+            if campos[campo]:
+                vistos[campo].add(campos[campo])
+        aceitas.append((numero, campos))
+    return aceitas
+
+
+def provisionar_usuarios(linhas, tamanho_lote=TAMANHO_LOTE_PADRAO, processos=None, tipos_permitidos=('membro_comum',),
+                         ao_gravar_lote=None):
+    """Cadastra usuários em lote a partir de um iterável de (número da linha, dados).
+
+    Por lote: valida cada linha, confere login/e-mail/ID de referência com uma consulta por campo,
+    calcula os hashes das senhas num pool de processos e grava tudo com bulk_create. Linhas sem
+    senha recebem uma senha inutilizável. As rejeitadas ficam em resultado.erros como (linha, motivo).
+    """
+    resultado = ResultadoImportacao()
+    senha_inutilizavel = make_password(None)
+    lote = []
+
+    def gravar(pool):
+        aceitas = _separar_conflitos(lote, resultado)
+        com_senha = [campos['senha'] for _, campos in aceitas if campos['senha']]
+        hashes = iter(pool.gerar(com_senha))
+        usuarios = []
+        for _, campos in aceitas:
+            dados = {campo: valor for campo, valor in campos.items() if campo != 'senha'}
+            senha = next(hashes) if campos['senha'] else senha_inutilizavel
+            usuarios.append(Usuario(password=senha, **dados))
+
+        try:
+            with transaction.atomic():
+                Usuario.objects.bulk_create(usuarios, batch_size=tamanho_lote)
+                invalidar_usuarios()
+        except IntegrityError:
+            # Outro processo cadastrou alguém do lote nesse meio tempo: grava um a um e rejeita os repetidos.
+            usuarios_por_linha = list(zip((numero for numero, _ in aceitas), usuarios))
+            usuarios = []
+            for numero, usuario in usuarios_por_linha:
+                try:
+                    with transaction.atomic():
+                        usuario.save(force_insert=True)
+                except IntegrityError:
+                    resultado.erros.append((numero, f"Usuário já cadastrado: {usuario.login}."))
+                    continue
+                usuarios.append(usuario)
+
+        resultado.importadas += len(usuarios)
+        resultado.ultima_linha_gravada = lote[-1][0]
+        lote.clear()
+        if ao_gravar_lote:
+            ao_gravar_lote(resultado)
+
+    with PoolHash(processos) as pool:
+        for numero, dados in linhas:
+            resultado.lidas += 1
+            try:
+                if not isinstance(dados, dict):
+                    raise DadosUsuarioInvalidos(f"Linha ilegível: {dados}")
+                lote.append((numero, validar_dados_usuario(dados, tipos_permitidos)))
+            except DadosUsuarioInvalidos as e:
+                resultado.erros.append((numero, str(e)))
+                continue
+            if len(lote) >= tamanho_lote:
+                gravar(pool)
+        if lote:
+            gravar(pool)
+
+    resultado.erros.sort()
+    return resultado
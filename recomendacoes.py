@@ -0,0 +1,325 @@
+import heapq
+from array import array
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .cache_catalogo import invalidar_recomendacoes
+from .models import Emprestimo, EmprestimoArquivado, EstadoRecomendacoes, EstatisticaUsuario, Recomendacao
+
+
+VIZINHOS_PADRAO = 10
+LIMITE_LEITOR_PADRAO = 500
+TAMANHO_LOTE_PADRAO = 5000
+# ids por consulta com IN (...): abaixo do limite de 2100 parâmetros do SQL Server.
+IDS_POR_CONSULTA = 500
+# Empréstimos mais novos que isto ficam para a próxima rodada: uma transação ainda aberta
+# com id menor não é deixada para trás da marca.
+MARGEM_CONFIRMACAO = timedelta(minutes=1)
+DESLOCAMENTO = 32
+MASCARA = (1 << DESLOCAMENTO) - 1
+VAZIO = frozenset()
+
+
+class ResultadoRecomendacoes:
+    def __init__(self):
+        self.emprestimos = 0
+        self.pares = 0
+        self.livros = 0
+        self.lotes = 0
+
+
+def vizinhos_padrao():
+    return getattr(settings, 'BIBLIOTECA_RECOMENDACOES_VIZINHOS', VIZINHOS_PADRAO)
+
+
+def limite_leitor_padrao():
+    return getattr(settings, 'BIBLIOTECA_RECOMENDACOES_LIMITE_LEITOR', LIMITE_LEITOR_PADRAO)
+
+
+def _ordem(item):
+    # Mais leitores em comum primeiro; no empate, o menor id, para a reconstrução e a
+    # atualização incremental chegarem exatamente à mesma lista.
+    livro, leitores = item
+    return leitores, -livro
+
+
+def mais_proximos(placar, quantidade):
+    return heapq.nlargest(quantidade, ((livro, leitores) for livro, leitores in placar.items() if leitores),
+                          key=_ordem)
+
+
+class MatrizLeitura:
+    """Matriz esparsa leitor x livro (1 se o leitor já pegou o livro), em CSR e CSC.
+
+    Os vetores são array('q') contíguos, como indptr/indices do scipy.sparse: a linha i tem os
+    livros indices[indptr[i]:indptr[i + 1]] do usuário leitores[i], e a coluna de um livro tem as
+    linhas linhas[inicio:fim], com (inicio, fim) = colunas[livro]. A coocorrência entre livros é AᵀA.
+    """
+
+    def __init__(self, pares):
+        # (usuário, livro) num inteiro só: uma ordenação agrupa por leitor e junta os repetidos.
+        chaves = array('q', (usuario << DESLOCAMENTO | livro for usuario, livro in pares))
+        self.leitores = array('q')
+        self.indptr = array('q', [0])
+        self.indices = array('q')
+        anterior = None
+        for chave in sorted(chaves):
+            if chave == anterior:
+                continue
+            anterior = chave
+            usuario = chave >> DESLOCAMENTO
+            if not self.leitores or self.leitores[-1] != usuario:
+                if self.leitores:
+                    self.indptr.append(len(self.indices))
+                self.leitores.append(usuario)
+            self.indices.append(chave & MASCARA)
+        if self.leitores:
+            self.indptr.append(len(self.indices))
+
+        # Transposta por contagem, como o tocsc(): leitores por livro, depois cada linha no seu lugar.
+        contagem = Counter(self.indices)
+        self.colunas = {}
+        inicio = 0
+        for livro in sorted(contagem):
+            self.colunas[livro] = (inicio, inicio + contagem[livro])
+            inicio += contagem[livro]
+        self.linhas = array('q', bytes(self.indices.itemsize * len(self.indices)))
+        proxima = {livro: inicio for livro, (inicio, _) in self.colunas.items()}
+        for linha in range(len(self.leitores)):
+            for livro in self.livros_da_linha(linha):
+                self.linhas[proxima[livro]] = linha
+                proxima[livro] += 1
+
+    def __len__(self):
+        return len(self.indices)
+
+    def livros(self):
+        return list(self.colunas)
+
+    def livros_da_linha(self, linha):
+        return self.indices[self.indptr[linha]:self.indptr[linha + 1]]
+
+    def linhas_do_livro(self, livro):
+        inicio, fim = self.colunas.get(livro, (0, 0))
+        return self.linhas[inicio:fim]
+
+    def leitores_do_livro(self, livro):
+        return {self.leitores[linha] for linha in self.linhas_do_livro(livro)}
+
+    def coocorrencias(self, livro):
+        """Linha `livro` de AᵀA pelo algoritmo de Gustavson: a soma das linhas de A dos seus leitores.
+
+        Só toca nos livros de quem leu `livro`; nenhum par de livros sem leitor em comum é visitado.
+        """
+        soma = Counter()
+        for linha in self.linhas_do_livro(livro):
+            soma.update(self.livros_da_linha(linha))
+        del soma[livro]
+        return soma
+
+    def vizinhos(self, livro, quantidade):
+        return mais_proximos(self.coocorrencias(livro), quantidade)
+
+
+def pares_novos(historicos, emprestimos):
+    """Pares de livros (menor id, maior id) que ganharam leitor em comum com os empréstimos.
+
+    historicos (usuário -> set dos livros que ele já tinha pegado) é atualizado no lugar; pegar
+    de novo um livro já lido não muda contagem nenhuma.
+    """
+    pares = set()
+    for usuario, livro in emprestimos:
+        lidos = historicos.setdefault(usuario, set())
+        if livro in lidos:
+            continue
+        pares.update((min(livro, outro), max(livro, outro)) for outro in lidos)
+        lidos.add(livro)
+    return pares
+
+
+def atualizar_vizinhos(vizinhos, pares, leitores, quantidade):
+    """Novas listas dos livros dos pares, sem recalcular as linhas inteiras de AᵀA.
+
+    Empréstimos novos só aumentam contagens, e só as dos pares. Um livro que estava fora de uma
+    lista continua abaixo do último colocado, a menos que seja de um par: basta recontar os pares
+    (interseção dos conjuntos de leitores) e mesclar com a lista guardada.
+    vizinhos: livro -> [(recomendado, leitores)] guardados; leitores: livro -> set de usuários.
+    """
+    placares = defaultdict(dict)
+    for livro, outro in pares:
+        comum = len(leitores.get(livro, VAZIO) & leitores.get(outro, VAZIO))
+        placares[livro][outro] = comum
+        placares[outro][livro] = comum
+    novos = {}
+    for livro, placar in placares.items():
+        atual = dict(vizinhos.get(livro, ()))
+        atual.update(placar)
+        novos[livro] = mais_proximos(atual, quantidade)
+    return novos
+
+
+def _em_partes(ids):
+    ids = list(ids)
+    for inicio in range(0, len(ids), IDS_POR_CONSULTA):
+        yield ids[inicio:inicio + IDS_POR_CONSULTA]
+
+
+def leitores_ignorados(limite=None):
+    """Usuários com mais de limite empréstimos (padrão: BIBLIOTECA_RECOMENDACOES_LIMITE_LEITOR ou 500).
+
+    Um leitor com n livros soma n² entradas à matriz e diz pouco sobre a afinidade entre eles.
+    """
+    limite = limite_leitor_padrao() if limite is None else limite
+    return set(EstatisticaUsuario.objects.filter(emprestimos__gt=limite).values_list('usuario_id', flat=True))
+
+
+def _pares(ate_id=None, **filtro):
+    # Empréstimos antes do arquivo: uma linha arquivada entre as duas leituras aparece na segunda.
+    ativos = Emprestimo.objects.filter(**filtro)
+    if ate_id is not None:
+        ativos = ativos.filter(id__lte=ate_id)
+    yield from ativos.order_by().values_list('usuario_id', 'livro_id').iterator(chunk_size=10000)
+    arquivados = EmprestimoArquivado.objects.filter(**filtro).order_by()
+    yield from arquivados.values_list('usuario_id', 'livro_id').iterator(chunk_size=10000)
+
+
+def _marca_segura(agora):
+    # Percorre do id mais alto para trás só os empréstimos do último minuto.
+    corte = agora - MARGEM_CONFIRMACAO
+    recentes = Emprestimo.objects.order_by('-id').values_list('id', 'data_emprestimo')
+    for emprestimo_id, data_emprestimo in recentes.iterator(chunk_size=100):
+        if data_emprestimo < corte:
+            return emprestimo_id
+    return 0
+
+
+def _historicos(usuarios, ate_id):
+    historicos = {}
+    for parte in _em_partes(usuarios):
+        for usuario, livro in _pares(ate_id, usuario_id__in=parte):
+            historicos.setdefault(usuario, set()).add(livro)
+    return historicos
+
+
+def _leitores(livros, ignorados, ate_id):
+    # Até a mesma marca da reconstrução: um empréstimo mais novo entra na rodada seguinte.
+    leitores = {}
+    for parte in _em_partes(livros):
+        for usuario, livro in _pares(ate_id, livro_id__in=parte):
+            if usuario not in ignorados:
+                leitores.setdefault(livro, set()).add(usuario)
+    return leitores
+
+
+def _vizinhos_guardados(livros):
+    vizinhos = {}
+    for parte in _em_partes(livros):
+        guardados = Recomendacao.objects.filter(livro_id__in=parte).order_by('livro_id', 'posicao')
+        for livro, recomendado, leitores in guardados.values_list('livro_id', 'recomendado_id', 'leitores'):
+            vizinhos.setdefault(livro, []).append((recomendado, leitores))
+    return vizinhos
+
+
+def _gravar(listas):
+    """Troca as listas dos livros dados (livro -> [(recomendado, leitores)])."""
+    for parte in _em_partes(listas):
+        Recomendacao.objects.filter(livro_id__in=parte).delete()
+    Recomendacao.objects.bulk_create(
+        Recomendacao(livro_id=livro, recomendado_id=recomendado, leitores=leitores, posicao=posicao)
+        for livro, vizinhos in listas.items()
+        for posicao, (recomendado, leitores) in enumerate(vizinhos, 1)
+    )
+
+
+def recomendacoes_do_livro(livro_id, quantidade=None):
+    """Os livros que os leitores de livro_id também pegaram, em ordem: uma consulta pelo índice único."""
+    recomendacoes = (
+        Recomendacao.objects.filter(livro_id=livro_id, recomendado__excluido_em__isnull=True)
+        .select_related('recomendado').order_by('posicao')
+    )
+    return list(recomendacoes[:quantidade] if quantidade else recomendacoes)
+
+
+def reconstruir_recomendacoes(quantidade=None, limite_leitor=None, agora=None, ao_gravar_lote=None):
+    """Recalcula do zero as listas de todos os livros a partir do histórico inteiro.
+
+    Monta a MatrizLeitura com os empréstimos e o arquivo e grava as listas em lotes de
+    IDS_POR_CONSULTA livros, um por transação. Serve para a primeira carga e para limpar o que a
+    atualização incremental não desfaz (leitores que passaram do limite, históricos expurgados).
+    """
+    quantidade = quantidade or vizinhos_padrao()
+    agora = agora or timezone.now()
+    marca = _marca_segura(agora)
+    ignorados = leitores_ignorados(limite_leitor)
+    matriz = MatrizLeitura(par for par in _pares(marca) if par[0] not in ignorados)
+
+    resultado = ResultadoRecomendacoes()
+    resultado.pares = len(matriz)
+    livros = matriz.livros()
+    for parte in _em_partes(livros):
+        with transaction.atomic():
+            _gravar({livro: matriz.vizinhos(livro, quantidade) for livro in parte})
+        resultado.livros += len(parte)
+        resultado.lotes += 1
+        if ao_gravar_lote:
+            ao_gravar_lote(resultado)
+
+    # Livros que ficaram sem leitor nenhum (históricos expurgados) perdem a lista.
+    sem_leitores = set(Recomendacao.objects.order_by().values_list('livro_id', flat=True).distinct()) - set(livros)
+    for parte in _em_partes(sem_leitores):
+        Recomendacao.objects.filter(livro_id__in=parte).delete()
+    EstadoRecomendacoes.objects.update_or_create(pk=1, defaults={
+        'ultimo_emprestimo_id': marca, 'reconstruidas_em': agora, 'atualizadas_em': agora,
+    })
+    invalidar_recomendacoes()
+    return resultado
+
+
+def atualizar_recomendacoes(quantidade=None, limite_leitor=None, tamanho_lote=TAMANHO_LOTE_PADRAO, agora=None,
+                            ao_processar_lote=None):
+    """Leva às listas guardadas os empréstimos feitos desde a última rodada, em lotes de tamanho_lote.
+
+    Só os pares de livros que ganharam leitor em comum são recontados (atualizar_vizinhos): o custo
+    acompanha os empréstimos novos, não o tamanho do histórico. Cada lote grava as listas e a marca
+    do último empréstimo lido na mesma transação; interrompido, basta rodar de novo.
+    """
+    quantidade = quantidade or vizinhos_padrao()
+    agora = agora or timezone.now()
+    marca = _marca_segura(agora)
+    ignorados = leitores_ignorados(limite_leitor)
+    estado, _ = EstadoRecomendacoes.objects.get_or_create(pk=1)
+
+    resultado = ResultadoRecomendacoes()
+    while estado.ultimo_emprestimo_id < marca:
+        novos = list(
+            Emprestimo.objects.filter(id__gt=estado.ultimo_emprestimo_id, id__lte=marca)
+            .order_by('id').values_list('id', 'usuario_id', 'livro_id')[:tamanho_lote]
+        )
+        if not novos:
+            break
+        emprestimos = [(usuario, livro) for _, usuario, livro in novos if usuario not in ignorados]
+        historicos = _historicos({usuario for usuario, _ in emprestimos}, estado.ultimo_emprestimo_id)
+        pares = pares_novos(historicos, emprestimos)
+        livros = {livro for par in pares for livro in par}
+        guardados = _vizinhos_guardados(livros)
+        listas = atualizar_vizinhos(guardados, pares, _leitores(livros, ignorados, marca), quantidade)
+        alteradas = {livro: vizinhos for livro, vizinhos in listas.items() if vizinhos != guardados.get(livro, [])}
+
+        with transaction.atomic():
+            _gravar(alteradas)
+            estado.ultimo_emprestimo_id = novos[-1][0]
+            estado.atualizadas_em = agora
+            estado.save(update_fields=['ultimo_emprestimo_id', 'atualizadas_em'])
+            if alteradas:
+                invalidar_recomendacoes()
+        resultado.emprestimos += len(novos)
+        resultado.pares += len(pares)
+        resultado.livros += len(alteradas)
+        resultado.lotes += 1
+        if ao_processar_lote:
+            ao_processar_lote(resultado)
+    return resultado
@@ -0,0 +1,229 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+
+logger = logging.getLogger(__name__)
+
+PRIMARIO = DEFAULT_DB_ALIAS
+TEMPO_CONEXAO_PADRAO = 600
+ATRASO_MAXIMO_PADRAO = 5
+QUARENTENA_PADRAO = 30
+COOKIE_PRIMARIO = 'biblioteca_primario'
+# Escritas que não mudam o acervo: gravar a sessão (login, mensagens) não faz a requisição ler do primário.
+MODELOS_SEM_FIXAR = {'sessions.session'}
+
+
+def configurar_bancos(primario, replicas=(), tempo_conexao=TEMPO_CONEXAO_PADRAO):
+    """Monta DATABASES com o primário em 'default' e as réplicas em 'replica1', 'replica2', ...
+
+    As conexões ficam abertas entre requisições (CONN_MAX_AGE) e são testadas antes de serem
+    reaproveitadas (CONN_HEALTH_CHECKS), em vez de uma conexão nova por requisição. Nos testes
+    as réplicas espelham o primário (TEST.MIRROR). Valores já presentes nos dicionários prevalecem.
+
+    Ex.: DATABASES = configurar_bancos(
+        {'ENGINE': 'mssql', 'NAME': 'biblioteca', 'HOST': 'sql01', ...},
+        [{'ENGINE': 'mssql', 'NAME': 'biblioteca', 'HOST': 'sql02',
+          'OPTIONS': {'extra_params': 'ApplicationIntent=ReadOnly'}}],
+    )
+    """
+    persistente = {'CONN_MAX_AGE': tempo_conexao, 'CONN_HEALTH_CHECKS': True}
+    bancos = {PRIMARIO: {**persistente, **primario}}
+    for indice, replica in enumerate(replicas, 1):
+        bancos[f'replica{indice}'] = {**persistente, 'TEST': {'MIRROR': PRIMARIO}, **replica}
+    return bancos
+
+
+def replicas_configuradas():
+    """BIBLIOTECA_REPLICAS, ou os aliases que espelham o primário nos testes."""
+    replicas = getattr(settings, 'BIBLIOTECA_REPLICAS', None)
+    if replicas is not None:
+        return list(replicas)
+    return [
+        alias for alias, banco in settings.DATABASES.items()
+        if alias != PRIMARIO and banco.get('TEST', {}).get('MIRROR') == PRIMARIO
+    ]
+
+
+class _EstadoLeitura:
+    __slots__ = ('permitida', 'fixado', 'escreveu', 'replica')
+
+    def __init__(self, fixado=False):
+        self.permitida = False
+        self.fixado = fixado
+        self.escreveu = False
+        self.replica = None
+
+
+# Um objeto mutável por requisição: as threads do sync_to_async recebem uma cópia do contexto,
+# mas enxergam o mesmo estado.
+_estado = ContextVar('biblioteca_estado_leitura', default=None)
+_fora_do_ar = {}
+
+
+def _replica_saudavel(alias):
+    ate = _fora_do_ar.get(alias)
+    if ate is not None and time.monotonic() < ate:
+        return False
+    conexao = connections[alias]
+    try:
+        conexao.close_if_health_check_failed()
+        conexao.ensure_connection()
+    except DatabaseError as e:
+        logger.warning("Réplica %s indisponível, lendo do primário: %s", alias, e)
+        _fora_do_ar[alias] = time.monotonic() + getattr(settings, 'BIBLIOTECA_REPLICA_QUARENTENA', QUARENTENA_PADRAO)
+        return False
+    _fora_do_ar.pop(alias, None)
+    return True
+
+
+def _escolher_replica():
+    replicas = replicas_configuradas()
+    random.shuffle(replicas)
+    for alias in replicas:
+        if _replica_saudavel(alias):
+            return alias
+    return PRIMARIO
+
+
+def banco_de_leitura():
+    """Alias de onde a requisição atual deve ler; a mesma réplica do começo ao fim da requisição."""
+    estado = _estado.get()
+    if estado is None or not estado.permitida or estado.fixado or connections[PRIMARIO].in_atomic_block:
+        return PRIMARIO
+    if estado.replica is None:
+        estado.replica = _escolher_replica()
+    return estado.replica
+
+
+class RoteadorReplicas:
+    """Escritas vão para o primário; leituras só vão para uma réplica dentro de views @ler_da_replica.
+
+    Depois da primeira escrita de dados (fora MODELOS_SEM_FIXAR), ou dentro de um transaction.atomic(),
+    as leituras da requisição voltam ao primário para enxergar o que acabou de ser gravado. Ative com
+    DATABASE_ROUTERS = ['biblioteca.replicas.RoteadorReplicas'].
+    """
+
+    def db_for_read(self, model, **hints):
+        return banco_de_leitura()
+
+    def db_for_write(self, model, **hints):
+        estado = _estado.get()
+        if estado is not None and model._meta.label_lower not in MODELOS_SEM_FIXAR:
+            estado.escreveu = True
+            estado.fixado = True
+        return PRIMARIO
+
+    def allow_relation(self, obj1, obj2, **hints):
+        bancos = {PRIMARIO, *replicas_configuradas()}
+        if obj1._state.db in bancos and obj2._state.db in bancos:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # O esquema chega às réplicas pela replicação.
+        if db in replicas_configuradas():
+            return False
+        return None
+
+
+@contextmanager
+def _leitura_em_replica():
+    estado = _estado.get()
+    token = None
+    if estado is None:
+        estado = _EstadoLeitura()
+        token = _estado.set(estado)
+    estado.permitida = True
+    try:
+        yield estado
+    finally:
+        estado.permitida = False
+        if token is not None:
+            _estado.reset(token)
+
+
+@contextmanager
+def ler_do_primario():
+    """Leituras do primário mesmo dentro de views @ler_da_replica: para o que vai ser guardado e servido depois."""
+    estado = _estado.get()
+    token = None
+    if estado is None:
+        estado = _EstadoLeitura()
+        token = _estado.set(estado)
+    fixado, estado.fixado = estado.fixado, True
+    try:
+        yield estado
+    finally:
+        estado.fixado = fixado or estado.escreveu
+        if token is not None:
+            _estado.reset(token)
+
+
+def ler_da_replica(view):
+    """Marca uma view de listagem/busca como segura para ler de réplica. Aceita views assíncronas."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def _view_async(request, *args, **kwargs):
+            with _leitura_em_replica():
+                return await view(request, *args, **kwargs)
+
+        return markcoroutinefunction(_view_async)
+
+    @wraps(view)
+    def _view(request, *args, **kwargs):
+        with _leitura_em_replica():
+            return view(request, *args, **kwargs)
+
+    return _view
+
+
+class ReplicasMiddleware:
+    """Mantém no primário, por alguns segundos, quem acabou de gravar algo.
+
+    Sem ele, o redirect depois de um POST pode cair numa réplica atrasada e mostrar a lista
+    sem o registro recém-criado. BIBLIOTECA_REPLICA_ATRASO_MAXIMO define a janela, em segundos.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        estado = _EstadoLeitura(fixado=COOKIE_PRIMARIO in request.COOKIES)
+        token = _estado.set(estado)
+        try:
+            resposta = self.get_response(request)
+        finally:
+            _estado.reset(token)
+        return self._fixar_se_escreveu(resposta, estado)
+
+    async def __acall__(self, request):
+        estado = _EstadoLeitura(fixado=COOKIE_PRIMARIO in request.COOKIES)
+        token = _estado.set(estado)
+        try:
+            resposta = await self.get_response(request)
+        finally:
+            _estado.reset(token)
+        return self._fixar_se_escreveu(resposta, estado)
+
+    def _fixar_se_escreveu(self, resposta, estado):
+        if estado.escreveu:
+            resposta.set_cookie(
+                COOKIE_PRIMARIO, '1', httponly=True, samesite='Lax',
+                max_age=getattr(settings, 'BIBLIOTECA_REPLICA_ATRASO_MAXIMO', ATRASO_MAXIMO_PADRAO),
+            )
+        return resposta
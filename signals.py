@@ -0,0 +1,97 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .autorizacao import invalidar_usuario
+from .busca import obter_backend
+from .cache_catalogo import invalidar_catalogo, invalidar_usuarios
+from .estatisticas import carregar_contado, mover_genero, registrar_emprestimo
+from .models import Emprestimo, EmprestimoArquivado, Exemplar, Livro, Usuario
+
+
+CAMPOS_INDEXADOS_LIVRO = {'titulo', 'autor'}
+# Campos que decidem se o livro aparece numa listagem (busca, exclusão).
+CAMPOS_LISTAGEM_LIVRO = CAMPOS_INDEXADOS_LIVRO | {'excluido_em'}
+
+
+@receiver(post_save, sender=Livro)
+def atualizar_indice_livro(sender, instance, created, update_fields=None, **kwargs):
+    # Empréstimos e devoluções só alteram os contadores de exemplares; não há o que reindexar.
+    if update_fields is not None and not CAMPOS_INDEXADOS_LIVRO.intersection(update_fields):
+        return
+    obter_backend().indexar([instance])
+
+
+@receiver(post_delete, sender=Livro)
+def remover_livro_do_indice(sender, instance, **kwargs):
+    obter_backend().remover([instance.id])
+
+
+@receiver(post_save, sender=Livro)
+def invalidar_cache_livro(sender, instance, created, update_fields=None, **kwargs):
+    # Cadastro ou mudança no que a busca encontra mexe nas listagens; o resto, só nas páginas do livro.
+    if created or update_fields is None or CAMPOS_LISTAGEM_LIVRO.intersection(update_fields):
+        invalidar_catalogo()
+    else:
+        invalidar_catalogo([instance.id])
+
+
+@receiver(post_delete, sender=Livro)
+def invalidar_cache_livro_excluido(sender, **kwargs):
+    invalidar_catalogo()
+
+
+@receiver(post_save, sender=Emprestimo)
+@receiver(post_delete, sender=Emprestimo)
+def invalidar_cache_emprestimo(sender, instance, **kwargs):
+    # Empréstimo e devolução mudam os exemplares disponíveis do livro. Numa instância carregada
+    # sem o livro (only/defer) não dá para saber qual: vale para o catálogo inteiro.
+    livro_id = instance.__dict__.get('livro_id')
+    invalidar_catalogo(None if livro_id is None else [livro_id])
+
+
+@receiver(pre_save, sender=Emprestimo)
+@receiver(pre_delete, sender=Emprestimo)
+@receiver(pre_delete, sender=EmprestimoArquivado)
+def lembrar_emprestimo_contado(sender, instance, **kwargs):
+    carregar_contado(instance)
+
+
+@receiver(post_save, sender=Emprestimo)
+def atualizar_estatisticas_emprestimo(sender, instance, **kwargs):
+    # Empréstimo, devolução e edição: as estatísticas recebem só a diferença, no mesmo commit.
+    registrar_emprestimo(instance)
+
+
+@receiver(post_delete, sender=Emprestimo)
+@receiver(post_delete, sender=EmprestimoArquivado)
+def descontar_estatisticas_emprestimo(sender, instance, **kwargs):
+    registrar_emprestimo(instance, removido=True)
+
+
+@receiver(post_save, sender=Livro)
+def atualizar_estatisticas_genero(sender, instance, created, **kwargs):
+    if not created:
+        mover_genero(instance)
+
+
+@receiver(post_save, sender=Usuario)
+@receiver(post_delete, sender=Usuario)
+def invalidar_cache_usuario(sender, instance, **kwargs):
+    # Apaga agora e de novo no commit: uma requisição no meio do caminho pode ter lido a linha antiga.
+    usuario_id = instance.pk
+    invalidar_usuario(usuario_id)
+    transaction.on_commit(lambda: invalidar_usuario(usuario_id))
+    invalidar_usuarios()
+
+
+@receiver(post_save, sender=Exemplar)
+@receiver(post_delete, sender=Exemplar)
+def recontar_exemplares(sender, instance, created=True, origin=None, **kwargs):
+    # Só para exemplares avulsos (admin); Exemplar.objects.registrar já soma nos contadores.
+    # Quando o próprio livro está sendo excluído não há o que recontar.
+    if not created or isinstance(origin, Livro):
+        return
+    livro = Livro.objects.filter(id=instance.livro_id).first()
+    if livro is not None:
+        livro.recalcular_exemplares()
@@ -1,3 +1,1145 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.core import mail
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.apps import apps
+from django.db import DatabaseError, connection
+from django.db.models import Count, Sum
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .autenticacao_async import BACKEND_PAPEIS
+from .autorizacao import chave_usuario
+from .busca import buscar_livros, normalizar_texto
+from .cache_catalogo import exibir_livros, invalidar_catalogo, obter_cache, pagina_em_cache
+from .arquivo import arquivar_emprestimos
+from .circulacao import (
+    ItemDevolucao, LivroIndisponivel, alterar_emprestimo, devolver_em_lote, emprestar_livro, reservar_livro,
+)
+from .estatisticas import divergencias, recalcular_estatisticas
+from .exclusao import ExclusaoRecusada, expurgar_exclusoes, solicitar_exclusao
+from .importacao import importar_livros, ler_jsonl
+from .models import (
+    Emprestimo, EmprestimoArquivado, EstatisticaDiaria, EstatisticaGenero, EstatisticaLivro, EstatisticaUsuario, Livro,
+    Recomendacao, Reserva, Usuario,
+)
+from .metricas import MetricasMiddleware, medir_sql, registro as registro_metricas
+from .orcamento_consultas import OrcamentoConsultasTestMixin, orcamento_consultas
+from .provisionamento import PoolHash, provisionar_usuarios
+from .recomendacoes import atualizar_recomendacoes, reconstruir_recomendacoes
+from .replicas import COOKIE_PRIMARIO, ReplicasMiddleware, _estado, ler_da_replica
+from .travas import adquirir_trava, liberar_trava
+from . import views_async
+from .views import LIMITE_AUTOCOMPLETAR
+
+
+def criar_usuario(login, **campos):
+    campos.setdefault('reader_name', login.title())
+    campos.setdefault('email', f'{login}@exemplo.org')
+    return Usuario.objects.create_user(login, None, **campos)
+
+
+def criar_livro(titulo='Dom Casmurro', exemplares=1, **campos):
+    livro, _ = Livro.objects.cadastrar(
+        titulo, campos.get('autor', 'Machado de Assis'), campos.get('ano_publicacao', 1899),
+        campos.get('genero', 'Romance'), exemplares=exemplares,
+    )
+    return livro
+
+
+class RetiradaComReservaTests(TestCase):
+    def test_retirada_usa_o_exemplar_separado_para_a_reserva(self):
+        livro = criar_livro(exemplares=2)
+        ana, bia, caio, duda = (criar_usuario(login) for login in ('ana', 'bia', 'caio', 'duda'))
+        emprestimos = [emprestar_livro(livro.id, leitor) for leitor in (ana, bia)]
+        reserva = reservar_livro(livro.id, caio)
+        for emprestimo in emprestimos:
+            Emprestimo.objects.get(id=emprestimo.id).marcar_como_devolvido()
+        reserva.refresh_from_db()
+        self.assertEqual(reserva.status, Reserva.DISPONIVEL)
+
+        emprestar_livro(livro.id, caio)
+        reserva.refresh_from_db()
+        livro.refresh_from_db()
+        self.assertEqual(reserva.status, Reserva.ATENDIDA)
+        self.assertEqual(livro.exemplares_disponiveis, 1)
+
+        # O exemplar da estante continua livre para quem não reservou.
+        emprestar_livro(livro.id, duda)
+        livro.refresh_from_db()
+        self.assertEqual(livro.exemplares_disponiveis, 0)
+        self.assertEqual(Emprestimo.objects.filter(livro=livro, devolvido=False).count(), 2)
+        with self.assertRaises(LivroIndisponivel):
+            emprestar_livro(livro.id, ana)
+
+
+class EmprestimosConcorrentesTests(TransactionTestCase):
+    """Retiradas simultâneas contra poucos exemplares: nenhum livro pode emprestar mais do que tem."""
+
+    LIVROS = 5
+    EXEMPLARES = 2
+    TENTATIVAS = 400
+    THREADS = 8
+    REPETICOES = 1000
+
+    def test_nenhum_livro_empresta_mais_exemplares_do_que_tem(self):
+        usuario = criar_usuario('ana')
+        livro_ids = [criar_livro(f'Livro {numero}', exemplares=self.EXEMPLARES).id for numero in range(self.LIVROS)]
+        contadores = {'sucesso': 0, 'indisponivel': 0, 'erro': 0}
+        trava = threading.Lock()
+
+        def tentar(numero):
+            resultado = 'erro'
+            try:
+                # Bloqueio ou deadlock desfazem a transação inteira; a retirada é só repetida.
+                for _ in range(self.REPETICOES):
+                    try:
+                        emprestar_livro(livro_ids[numero % len(livro_ids)], usuario)
+                        resultado = 'sucesso'
+                    except LivroIndisponivel:
+                        resultado = 'indisponivel'
+                    except DatabaseError:
+                        time.sleep(0.001)
+                        continue
+                    break
+            finally:
+                connection.close()
+            with trava:
+                contadores[resultado] += 1
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+            list(executor.map(tentar, range(self.TENTATIVAS)))
+
+        ativos = Emprestimo.objects.filter(devolvido=False)
+        excedentes = ativos.values('livro_id').annotate(total=Count('id')).filter(total__gt=self.EXEMPLARES)
+        contadores_livros = Livro.objects.aggregate(
+            total=Sum('total_exemplares'), disponiveis=Sum('exemplares_disponiveis'),
+        )
+        self.assertFalse(excedentes.exists(), list(excedentes))
+        self.assertEqual(ativos.count(), contadores['sucesso'])
+        self.assertEqual(ativos.count(), contadores_livros['total'] - contadores_livros['disponiveis'])
+        self.assertEqual(contadores['sucesso'], self.LIVROS * self.EXEMPLARES)
+        self.assertEqual(contadores['erro'], 0)
+
+
+class AutorizacaoPorPapelTests(TestCase):
+    def setUp(self):
+        obter_cache().clear()
+        self.funcionario = criar_usuario('func', tipo_usuario='funcionario')
+        self.membro = criar_usuario('ana')
+        self.livro = criar_livro(exemplares=1)
+        emprestar_livro(self.livro.id, self.funcionario)
+
+    def test_papeis_valem_com_o_model_backend(self):
+        self.client.force_login(self.funcionario)
+        self.assertEqual(self.client.get('/emprestimos/vencidos/').status_code, 200)
+
+        self.client.force_login(self.membro)
+        self.assertRedirects(self.client.get('/emprestimos/vencidos/'), '/', fetch_redirect_response=False)
+        self.client.post(f'/books/{self.livro.id}/reservar/')
+        reserva = Reserva.objects.get(usuario=self.membro)
+        self.client.post(f'/reservas/{reserva.id}/cancelar/')
+        reserva.refresh_from_db()
+        self.assertEqual(reserva.status, Reserva.CANCELADA)
+
+    def test_reservas_de_cada_papel(self):
+        outro = criar_usuario('bia')
+        reservar_livro(self.livro.id, self.membro)
+        reserva_alheia = reservar_livro(self.livro.id, outro)
+
+        self.client.force_login(self.funcionario)
+        self.assertEqual(len(self.client.get('/reservas/').context['reservas']), 2)
+
+        self.client.force_login(self.membro)
+        self.assertEqual([r.usuario_id for r in self.client.get('/reservas/').context['reservas']], [self.membro.id])
+        self.client.post(f'/reservas/{reserva_alheia.id}/cancelar/')
+        self.assertEqual(Reserva.objects.get(id=reserva_alheia.id).status, Reserva.AGUARDANDO)
+
+    def test_autocompletar_recusa_membros_com_json(self):
+        self.client.force_login(self.membro)
+        for url in ('/autocompletar/livros/?q=Dom', '/autocompletar/usuarios/?q=a'):
+            with self.subTest(url=url):
+                resposta = self.client.get(url)
+                self.assertEqual(resposta.status_code, 403)
+                self.assertIn('erro', resposta.json())
+
+    @override_settings(AUTHENTICATION_BACKENDS=[BACKEND_PAPEIS])
+    def test_cache_do_backend_nao_guarda_a_senha(self):
+        self.client.force_login(self.funcionario, backend=BACKEND_PAPEIS)
+        self.assertEqual(self.client.get('/emprestimos/vencidos/').status_code, 200)
+        guardado = obter_cache().get(chave_usuario(self.funcionario.id))
+        self.assertNotIn('password', guardado['campos'])
+        self.assertNotIn(self.funcionario.password, repr(guardado))
+
+        # Vindo do cache, o usuário continua com a sessão válida...
+        self.assertEqual(self.client.get('/emprestimos/vencidos/').status_code, 200)
+        # ...e trocar a senha encerra as sessões abertas, como no ModelBackend.
+        self.funcionario.set_password('nova-senha')
+        self.funcionario.save()
+        self.assertEqual(self.client.get('/emprestimos/vencidos/').status_code, 302)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+
+class AutocompletarTests(TestCase):
+    def setUp(self):
+        self.client.force_login(criar_usuario('func', tipo_usuario='funcionario'))
+
+    def textos(self, url):
+        resposta = self.client.get(url)
+        self.assertEqual(resposta.status_code, 200)
+        return [item['texto'] for item in resposta.json()['resultados']]
+
+    def test_limite_do_parametro_e_teto(self):
+        for numero in range(LIMITE_AUTOCOMPLETAR + 2):
+            criar_livro(f'Dom {numero:02}')
+        self.assertEqual(len(self.textos('/autocompletar/livros/?q=dom')), LIMITE_AUTOCOMPLETAR)
+        self.assertEqual(len(self.textos(f'/autocompletar/livros/?q=dom&limite={LIMITE_AUTOCOMPLETAR * 5}')),
+                         LIMITE_AUTOCOMPLETAR)
+        self.assertEqual(self.textos('/autocompletar/livros/?q=dom&limite=2'),
+                         ['Dom 00 (Machado de Assis)', 'Dom 01 (Machado de Assis)'])
+        for limite, esperado in (('0', 1), ('abc', LIMITE_AUTOCOMPLETAR)):
+            with self.subTest(limite=limite):
+                self.assertEqual(len(self.textos(f'/autocompletar/livros/?q=dom&limite={limite}')), esperado)
+
+    def test_busca_pelo_inicio_e_so_disponiveis(self):
+        ana = criar_usuario('ana', reader_name='Ana Lima')
+        criar_usuario('bia', reader_name='Bia Ana')
+        emprestar_livro(criar_livro('Dom Casmurro').id, ana)
+        criar_livro('Domingo no Parque')
+        self.assertEqual(self.textos('/autocompletar/livros/?q=dom&disponiveis=1'), ['Domingo no Parque (Machado de Assis)'])
+        self.assertEqual(self.textos('/autocompletar/usuarios/?q=ana'), [f'Ana Lima (ID: {ana.id})'])
+        self.assertEqual(self.textos('/autocompletar/usuarios/?q=+'), [])
+
+
+@override_settings(AUTHENTICATION_BACKENDS=[BACKEND_PAPEIS])
+class ConsultasAutenticadasTests(TestCase):
+    """Com o BackendPapeis, uma requisição autenticada não consulta a tabela de usuários."""
+
+    URLS = [
+        '/usuario/', '/emprestimos/pesquisar/', '/devolucao/', '/emprestimos/vencidos/', '/books/cache/',
+        '/autocompletar/livros/?q=Dom', '/api/v1/usuarios/', '/api/v1/emprestimos/',
+    ]
+
+    def setUp(self):
+        obter_cache().clear()
+        self.funcionario = criar_usuario('func', tipo_usuario='funcionario')
+        emprestar_livro(criar_livro().id, self.funcionario)
+        self.client.force_login(self.funcionario, backend=BACKEND_PAPEIS)
+
+    def test_usuario_vem_do_cache(self):
+        for url in self.URLS:
+            with self.subTest(url=url):
+                obter_cache().delete(chave_usuario(self.funcionario.id))
+                with CaptureQueriesContext(connection) as sem_cache:
+                    self.assertEqual(self.client.get(url).status_code, 200)
+                with self.assertNumQueries(len(sem_cache) - 1):
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class RecomendacoesTests(TestCase):
+    def test_pagina_de_recomendacoes_e_publica(self):
+        obter_cache().clear()
+        dom_casmurro = criar_livro('Dom Casmurro')
+        iracema = criar_livro('Iracema', autor='José de Alencar')
+        Recomendacao.objects.create(livro=dom_casmurro, recomendado=iracema, leitores=3, posicao=1)
+
+        url = f'/books/{dom_casmurro.id}/recomendacoes/'
+        self.assertContains(self.client.get('/books/'), f'href="{url}"')
+        resposta = self.client.get(url)
+        self.assertContains(resposta, 'Iracema')
+        self.assertContains(resposta, '3 leitor(es) em comum')
+
+        self.client.force_login(criar_usuario('ana'))
+        self.assertContains(self.client.get(f'/books/{iracema.id}/recomendacoes/'), 'Ainda não há recomendações')
+
+    def emprestar(self, pares):
+        emprestimos = [emprestar_livro(livro.id, usuario) for usuario, livro in pares]
+        # Empréstimos do último minuto ficam para a próxima rodada (MARGEM_CONFIRMACAO).
+        Emprestimo.objects.filter(id__in=[emprestimo.id for emprestimo in emprestimos]).update(
+            data_emprestimo=timezone.now() - timedelta(minutes=5),
+        )
+
+    def listas(self):
+        return list(Recomendacao.objects.order_by('livro_id', 'posicao').values_list(
+            'livro_id', 'posicao', 'recomendado_id', 'leitores',
+        ))
+
+    def test_atualizacao_incremental_chega_a_reconstrucao(self):
+        leitores = [criar_usuario(login) for login in ('ana', 'bia', 'caio', 'duda')]
+        livros = [criar_livro(f'Livro {numero}', exemplares=10) for numero in range(5)]
+        ana, bia, caio, duda = leitores
+        self.emprestar([(ana, livros[0]), (ana, livros[1]), (bia, livros[0]), (bia, livros[2])])
+        reconstruir_recomendacoes(quantidade=2)
+        self.assertTrue(self.listas())
+
+        self.emprestar([
+            (caio, livros[1]), (caio, livros[2]), (caio, livros[3]), (duda, livros[3]), (duda, livros[4]),
+            (ana, livros[3]), (bia, livros[1]), (ana, livros[0]),
+        ])
+        emprestar_livro(livros[4].id, caio)
+        resultado = atualizar_recomendacoes(quantidade=2, tamanho_lote=3)
+        self.assertEqual(resultado.emprestimos, 8)
+        incrementais = self.listas()
+
+        reconstruir_recomendacoes(quantidade=2)
+        self.assertEqual(incrementais, self.listas())
+
+
+class MetricasTests(TestCase):
+    def test_metricas_fechadas_por_padrao_mesmo_para_localhost(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.client.force_login(criar_usuario('func', tipo_usuario='funcionario'))
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+        self.client.force_login(Usuario.objects.create_superuser('admin', None, reader_name='Admin', email='a@exemplo.org'))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(BIBLIOTECA_METRICAS_IPS=['10.0.0.5'])
+    def test_ip_configurado_coleta_sem_login(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.5').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+
+    def test_metricas_e_orcamento_compartilham_o_execute_wrapper(self):
+        @orcamento_consultas(5)
+        def view(request):
+            list(Livro.objects.all())
+            list(Usuario.objects.all())
+            return HttpResponse()
+
+        registro_metricas.limpar()
+        request = RequestFactory().get('/')
+        MetricasMiddleware(view)(request)
+        self.assertEqual(request.consultas_sql.total, 2)
+        self.assertIn('biblioteca_sql_consultas_sum{view="nao_resolvida"} 2', registro_metricas.exportar())
+        self.assertEqual(connection.execute_wrappers, [medir_sql])
+
+
+class AvisosAtrasoTests(TestCase):
+    CHAVE_TRAVA = 'biblioteca:avisos_atraso:em_andamento'
+
+    def setUp(self):
+        livro = criar_livro(exemplares=5)
+        ana, bia, sem_email = criar_usuario('ana'), criar_usuario('bia'), criar_usuario('caio', email=None)
+        for leitor in (ana, ana, bia, sem_email):
+            emprestar_livro(livro.id, leitor)
+        Emprestimo.objects.update(data_devolucao_prevista=timezone.now() - timedelta(days=3))
+
+    def enviar(self):
+        call_command('enviar_avisos_atraso', '--intervalo-dias', '7', stdout=io.StringIO())
+
+    def test_repetir_o_comando_nao_reenvia_avisos(self):
+        self.enviar()
+        self.assertEqual(sorted(mensagem.to[0] for mensagem in mail.outbox), ['ana@exemplo.org', 'bia@exemplo.org'])
+        # Os dois empréstimos da Ana vão no mesmo e-mail.
+        self.assertEqual(mail.outbox[0].body.count('Dom Casmurro'), 2)
+        self.enviar()
+        self.assertEqual(len(mail.outbox), 2)
+
+        # Passado o intervalo, quem continua em atraso é avisado de novo.
+        Emprestimo.objects.update(aviso_atraso_em=timezone.now() - timedelta(days=8))
+        self.enviar()
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_execucao_simultanea_e_recusada(self):
+        dono = adquirir_trava(self.CHAVE_TRAVA, 60)
+        with self.assertRaises(CommandError):
+            self.enviar()
+        self.assertEqual(mail.outbox, [])
+
+        liberar_trava(self.CHAVE_TRAVA, dono)
+        self.enviar()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIsNotNone(adquirir_trava(self.CHAVE_TRAVA, 60))
+
+    def test_trava_expirada_pode_ser_retomada(self):
+        expirada = adquirir_trava(self.CHAVE_TRAVA, -1)
+        atual = adquirir_trava(self.CHAVE_TRAVA, 60)
+        self.assertIsNotNone(atual)
+        self.assertIsNone(adquirir_trava(self.CHAVE_TRAVA, 60))
+
+        # A execução que perdeu a trava por expiração não solta a de quem a retomou.
+        liberar_trava(self.CHAVE_TRAVA, expirada)
+        self.assertIsNone(adquirir_trava(self.CHAVE_TRAVA, 60))
+        liberar_trava(self.CHAVE_TRAVA, atual)
+        self.assertIsNotNone(adquirir_trava(self.CHAVE_TRAVA, 60))
+
+
+class ImportacaoTests(TestCase):
+    def test_campos_de_texto_com_outros_tipos_sao_rejeitados_por_linha(self):
+        linhas = [
+            {'titulo': 123, 'autor': 'Machado de Assis', 'ano_publicacao': 1899},
+            {'titulo': 'Dom Casmurro', 'autor': ['Machado'], 'ano_publicacao': 1899},
+            {'titulo': 'Dom Casmurro', 'autor': 'Machado de Assis', 'ano_publicacao': 1899, 'genero': {'nome': 'x'}},
+            {'titulo': 'Dom Casmurro', 'autor': 'Machado de Assis', 'ano_publicacao': 1899, 'genero': None},
+        ]
+        resultado = importar_livros(ler_jsonl(io.StringIO('\n'.join(json.dumps(linha) for linha in linhas))))
+        self.assertEqual(resultado.importadas, 1)
+        self.assertEqual([numero for numero, _ in resultado.erros], [1, 2, 3])
+        self.assertIn('deve ser um texto', resultado.erros[0][1])
+
+    def test_titulos_existentes_recebem_exemplares(self):
+        existente = criar_livro(exemplares=2)
+        linhas = [
+            {'titulo': 'DOM CASMURRO', 'autor': 'machado de assis', 'ano_publicacao': 1899, 'exemplares': 3},
+            {'titulo': 'Iracema', 'autor': 'José de Alencar', 'ano_publicacao': 1865, 'exemplares': 2},
+            {'titulo': 'Iracema', 'autor': 'José de Alencar', 'ano_publicacao': 1865},
+            {'titulo': 'Dom Casmurro', 'autor': 'Machado de Assis', 'ano_publicacao': 1900},
+        ]
+        resultado = importar_livros(
+            ler_jsonl(io.StringIO('\n'.join(json.dumps(linha) for linha in linhas))), tamanho_lote=3,
+        )
+        self.assertEqual((resultado.importadas, resultado.titulos_novos), (4, 2))
+        existente.refresh_from_db()
+        self.assertEqual((existente.total_exemplares, existente.exemplares_disponiveis), (5, 5))
+        self.assertEqual(existente.exemplares.count(), 5)
+        iracema = Livro.objects.get(titulo='Iracema')
+        self.assertEqual((iracema.total_exemplares, iracema.exemplares.count()), (3, 3))
+        self.assertEqual(Livro.objects.count(), 3)
+
+
+class ProvisionamentoTests(TestCase):
+    def provisionar(self, linhas, **opcoes):
+        opcoes.setdefault('processos', 1)
+        return provisionar_usuarios(enumerate(linhas, start=1), **opcoes)
+
+    def test_usuarios_provisionados_entram_com_a_senha(self):
+        resultado = self.provisionar([
+            {'login': 'ana', 'reader_name': 'Ana', 'email': 'ana@exemplo.org', 'senha': 's3nha-da-ana'},
+            {'login': 'bia', 'reader_name': 'Bia'},
+        ])
+        self.assertEqual((resultado.importadas, resultado.erros), (2, []))
+        self.assertTrue(self.client.login(username='ana', password='s3nha-da-ana'))
+        self.assertFalse(self.client.login(username='ana', password='outra'))
+        self.assertFalse(Usuario.objects.get(login='bia').has_usable_password())
+
+    def test_repetidos_sao_rejeitados_e_nao_gravados(self):
+        criar_usuario('ana')
+        resultado = self.provisionar([
+            {'login': 'ana', 'reader_name': 'Outra Ana'},
+            {'login': 'bia', 'reader_name': 'Bia', 'email': 'bia@exemplo.org'},
+            {'login': 'bia', 'reader_name': 'Bia de Novo'},
+            {'login': 'caio', 'reader_name': 'Caio', 'email': 'bia@EXEMPLO.ORG'},
+            {'login': 'duda', 'reader_name': 'Duda', 'reader_ref_id': 'R1'},
+        ])
+        self.assertEqual(resultado.importadas, 2)
+        self.assertEqual([numero for numero, _ in resultado.erros], [1, 3, 4])
+        self.assertIn('já cadastrado', resultado.erros[0][1])
+        self.assertIn('repetido no arquivo', resultado.erros[1][1])
+        self.assertIn('bia@exemplo.org', resultado.erros[2][1])
+        self.assertEqual(
+            sorted(Usuario.objects.values_list('login', 'reader_name')),
+            [('ana', 'Ana'), ('bia', 'Bia'), ('duda', 'Duda')],
+        )
+
+    def test_hashes_em_paralelo_equivalem_aos_seriais(self):
+        senhas = [f'senha-{numero}' for numero in range(6)]
+        with PoolHash(processos=1) as serial, PoolHash(processos=2) as paralelo:
+            hashes_seriais = serial.gerar(senhas)
+            hashes_paralelos = paralelo.gerar(senhas)
+        self.assertEqual(len(hashes_paralelos), len(senhas))
+        for senha, hash_serial, hash_paralelo in zip(senhas, hashes_seriais, hashes_paralelos):
+            # O sal é aleatório: compara algoritmo e custo, e confere a senha.
+            self.assertEqual(hash_paralelo.split('$')[:2], hash_serial.split('$')[:2])
+            self.assertTrue(check_password(senha, hash_paralelo))
+            self.assertFalse(check_password(senha + 'x', hash_paralelo))
+
+
+class EmprestimosVencidosTests(TestCase):
+    def setUp(self):
+        self.funcionario = criar_usuario('func', tipo_usuario='funcionario')
+        self.membro = criar_usuario('ana')
+        livro = criar_livro(exemplares=5)
+        agora = timezone.now()
+        self.emprestimos = {}
+        for nome, prevista, devolucao in (
+            ('atrasado', agora - timedelta(days=3), None),
+            ('no_prazo', agora + timedelta(days=3), None),
+            ('devolvido_atrasado', agora - timedelta(days=10), agora - timedelta(days=8)),
+            ('devolvido_no_dia', agora - timedelta(days=10, hours=2), agora - timedelta(days=10, hours=1)),
+            ('devolvido_no_prazo', agora - timedelta(days=10), agora - timedelta(days=12)),
+        ):
+            emprestimo = emprestar_livro(livro.id, self.membro)
+            Emprestimo.objects.filter(id=emprestimo.id).update(
+                data_devolucao_prevista=prevista, data_devolucao=devolucao, devolvido=devolucao is not None,
+            )
+            self.emprestimos[emprestimo.id] = nome
+
+    def listados(self, situacao):
+        resposta = self.client.get(f'/emprestimos/vencidos/?situacao={situacao}')
+        return sorted(self.emprestimos[emprestimo.id] for emprestimo in resposta.context['emprestimos_vencidos'])
+
+    def test_situacoes(self):
+        self.client.force_login(self.funcionario)
+        self.assertEqual(self.listados('ativos'), ['atrasado'])
+        self.assertEqual(self.listados('devolvidos'), ['devolvido_atrasado'])
+        self.assertEqual(self.listados('todos'), ['atrasado', 'devolvido_atrasado'])
+
+    def test_link_no_menu_segue_o_papel_da_view(self):
+        self.client.force_login(self.funcionario)
+        self.assertContains(self.client.get('/reservas/'), 'href="/emprestimos/vencidos/"')
+        self.client.force_login(self.membro)
+        self.assertNotContains(self.client.get('/reservas/'), 'href="/emprestimos/vencidos/"')
+
+
+class DevolucaoTests(TestCase):
+    def test_devolucao_repetida_libera_um_exemplar_so(self):
+        livro = criar_livro(exemplares=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            emprestimo = emprestar_livro(livro.id, criar_usuario('ana'))
+            emprestar_livro(livro.id, criar_usuario('bia'))
+        # Duas requisições que leram o empréstimo ainda ativo.
+        primeira, segunda = Emprestimo.objects.get(id=emprestimo.id), Emprestimo.objects.get(id=emprestimo.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(primeira.marcar_como_devolvido())
+            self.assertFalse(segunda.marcar_como_devolvido())
+        self.assertTrue(segunda.devolvido)
+        livro.refresh_from_db()
+        self.assertEqual(livro.exemplares_disponiveis, 1)
+        self.assertEqual(EstatisticaLivro.objects.get(pk=livro.id).ativos, 1)
+
+
+class EstatisticasTests(TestCase):
+    """As somas feitas a cada evento têm de bater com uma recontagem do zero."""
+
+    def tabelas(self):
+        instantaneo = {}
+        for tabela in (EstatisticaDiaria, EstatisticaLivro, EstatisticaUsuario, EstatisticaGenero):
+            campos = [campo.name for campo in tabela._meta.concrete_fields if not campo.primary_key]
+            # Linhas zeradas contam como ausentes: a recontagem não as cria.
+            instantaneo[tabela.__name__] = {
+                chave: valores for chave, *valores in tabela.objects.values_list('pk', *campos) if any(valores)
+            }
+        return instantaneo
+
+    def assertIgualARecontagem(self):
+        self.assertEqual(divergencias(), [])
+        incrementais = self.tabelas()
+        recalcular_estatisticas()
+        self.assertEqual(self.tabelas(), incrementais)
+
+    def test_eventos_batem_com_a_recontagem(self):
+        ana, bia = criar_usuario('ana'), criar_usuario('bia')
+        dom_casmurro = criar_livro(exemplares=3)
+        iracema = criar_livro('Iracema', exemplares=2, autor='José de Alencar', ano_publicacao=1865, genero='Indianista')
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            emprestimos = [
+                emprestar_livro(dom_casmurro.id, ana), emprestar_livro(dom_casmurro.id, bia), emprestar_livro(iracema.id, ana),
+            ]
+            # Dentro da transação do empréstimo as linhas compartilhadas ainda não foram tocadas.
+            self.assertFalse(EstatisticaGenero.objects.exists())
+        self.assertTrue(callbacks)
+        self.assertIgualARecontagem()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            emprestimos[0].marcar_como_devolvido()
+        self.assertIgualARecontagem()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            alterar_emprestimo(emprestimos[1], iracema, ana, devolvido=False)
+        self.assertIgualARecontagem()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            dom_casmurro = Livro.objects.get(id=dom_casmurro.id)
+            dom_casmurro.genero = 'Realismo'
+            dom_casmurro.save()
+        self.assertIgualARecontagem()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            emprestimos[2].delete()
+        self.assertIgualARecontagem()
+
+        antes = self.tabelas()
+        with self.captureOnCommitCallbacks(execute=True):
+            resultado = arquivar_emprestimos(idade=timedelta(days=1), agora=timezone.now() + timedelta(days=2))
+        self.assertEqual(resultado.arquivados, 1)
+        self.assertTrue(EmprestimoArquivado.objects.filter(id=emprestimos[0].id).exists())
+        self.assertEqual(self.tabelas(), antes)
+        self.assertIgualARecontagem()
+
+
+class ArquivoTests(TestCase):
+    def setUp(self):
+        self.agora = timezone.now()
+        self.ana = criar_usuario('ana')
+        self.livro = criar_livro(exemplares=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.emprestimos = [emprestar_livro(self.livro.id, self.ana) for _ in range(5)]
+            # Três devolvidos antes do corte, um depois e um ainda emprestado.
+            for emprestimo, dias in zip(self.emprestimos, (400, 380, 370, 10)):
+                emprestimo.marcar_como_devolvido()
+                Emprestimo.objects.filter(id=emprestimo.id).update(data_devolucao=self.agora - timedelta(days=dias))
+
+    def estatisticas(self):
+        return [
+            list(tabela.objects.order_by('pk').values())
+            for tabela in (EstatisticaDiaria, EstatisticaLivro, EstatisticaUsuario, EstatisticaGenero)
+        ]
+
+    def test_lotes_movem_so_os_devolvidos_antes_do_corte(self):
+        lotes = []
+        antes = self.estatisticas()
+        with self.captureOnCommitCallbacks(execute=True):
+            resultado = arquivar_emprestimos(
+                idade=timedelta(days=365), agora=self.agora, tamanho_lote=2,
+                ao_arquivar_lote=lambda r: lotes.append(r.arquivados),
+            )
+        antigos = {emprestimo.id for emprestimo in self.emprestimos[:3]}
+        self.assertEqual((resultado.arquivados, resultado.lotes, lotes), (3, 2, [2, 3]))
+        self.assertEqual(set(EmprestimoArquivado.objects.values_list('id', flat=True)), antigos)
+        self.assertEqual(
+            set(Emprestimo.objects.values_list('id', flat=True)), {emprestimo.id for emprestimo in self.emprestimos[3:]},
+        )
+        self.assertEqual(arquivar_emprestimos(idade=timedelta(days=365), agora=self.agora).arquivados, 0)
+        # As estatísticas contam as duas tabelas: mudar de tabela não é uma devolução nem uma exclusão.
+        self.assertEqual(EstatisticaLivro.objects.get(livro=self.livro).emprestimos, 5)
+        self.assertEqual(self.estatisticas(), antes)
+
+    def test_historico_e_exportacao_leem_o_arquivo(self):
+        arquivar_emprestimos(idade=timedelta(days=365), agora=self.agora)
+        self.client.force_login(criar_usuario('func', tipo_usuario='funcionario'))
+        antigos = [emprestimo.id for emprestimo in self.emprestimos[:3]]
+
+        for parametros, esperados in (('', [self.emprestimos[3].id]), ('?arquivo=1', antigos)):
+            with self.subTest(parametros=parametros):
+                resposta = self.client.get(f'/devolucao/{parametros}')
+                self.assertEqual([emprestimo.id for emprestimo in resposta.context['emprestimos_devolvidos']], esperados)
+
+        resposta = self.client.get('/devolucao/exportar/?formato=ndjson&arquivo=1')
+        self.assertIn('emprestimos_arquivados', resposta['Content-Disposition'])
+        linhas = b''.join(resposta.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(linha)['id'] for linha in linhas], antigos)
+
+
+class ExclusaoTests(TestCase):
+    def setUp(self):
+        self.admin = criar_usuario('admin', tipo_usuario='admin')
+        self.ana, self.bia = criar_usuario('ana'), criar_usuario('bia')
+        self.livro = criar_livro(exemplares=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.emprestimo = emprestar_livro(self.livro.id, self.ana)
+            self.reserva = reservar_livro(self.livro.id, self.bia)
+
+    def test_registros_excluidos_somem_dos_gerenciadores(self):
+        solicitar_exclusao(self.bia, solicitada_por=self.admin)
+        self.assertFalse(Usuario.objects.filter(id=self.bia.id).exists())
+        self.assertFalse(Usuario.todos.get(id=self.bia.id).is_active)
+        self.assertEqual(Reserva.objects.get(id=self.reserva.id).status, Reserva.CANCELADA)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.emprestimo.marcar_como_devolvido()
+        solicitar_exclusao(self.livro, solicitada_por=self.admin)
+        self.assertFalse(Livro.objects.filter(id=self.livro.id).exists())
+        self.assertTrue(Livro.todos.filter(id=self.livro.id).exists())
+
+    def test_livro_emprestado_nao_e_excluido(self):
+        with self.assertRaises(ExclusaoRecusada):
+            solicitar_exclusao(self.livro, solicitada_por=self.admin)
+        self.assertTrue(Livro.objects.filter(id=self.livro.id).exists())
+
+        # Devolvido, o exemplar fica separado para a reserva; a exclusão a cancela.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.emprestimo.marcar_como_devolvido()
+        self.assertEqual(Reserva.objects.get(id=self.reserva.id).status, Reserva.DISPONIVEL)
+        solicitar_exclusao(self.livro, solicitada_por=self.admin)
+        self.assertEqual(Reserva.objects.get(id=self.reserva.id).status, Reserva.CANCELADA)
+        with self.assertRaises(Livro.DoesNotExist):
+            emprestar_livro(self.livro.id, self.bia)
+
+    def test_expurgo_libera_exemplares_e_desconta_estatisticas(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Emprestimo.objects.create(
+                livro=self.livro, usuario=self.ana, data_emprestimo=timezone.now() - timedelta(days=20),
+                data_devolucao=timezone.now() - timedelta(days=15), devolvido=True,
+            )
+        solicitar_exclusao(self.ana, solicitada_por=self.admin)
+        self.assertEqual(Livro.objects.get(id=self.livro.id).exemplares_disponiveis, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resultado = expurgar_exclusoes(tamanho_lote=1)
+        self.assertEqual((resultado.exclusoes, resultado.registros), (1, 2))
+        self.assertFalse(Usuario.todos.filter(id=self.ana.id).exists())
+        # O exemplar que estava com a Ana vai para a reserva da Bia.
+        self.assertEqual(Reserva.objects.get(id=self.reserva.id).status, Reserva.DISPONIVEL)
+        self.assertEqual(EstatisticaLivro.objects.get(pk=self.livro.id).emprestimos, 0)
+        self.assertEqual(divergencias(), [])
+
+
+class DevolucaoEmLoteTests(TestCase):
+    def test_identificadores_que_nao_sao_ids(self):
+        emprestimo = emprestar_livro(criar_livro().id, criar_usuario('ana'))
+        itens = devolver_em_lote([str(emprestimo.id), '²', '99999999999999999999', '١٢'], ['²', '99999999999999999999'])
+        self.assertEqual([item.situacao for item in itens], [
+            ItemDevolucao.DEVOLVIDO, ItemDevolucao.INVALIDO, ItemDevolucao.INVALIDO, ItemDevolucao.INVALIDO,
+            ItemDevolucao.NAO_ENCONTRADO, ItemDevolucao.NAO_ENCONTRADO,
+        ])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'índice FTS5 só existe no SQLite')
+class BuscaTests(TestCase):
+    def titulos(self, query):
+        return [livro.titulo for livro in buscar_livros(query)]
+
+    def test_busca_ignora_acentos_e_caixa(self):
+        criar_livro('Memórias Póstumas de Brás Cubas')
+        self.assertEqual(normalizar_texto('Memórias PÓSTUMAS'), 'memorias postumas')
+        for query in ('memorias bras', 'MEMÓRIAS', 'Bras Cubas'):
+            with self.subTest(query=query):
+                self.assertEqual(self.titulos(query), ['Memórias Póstumas de Brás Cubas'])
+
+    def test_busca_por_prefixo_exige_todos_os_termos(self):
+        criar_livro('Memórias Póstumas de Brás Cubas')
+        criar_livro('Memorial de Aires')
+        self.assertEqual(sorted(self.titulos('memo')), ['Memorial de Aires', 'Memórias Póstumas de Brás Cubas'])
+        self.assertEqual(self.titulos('memo aire'), ['Memorial de Aires'])
+        self.assertEqual(self.titulos('"memo" OR *'), [])
+
+    def test_titulo_pesa_mais_que_autor(self):
+        criar_livro('Iracema', autor='José de Alencar', ano_publicacao=1865)
+        criar_livro('Contos de Alencar', autor='Vários Autores')
+        self.assertEqual(self.titulos('alencar'), ['Contos de Alencar', 'Iracema'])
+
+    def test_indice_acompanha_edicao_e_exclusao(self):
+        livro = criar_livro('Helena')
+        livro.titulo = 'Iaiá Garcia'
+        livro.save()
+        self.assertEqual(self.titulos('helena'), [])
+        self.assertEqual(self.titulos('iaia'), ['Iaiá Garcia'])
+
+        livro.delete()
+        self.assertEqual(self.titulos('iaia'), [])
+
+    def test_migration_reconstroi_o_indice_depois_de_mesclas(self):
+        from importlib import import_module
+
+        reconstruir = import_module('biblioteca.migrations.0013_reconstruir_indice_busca').reconstruir_indice_busca
+        mantido = criar_livro('Quincas Borba')
+        # Como na 0005: o índice fica com uma linha órfã e outra desatualizada.
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO biblioteca_livro_busca (rowid, titulo, autor) VALUES (%s, 'Fantasma', '')",
+                           [mantido.id + 1000])
+        Livro.objects.filter(id=mantido.id).update(titulo='Quincas Borba (edição crítica)')
+        self.assertEqual(self.titulos('critica'), [])
+
+        # Fora de migrate o schema editor do SQLite não abre dentro da transação do teste.
+        reconstruir(apps, SimpleNamespace(connection=connection))
+        self.assertEqual(self.titulos('quincas critica'), ['Quincas Borba (edição crítica)'])
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT rowid FROM biblioteca_livro_busca")
+            self.assertEqual(cursor.fetchall(), [(mantido.id,)])
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        obter_cache().clear()
+        self.client.force_login(criar_usuario('func', tipo_usuario='funcionario'))
+
+    def test_id_maior_que_bigint_e_parametro_invalido(self):
+        for valor in ('99999999999999999999', '-99999999999999999999', 'abc'):
+            with self.subTest(valor=valor):
+                resposta = self.client.get(f'/api/v1/emprestimos/?livro={valor}')
+                self.assertEqual(resposta.status_code, 400)
+                self.assertIn('livro', resposta.json()['erro'])
+
+    @override_settings(BIBLIOTECA_BUSCA_LIMITE=2)
+    def test_resposta_avisa_quando_a_busca_foi_cortada(self):
+        for numero in range(3):
+            criar_livro(f'Memórias {numero}')
+        dados = self.client.get('/api/v1/livros/?query=Memórias').json()
+        self.assertEqual(len(dados['resultados']), 2)
+        self.assertEqual((dados['limite_busca'], dados['busca_truncada']), (2, True))
+
+        dados = self.client.get('/api/v1/livros/?query=Memórias 1').json()
+        self.assertFalse(dados['busca_truncada'])
+        self.assertNotIn('busca_truncada', self.client.get('/api/v1/livros/').json())
+
+
+class ExportacaoTests(TestCase):
+    def setUp(self):
+        self.client.force_login(criar_usuario('func', tipo_usuario='funcionario'))
+        ana = criar_usuario('ana', reader_name='Ana Lima')
+        self.emprestimos = [
+            emprestar_livro(criar_livro('Dom Casmurro').id, ana),
+            emprestar_livro(criar_livro('Iracema', autor='José de Alencar', ano_publicacao=1865).id, ana),
+        ]
+
+    def test_csv_com_cabecalho_e_uma_linha_por_emprestimo(self):
+        resposta = self.client.get('/emprestimos/exportar/')
+        self.assertEqual(resposta['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('emprestimos_ativos.csv', resposta['Content-Disposition'])
+        linhas = list(csv.reader(io.StringIO(b''.join(resposta.streaming_content).decode())))
+        self.assertEqual(linhas[0][:3], ['id', 'livro_titulo', 'livro_autor'])
+        self.assertEqual([linha[1] for linha in linhas[1:]], ['Dom Casmurro', 'Iracema'])
+        self.assertEqual(linhas[1][4], 'Ana Lima')
+
+    def test_ndjson_compactado_e_filtrado_pela_busca(self):
+        resposta = self.client.get('/emprestimos/exportar/?formato=ndjson&gzip=1&query=alencar')
+        self.assertEqual(resposta['Content-Type'], 'application/gzip')
+        self.assertIn('emprestimos_ativos.ndjson.gz', resposta['Content-Disposition'])
+        linhas = gzip.decompress(b''.join(resposta.streaming_content)).decode().splitlines()
+        self.assertEqual(len(linhas), 1)
+        dados = json.loads(linhas[0])
+        self.assertEqual((dados['id'], dados['livro_titulo'], dados['devolvido']), (self.emprestimos[1].id, 'Iracema', False))
+        self.assertEqual(dados['data_emprestimo'], self.emprestimos[1].data_emprestimo.isoformat())
+
+    def test_devolvidos_e_formato_desconhecido(self):
+        self.emprestimos[0].marcar_como_devolvido()
+        resposta = self.client.get('/devolucao/exportar/?formato=xml')
+        self.assertIn('emprestimos_devolvidos.csv', resposta['Content-Disposition'])
+        linhas = list(csv.reader(io.StringIO(b''.join(resposta.streaming_content).decode())))
+        self.assertEqual([linha[0] for linha in linhas[1:]], [str(self.emprestimos[0].id)])
+
+
+@override_settings(ROOT_URLCONF='biblioteca.urls_asgi')
+class ViewsAsyncTests(TestCase):
+    def setUp(self):
+        obter_cache().clear()
+        self.ana = criar_usuario('ana', reader_name='Ana Lima')
+        self.ana.set_password('s3nha-da-ana')
+        self.ana.save()
+        self.funcionario = criar_usuario('func', tipo_usuario='funcionario')
+        livro = criar_livro('Dom Casmurro')
+        self.emprestimo = emprestar_livro(livro.id, self.ana)
+
+    async def test_login_com_e_sem_a_senha_certa(self):
+        resposta = await self.async_client.post('/login/', {'login': 'ana', 'password': 'errada'})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIs(resposta.resolver_match.func, views_async.user_login)
+        self.assertContains(resposta, 'inválidos')
+        self.assertIsNone(await (await self.async_client.asession()).aget('_auth_user_id'))
+
+        resposta = await self.async_client.post('/login/', {'login': 'ana', 'password': 's3nha-da-ana'})
+        self.assertRedirects(resposta, '/home/', fetch_redirect_response=False)
+        sessao = await self.async_client.asession()
+        self.assertEqual(await sessao.aget('_auth_user_id'), str(self.ana.id))
+        self.assertEqual(await sessao.aget('user_type'), 'membro_comum')
+
+    async def test_listagens_assincronas(self):
+        await self.async_client.aforce_login(self.funcionario)
+        paginas = (
+            ('/books/?query=casmurro', 'Dom Casmurro'),
+            ('/usuario/?query=lima', 'Ana Lima'),
+            ('/emprestimos/pesquisar/?query=ana', 'Dom Casmurro'),
+        )
+        for url, texto in paginas:
+            with self.subTest(url=url):
+                resposta = await self.async_client.get(url)
+                # Os decoradores preservam o módulo da view: confirma que a rota é a assíncrona.
+                self.assertEqual(resposta.resolver_match.func.__module__, views_async.__name__)
+                self.assertContains(resposta, texto)
+
+        resposta = await self.async_client.get('/devolucao/?arquivo=1')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.context['arquivo'])
+
+    async def test_listagens_de_gerenciamento_recusam_membros(self):
+        await self.async_client.aforce_login(self.ana)
+        for url in ('/usuario/', '/emprestimos/pesquisar/', '/devolucao/'):
+            with self.subTest(url=url):
+                self.assertNotEqual((await self.async_client.get(url)).status_code, 200)
+
+
+class CursorAdulteradoTests(TestCase):
+    def setUp(self):
+        obter_cache().clear()
+        self.client.force_login(criar_usuario('func', tipo_usuario='funcionario'))
+        emprestar_livro(criar_livro().id, criar_usuario('ana'))
+
+    def test_cursor_adulterado_volta_a_primeira_pagina(self):
+        cursores = [
+            {'v': 5, 'd': 'proxima'},
+            {'v': ['abc'], 'd': 'proxima'},
+            {'v': [[1]], 'd': 'proxima'},
+            {'v': [{'id': 1}], 'd': 'anterior'},
+            {'v': [99999999999999999999], 'd': 'proxima'},
+            {'v': ['99999999999999999999'], 'd': 'proxima'},
+            {'v': [1], 'd': 'lado'},
+            ['v', 'd'],
+        ]
+        for url in ('/books/', '/usuario/', '/api/v1/livros/', '/emprestimos/vencidos/?ordem=atraso'):
+            for dados in cursores:
+                cursor = base64.urlsafe_b64encode(json.dumps(dados).encode()).decode()
+                with self.subTest(url=url, cursor=dados):
+                    separador = '&' if '?' in url else '?'
+                    self.assertEqual(self.client.get(f'{url}{separador}cursor={cursor}').status_code, 200)
+
+
+class CacheCatalogoTests(TestCase):
+    def setUp(self):
+        obter_cache().clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dom_casmurro = criar_livro('Dom Casmurro')
+            self.iracema = criar_livro('Iracema', autor='José de Alencar', ano_publicacao=1865)
+
+    def assertCache(self, url, esperado):
+        self.assertEqual(self.client.get(url)['X-Cache'], esperado, url)
+
+    def test_pagina_anonima_nao_leva_token_csrf(self):
+        self.assertCache('/books/', 'MISS')
+        resposta = self.client_class().get('/books/')
+        self.assertEqual(resposta['X-Cache'], 'HIT')
+        self.assertNotIn(b'csrfmiddlewaretoken', resposta.content)
+
+    def test_pagina_que_usou_o_token_csrf_nao_e_guardada(self):
+        @pagina_em_cache
+        def view(request):
+            exibir_livros(request, [])
+            return HttpResponse(get_token(request))
+
+        fabrica = RequestFactory()
+        for _ in range(2):
+            request = fabrica.get('/com-token/')
+            request.user = AnonymousUser()
+            self.assertNotIn('X-Cache', view(request))
+
+    def test_alteracao_de_um_livro_so_invalida_as_paginas_que_o_mostram(self):
+        for url in ('/books/', '/books/?query=Iracema'):
+            self.assertCache(url, 'MISS')
+            self.assertCache(url, 'HIT')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            emprestar_livro(self.dom_casmurro.id, criar_usuario('ana'))
+        self.assertCache('/books/?query=Iracema', 'HIT')
+        self.assertCache('/books/', 'MISS')
+        self.assertCache('/books/', 'HIT')
+
+    def test_mudanca_no_que_a_busca_encontra_invalida_as_listagens(self):
+        self.assertCache('/books/?query=Iracema', 'MISS')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dom_casmurro.titulo = 'Iracema e Dom Casmurro'
+            self.dom_casmurro.save(update_fields=['titulo'])
+        resposta = self.client.get('/books/?query=Iracema')
+        self.assertEqual(resposta['X-Cache'], 'MISS')
+        self.assertContains(resposta, 'Iracema e Dom Casmurro')
+
+    def requisitar(self, view):
+        request = RequestFactory().get('/pagina/')
+        request.user = AnonymousUser()
+        return view(request)
+
+    def test_pagina_guardada_mantem_os_cabecalhos(self):
+        @pagina_em_cache
+        def view(request):
+            exibir_livros(request, [self.iracema])
+            return HttpResponse('<p>Iracema</p>', content_type='application/xhtml+xml', headers={'Content-Language': 'pt-br'})
+
+        self.assertEqual(self.requisitar(view)['X-Cache'], 'MISS')
+        resposta = self.requisitar(view)
+        self.assertEqual(resposta['X-Cache'], 'HIT')
+        self.assertEqual((resposta['Content-Type'], resposta['Content-Language']), ('application/xhtml+xml', 'pt-br'))
+
+    def test_alteracao_durante_a_geracao_invalida_a_pagina(self):
+        @pagina_em_cache
+        def view(request):
+            exibir_livros(request, [self.iracema])
+            if not alterado:
+                # Outro processo altera o livro enquanto esta página é gerada com os dados de antes.
+                with self.captureOnCommitCallbacks(execute=True):
+                    invalidar_catalogo([self.iracema.id])
+                alterado.append(True)
+            return HttpResponse('Iracema')
+
+        alterado = []
+        self.assertEqual(self.requisitar(view)['X-Cache'], 'MISS')
+        self.assertEqual(self.requisitar(view)['X-Cache'], 'MISS')
+        self.assertEqual(self.requisitar(view)['X-Cache'], 'HIT')
+
+
+class OrcamentoViewsTests(OrcamentoConsultasTestMixin, TestCase):
+    """Cada view com @orcamento_consultas, chamada com dados suficientes para revelar um N+1."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = Usuario.objects.create_superuser('admin', None, reader_name='Admin', email='admin@exemplo.org')
+        leitores = [criar_usuario(login) for login in ('ana', 'bia', 'caio', 'duda')]
+        livros = [
+            criar_livro(titulo, exemplares=3, autor=autor, genero=genero)
+            for titulo, autor, genero in (
+                ('Dom Casmurro', 'Machado de Assis', 'Romance'),
+                ('Iracema', 'José de Alencar', 'Romance'),
+                ('Os Sertões', 'Euclides da Cunha', 'Ensaio'),
+            )
+        ]
+        emprestimos = [emprestar_livro(livro.id, leitor) for livro in livros for leitor in leitores[:3]]
+        Emprestimo.objects.filter(id__in=[e.id for e in emprestimos[::2]]).update(
+            data_devolucao_prevista=timezone.now() - timedelta(days=5),
+        )
+        for livro in livros:
+            reservar_livro(livro.id, leitores[3])
+        for emprestimo in emprestimos[:2]:
+            Emprestimo.objects.get(id=emprestimo.id).marcar_como_devolvido()
+        cls.livros, cls.leitores, cls.emprestimos = livros, leitores, emprestimos
+
+    def setUp(self):
+        obter_cache().clear()
+        self.client.force_login(self.admin)
+
+    def test_paginas(self):
+        for url in (
+            '/', '/books/', '/books/?query=Iracema', '/usuario/', '/usuario/?query=ana',
+            '/emprestimos/', '/emprestimos/pesquisar/?query=Machado', '/devolucao/', '/devolucao/?arquivo=1',
+            '/devolucao/lote/', '/emprestimos/vencidos/', '/emprestimos/vencidos/?situacao=todos&ordem=multa',
+            f'/emprestimos/editar/{self.emprestimos[-1].id}/', '/reservas/',
+            f'/books/{self.livros[0].id}/recomendacoes/',
+        ):
+            with self.subTest(url=url):
+                self.assertDentroDoOrcamento(url)
+
+    def test_paginas_de_membro(self):
+        self.client.force_login(self.leitores[3])
+        self.assertDentroDoOrcamento('/')
+        self.assertDentroDoOrcamento('/reservas/')
+
+    def test_api(self):
+        for url in (
+            '/api/v1/livros/', '/api/v1/livros/?query=Machado&disponiveis=1&fields=titulo,autor',
+            f'/api/v1/livros/{self.livros[0].id}/recomendacoes/', '/api/v1/usuarios/?query=a',
+            '/api/v1/emprestimos/?devolvido=0&fields=livro_titulo,usuario_nome',
+        ):
+            with self.subTest(url=url):
+                self.assertDentroDoOrcamento(url)
+
+    def test_emprestimo(self):
+        livro, leitor = self.livros[0], self.leitores[3]
+        resposta = self.assertDentroDoOrcamento('/emprestimo/', 'post', {'livro_id': livro.id, 'usuario_id': leitor.id})
+        self.assertRedirects(resposta, '/emprestimo/', fetch_redirect_response=False)
+        self.assertTrue(Emprestimo.objects.filter(livro=livro, usuario=leitor, devolvido=False).exists())
+
+    def test_edicao_de_emprestimo(self):
+        # Marcar como devolvido na edição devolve o exemplar, e ele vai para a reserva da fila.
+        emprestimo = self.emprestimos[-1]
+        self.assertDentroDoOrcamento(f'/emprestimos/editar/{emprestimo.id}/', 'post', {
+            'livro_id': emprestimo.livro_id, 'usuario_id': emprestimo.usuario_id, 'devolvido': 'True',
+        })
+        self.assertTrue(Emprestimo.objects.get(id=emprestimo.id).devolvido)
+        self.assertEqual(Livro.objects.get(id=emprestimo.livro_id).exemplares_disponiveis, 0)
+        self.assertEqual(Reserva.objects.get(livro_id=emprestimo.livro_id).status, Reserva.DISPONIVEL)
+
+    def test_troca_de_livro_na_edicao(self):
+        destino, origem = self.livros[0], self.livros[1]
+        self.assertEqual(Livro.objects.get(id=destino.id).exemplares_disponiveis, 1)
+
+        # Troca e devolução na mesma edição: o exemplar de Iracema vai para a reserva que esperava por ele, e o
+        # de Dom Casmurro é retirado e devolvido à estante.
+        emprestimo = self.emprestimos[5]
+        self.assertDentroDoOrcamento(f'/emprestimos/editar/{emprestimo.id}/', 'post', {
+            'livro_id': destino.id, 'usuario_id': emprestimo.usuario_id, 'devolvido': 'True',
+        })
+        emprestimo.refresh_from_db()
+        self.assertEqual((emprestimo.livro_id, emprestimo.devolvido), (destino.id, True))
+        self.assertEqual(Livro.objects.get(id=destino.id).exemplares_disponiveis, 1)
+        self.assertEqual(Livro.objects.get(id=origem.id).exemplares_disponiveis, 0)
+        self.assertEqual(Reserva.objects.get(livro=origem).status, Reserva.DISPONIVEL)
+
+        # Só a troca: Dom Casmurro perde o exemplar da estante e o de Iracema, sem fila, volta para a dela.
+        emprestimo = self.emprestimos[3]
+        self.assertDentroDoOrcamento(f'/emprestimos/editar/{emprestimo.id}/', 'post', {
+            'livro_id': destino.id, 'usuario_id': emprestimo.usuario_id, 'devolvido': 'False',
+        })
+        emprestimo.refresh_from_db()
+        self.assertEqual((emprestimo.livro_id, emprestimo.devolvido), (destino.id, False))
+        self.assertEqual(Livro.objects.get(id=destino.id).exemplares_disponiveis, 0)
+        self.assertEqual(Livro.objects.get(id=origem.id).exemplares_disponiveis, 1)
+
+        # Sem exemplar no livro novo, a edição é recusada e nada muda.
+        outro = self.emprestimos[4]
+        self.client.post(f'/emprestimos/editar/{outro.id}/', {
+            'livro_id': self.livros[2].id, 'usuario_id': outro.usuario_id, 'devolvido': 'False',
+        })
+        self.assertEqual(Emprestimo.objects.get(id=outro.id).livro_id, origem.id)
+        self.assertEqual(Reserva.objects.get(livro=self.livros[2]).status, Reserva.AGUARDANDO)
+
+    def test_devolucao_em_lote(self):
+        ultimo = self.livros[-1]
+        ativos = list(Emprestimo.objects.filter(devolvido=False).exclude(livro=ultimo).values_list('id', flat=True))
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.assertDentroDoOrcamento(
+                '/devolucao/lote/', 'post', json.dumps({'emprestimos': ativos, 'livros': [ultimo.id, ultimo.id]}),
+                content_type='application/json',
+            )
+        self.assertEqual(resposta.json()['devolvidos'], len(ativos) + 2)
+
+
+@skipUnless('replica' in settings.DATABASES, "Sem o banco 'replica' em DATABASES (ex.: configurar_bancos com TEST.MIRROR).")
+@override_settings(DATABASE_ROUTERS=['biblioteca.replicas.RoteadorReplicas'], BIBLIOTECA_REPLICAS=['replica'])
+class ReplicasTests(TransactionTestCase):
+    # Fora de TestCase: dentro de transaction.atomic() o roteador manda toda leitura para o primário.
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.livro = criar_livro()
+        self.bancos = []
+
+    def requisitar(self, acao, cookies=None):
+        @ler_da_replica
+        def view(request):
+            self.bancos.append(Livro.objects.all().db)
+            acao()
+            self.bancos.append(Livro.objects.all().db)
+            return HttpResponse()
+
+        requisicao = RequestFactory().get('/books/')
+        requisicao.COOKIES.update(cookies or {})
+        resposta = ReplicasMiddleware(view)(requisicao)
+        self.assertIsNone(_estado.get())
+        return resposta
+
+    def test_listagem_le_da_replica(self):
+        resposta = self.requisitar(lambda: list(Livro.objects.all()))
+        self.assertEqual(self.bancos, ['replica', 'replica'])
+        self.assertNotIn(COOKIE_PRIMARIO, resposta.cookies)
+        # Fora da requisição e fora de views @ler_da_replica, tudo vai ao primário.
+        self.assertEqual(Livro.objects.all().db, 'default')
+
+    def test_escrita_fixa_a_requisicao_no_primario(self):
+        resposta = self.requisitar(lambda: Livro.objects.filter(id=self.livro.id).update(genero='Clássico'))
+        self.assertEqual(self.bancos, ['replica', 'default'])
+        self.assertIn(COOKIE_PRIMARIO, resposta.cookies)
+
+        # Com o cookie, a requisição seguinte (o redirect depois do POST) também lê do primário.
+        self.bancos.clear()
+        self.requisitar(lambda: None, cookies={COOKIE_PRIMARIO: '1'})
+        self.assertEqual(self.bancos, ['default', 'default'])
+
+    def test_pagina_em_cache_e_gerada_do_primario(self):
+        # A página guardada vale para todos os visitantes: lê-la de uma réplica atrasada a deixaria velha.
+        @pagina_em_cache
+        @ler_da_replica
+        def view(request):
+            exibir_livros(request, [])
+            self.bancos.append(Livro.objects.all().db)
+            return HttpResponse()
+
+        requisicao = RequestFactory().get('/books/')
+        requisicao.user = AnonymousUser()
+        obter_cache().clear()
+        ReplicasMiddleware(view)(requisicao)
+        self.assertEqual(self.bancos, ['default'])
+
+    def test_gravar_a_sessao_nao_fixa_no_primario(self):
+        def gravar_sessao():
+            sessao = SessionStore()
+            sessao['visitou'] = True
+            sessao.save()
+
+        resposta = self.requisitar(gravar_sessao)
+        self.assertEqual(self.bancos, ['replica', 'replica'])
+        self.assertNotIn(COOKIE_PRIMARIO, resposta.cookies)
@@ -0,0 +1,30 @@
+import secrets
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import TravaTarefa
+
+
+def adquirir_trava(nome, segundos):
+    """Como cache.add para travar um comando agendado, mas numa linha do banco, que todos os processos veem.
+
+    Retorna o dono da trava, a passar para liberar_trava, ou None se outra execução a tem. Depois de
+    segundos a trava expira, para que um processo que caiu sem chamar liberar_trava não bloqueie a
+    tarefa para sempre.
+    """
+    agora = timezone.now()
+    dono = secrets.token_hex(16)
+    TravaTarefa.objects.filter(nome=nome, expira_em__lt=agora).delete()
+    try:
+        with transaction.atomic():
+            TravaTarefa.objects.create(nome=nome, dono=dono, expira_em=agora + timedelta(seconds=segundos))
+    except IntegrityError:
+        return None
+    return dono
+
+
+def liberar_trava(nome, dono):
+    # Só a trava desta execução: se ela expirou e outro processo travou a tarefa, a dele fica.
+    TravaTarefa.objects.filter(nome=nome, dono=dono).delete()
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.urls import path
 from .views import * 
+from .api import api_emprestimos, api_livros, api_recomendacoes, api_usuarios
 
 urlpatterns = [
     path('', pagina_inicial, name='pagina_inicial'),
@@ -13,17 +14,34 @@ urlpatterns = [
     path('emprestimo/', realizar_emprestimo, name='realizar_emprestimo'), 
     path('salvar_usuario/',salvar_usuario, name='salvar_usuario'), 
     path('books/add/', salvar_livro, name='salvar_livro'),
+    path('books/importar/', importar_livros_arquivo, name='importar_livros'),
+    path('books/cache/', estatisticas_cache_catalogo, name='estatisticas_cache_catalogo'),
+    path('metrics', exportar_metricas, name='metricas'),
+    path('api/v1/livros/', api_livros, name='api_livros'),
+    path('api/v1/livros/<int:livro_id>/recomendacoes/', api_recomendacoes, name='api_recomendacoes'),
+    path('api/v1/usuarios/', api_usuarios, name='api_usuarios'),
+    path('api/v1/emprestimos/', api_emprestimos, name='api_emprestimos'),
     path('emprestimos/pesquisar/', pesquisar_emprestimos, name='pesquisar_emprestimos'),
     path('emprestimos/<int:emprestimo_id>/devolver/', devolver_emprestimo, name='devolver_emprestimo'),
     path('devolucao/', devolucao_page, name='devolucao_page'), 
+    path('devolucao/lote/', devolucao_em_lote, name='devolucao_em_lote'),
+    path('devolucao/exportar/', exportar_devolvidos, name='exportar_devolvidos'),
+    path('emprestimos/exportar/', exportar_ativos, name='exportar_ativos'),
+    path('emprestimos/vencidos/', emprestimos_vencidos, name='emprestimos_vencidos'),
     path('emprestimo/devolver/<int:emprestimo_id>/', devolver_emprestimo, name='devolver_emprestimo'), 
     path('devolver_emprestimo/<int:emprestimo_id>/',devolver_emprestimo, name='devolver_emprestimo'), 
     path('emprestimo/<int:emprestimo_id>/', devolver_emprestimo, name='detalhe_emprestimo'),
     path('usuario/edit/<int:usuario_id>/', editar_usuario, name='editar_usuario'),
     path('usuario/excluir/<int:usuario_id>/', excluir_usuario, name='excluir_usuario'),
     path('books/edit/<int:livro_id>/', editar_livro, name='editar_livro'),
+    path('books/<int:livro_id>/recomendacoes/', recomendacoes_livro, name='recomendacoes_livro'),
     path('books/delete/<int:livro_id>/', excluir_livro, name='excluir_livro'),
     path('emprestimos/editar/<int:emprestimo_id>/', editar_emprestimo, name='editar_emprestimo'),
+    path('autocompletar/livros/', autocompletar_livros, name='autocompletar_livros'),
+    path('autocompletar/usuarios/', autocompletar_usuarios, name='autocompletar_usuarios'),
+    path('reservas/', reservas, name='reservas_page'),
+    path('books/<int:livro_id>/reservar/', reservar_livro, name='reservar_livro'),
+    path('reservas/<int:reserva_id>/cancelar/', cancelar_reserva, name='cancelar_reserva'),
     path('register/',user_register, name='register_page'),
     path('login/', user_login, name='login_page'), 
     path('logout/',user_logout, name='logout_page'), 
@@ -0,0 +1,21 @@
+from django.urls import path
+
+from . import views_async
+from .urls import urlpatterns as urlpatterns_wsgi
+
+
+# Em servidores ASGI aponte ROOT_URLCONF (ou o include do projeto) para este módulo:
+# as rotas abaixo trocam pelas views assíncronas e o restante continua igual a urls.py.
+VIEWS_ASYNC = {
+    'login_page': views_async.user_login,
+    'register_page': views_async.user_register,
+    'books_page': views_async.books,
+    'usuarios_page': views_async.usuario,
+    'pesquisar_emprestimos': views_async.pesquisar_emprestimos,
+    'devolucao_page': views_async.devolucao_page,
+}
+
+urlpatterns = [
+    path(str(padrao.pattern), VIEWS_ASYNC[padrao.name], name=padrao.name) if padrao.name in VIEWS_ASYNC else padrao
+    for padrao in urlpatterns_wsgi
+]
@@ -1,29 +1,61 @@
+import json
+import re
 from datetime import timedelta
 from django.shortcuts import render, redirect, get_object_or_404
+from django.utils.cache import patch_cache_control
 from django.contrib import messages
 from django.contrib.auth.hashers import make_password, check_password 
-from django.db.models import Q 
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from django.http import HttpResponse 
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
 from django.db import transaction 
-from .models import Livro, Usuario, Emprestimo 
+from .models import Exemplar, Livro, Usuario, Emprestimo, EmprestimoArquivado, Reserva
 from .forms import UsuarioLoginForm, UsuarioRegistroForm, UsuarioAdminForm 
+from .busca import buscar_livros
+from .paginacao import paginar_por_chave
+from .replicas import banco_de_leitura, ler_da_replica
+from .orcamento_consultas import orcamento_consultas
+from .metricas import CONTENT_TYPE as CONTENT_TYPE_METRICAS, pode_ver_metricas, registro as registro_metricas
+from .circulacao import (
+    MAXIMO_DEVOLUCOES_POR_LOTE, LivroIndisponivel, LoteDevolucaoInvalido, ReservaInvalida, alterar_emprestimo,
+    devolver_em_lote, emprestar_livro, reservar_livro as reservar,
+)
+from .exportacao import COLUNAS_EMPRESTIMO, FORMATOS, exportar_queryset
+from .cache_catalogo import estatisticas as estatisticas_cache, exibir_livros, pagina_em_cache
+from .estatisticas import resumo_circulacao
+from .arquivo import idade_padrao as idade_arquivo
+from .exclusao import ExclusaoRecusada, solicitar_exclusao
+from .recomendacoes import recomendacoes_do_livro
+from .autorizacao import (
+    PERMISSAO_ADMIN, PERMISSAO_GERENCIAMENTO, PERMISSAO_LEITOR, papel_do_usuario, papel_requerido, papel_requerido_json,
+)
+from .importacao import DadosLivroInvalidos, LEITORES, abrir_texto, detectar_formato, importar_livros, validar_dados_livro
 from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
 from django.contrib.auth.decorators import login_required 
 
 
-PERMISSAO_GERENCIAMENTO = ('admin', 'funcionario')
-PERMISSAO_ADMIN = ('admin',)
+def filtro_busca_emprestimos(query):
+    return (
+        Q(livro__titulo__icontains=query) |
+        Q(livro__autor__icontains=query) |
+        Q(usuario__reader_name__icontains=query) |
+        Q(usuario__reader_contact__icontains=query)
+    )
 
+def filtro_busca_usuarios(query):
+    return (
+        Q(reader_name__icontains=query) |
+        Q(reader_contact__icontains=query) |
+        Q(login__icontains=query) |
+        Q(email__icontains=query)
+    )
 
-def verificar_permissao(request, required_types, error_message):
-    if request.user.tipo_usuario.lower() not in required_types:
-        messages.error(request, error_message)
-        return redirect('pagina_inicial')
-    return None
-
+@orcamento_consultas(8)
 def pagina_inicial(request):
-    return render(request, "home.html", context={"current_tab": "home"})
+    # O painel lê só as tabelas de estatísticas, mantidas a cada empréstimo e devolução.
+    resumo = resumo_circulacao(incluir_leitores=papel_do_usuario(request.user) in PERMISSAO_GERENCIAMENTO)
+    return render(request, "home.html", context={"current_tab": "home", "estatisticas": resumo})
 
 def shopping(request):
     return HttpResponse("Bem-vindo(a) às compras")
@@ -81,39 +113,52 @@ def user_logout(request):
     messages.info(request, "Foi desconectado(a).")
     return redirect('login_page')
     
+@pagina_em_cache
+@orcamento_consultas(4)
+@ler_da_replica
 def books(request):
     query = request.GET.get('query', '')
     
+    pagina = None
     if query:
-        todos_os_livros = Livro.objects.filter(
-            Q(titulo__icontains=query) | Q(autor__icontains=query)
-        )
+        todos_os_livros = buscar_livros(query)
     else:
-        todos_os_livros = Livro.objects.all()
+        pagina = paginar_por_chave(request, Livro.objects.all(), ordenacao=('id',))
+        todos_os_livros = pagina
+    exibir_livros(request, todos_os_livros)
 
     return render(request, "books.html",
                     context={
                         "current_tab": "books",
                         "livros": todos_os_livros,
+                        "pagina": pagina,
                         "query": query
                     })
 
 @login_required 
-def usuario(request):
-    if verificar_permissao(request, PERMISSAO_GERENCIAMENTO, "Não tem permissão para aceder a esta página."):
-        return verificar_permissao(request, PERMISSAO_GERENCIAMENTO, "Não tem permissão para aceder a esta página.")
+@papel_requerido(PERMISSAO_GERENCIAMENTO)
+def estatisticas_cache_catalogo(request):
+    return JsonResponse(estatisticas_cache())
+
+def exportar_metricas(request):
+    # Superusuários, ou sem login a partir de um IP listado em BIBLIOTECA_METRICAS_IPS (o do Prometheus).
+    if not pode_ver_metricas(request):
+        return HttpResponseForbidden("Métricas disponíveis só para superusuários e para os IPs de BIBLIOTECA_METRICAS_IPS.")
+    return HttpResponse(registro_metricas.exportar(), content_type=CONTENT_TYPE_METRICAS)
 
+@login_required 
+@orcamento_consultas(2)
+@papel_requerido(PERMISSAO_GERENCIAMENTO)
+@ler_da_replica
+def usuario(request):
     form = UsuarioAdminForm(request_user=request.user) 
     query = request.GET.get('query') 
     
     todos_os_usuarios = Usuario.objects.all()
     if query:
-        todos_os_usuarios = todos_os_usuarios.filter(
-            Q(reader_name__icontains=query) |
-            Q(reader_contact__icontains=query) |
-            Q(login__icontains=query) |
-            Q(email__icontains=query) 
-        ).distinct() 
+        todos_os_usuarios = todos_os_usuarios.filter(filtro_busca_usuarios(query)).distinct()
+
+    pagina = paginar_por_chave(request, todos_os_usuarios, ordenacao=('id',))
 
     can_delete_users = False
     if request.user.is_superuser:
@@ -123,7 +168,8 @@ def usuario(request):
 
     context = {
         "current_tab": "usuario", 
-        "usuarios": todos_os_usuarios,
+        "usuarios": pagina,
+        "pagina": pagina,
         "query": query if query else "",
         "form": form 
     }
@@ -131,10 +177,8 @@ def usuario(request):
     return render(request, "usuario.html", context=context)
 
 @login_required 
+@papel_requerido(PERMISSAO_GERENCIAMENTO)
 def salvar_usuario(request):
-    if verificar_permissao(request, PERMISSAO_GERENCIAMENTO, "Não tem permissão para aceder a esta página."):
-        return verificar_permissao(request, PERMISSAO_GERENCIAMENTO, "Não tem permissão para aceder a esta página.")
-    
     if request.method == "POST":
         form = UsuarioAdminForm(request.POST, request_user=request.user) 
         if form.is_valid():
@@ -151,57 +195,72 @@ def salvar_usuario(request):
     return redirect('usuarios_page')
     
 @login_required 
+@papel_requerido(PERMISSAO_GERENCIAMENTO)
 def salvar_livro(request):
-    if verificar_permissao(request, PERMISSAO_GERENCIAMENTO):
-        return verificar_permissao(request, PERMISSAO_GERENCIAMENTO)
-        
     if request.method == "POST":
         titulo = request.POST.get('titulo') 
         autor = request.POST.get('autor')
         ano_publicacao_str = request.POST.get('ano_publicacao') 
         genero = request.POST.get('genero')
+        exemplares = request.POST.get('exemplares')
 
-        if not titulo or not autor:
-            messages.error(request, "Título e autor do livro são obrigatórios.")
+        try:
+            dados_livro = validar_dados_livro(titulo, autor, ano_publicacao_str, genero, exemplares)
+        except DadosLivroInvalidos as e:
+            messages.error(request, str(e))
             return redirect('books_page')
 
-        ano_publicacao = None
-        if ano_publicacao_str:
-            try:
-                ano_publicacao = int(ano_publicacao_str) 
-            except ValueError:
-                messages.error(request, "Ano de Publicação deve ser um número válido.")
-                return redirect('books_page')
-
         try:
-            Livro.objects.create(
-                titulo=titulo,
-                autor=autor,
-                ano_publicacao=ano_publicacao,
-                genero=genero,
-                disponivel=True 
-            )
-            messages.success(request, f"Livro '{titulo}' de {autor} salvo com sucesso!")
+            livro, criado = Livro.objects.cadastrar(**dados_livro)
+            if criado:
+                messages.success(request, f"Livro '{livro.titulo}' de {livro.autor} salvo com sucesso!")
+            else:
+                messages.success(request, f"{dados_livro['exemplares']} exemplar(es) somado(s) ao livro '{livro.titulo}' já cadastrado (agora {livro.total_exemplares}).")
         except Exception as e:
             messages.error(request, f"Ocorreu um erro ao salvar o livro: {e}")
 
     return redirect('books_page')
+
+@login_required 
+@papel_requerido(PERMISSAO_GERENCIAMENTO, "Não tem permissão para importar livros.")
+def importar_livros_arquivo(request):
+    if request.method == "POST":
+        arquivo = request.FILES.get('arquivo')
+        if not arquivo:
+            messages.error(request, "Selecione um arquivo CSV ou JSONL para importar.")
+            return redirect('books_page')
+
+        formato = detectar_formato(arquivo.name)
+        try:
+            resultado = importar_livros(LEITORES[formato](abrir_texto(arquivo.file)))
+        except Exception as e:
+            messages.error(request, f"Ocorreu um erro ao importar os livros: {e}")
+            return redirect('books_page')
+
+        messages.success(
+            request,
+            f"{resultado.importadas} livro(s) importado(s) de {resultado.lidas} linha(s); "
+            f"{resultado.titulos_novos} título(s) novo(s), os demais somados a títulos existentes.",
+        )
+        for numero, erro in resultado.erros[:10]:
+            messages.error(request, f"Linha {numero}: {erro}")
+        if len(resultado.erros) > 10:
+            messages.error(request, f"... e mais {len(resultado.erros) - 10} linha(s) rejeitada(s).")
+
+    return redirect('books_page')
     
 @login_required 
+@orcamento_consultas(14)
+@papel_requerido(PERMISSAO_GERENCIAMENTO)
 def realizar_emprestimo(request):
-    if verificar_permissao(request, PERMISSAO_GERENCIAMENTO, "Não tem permissão para aceder a esta página."):
-        return verificar_permissao(request, PERMISSAO_GERENCIAMENTO, "Não tem permissão para aceder a esta página.")
-
     def render_emprestimo_page(request, error_message=None):
         if error_message:
             messages.error(request, error_message)
-        livros_disponiveis = Livro.objects.filter(disponivel=True).order_by('titulo')
-        usuarios_ativos = Usuario.objects.all().order_by('reader_name')
-        emprestimos_ativos = Emprestimo.objects.filter(devolvido=False).order_by('data_emprestimo') 
+        emprestimos_ativos = paginar_por_chave(request, Emprestimo.objects.filter(devolvido=False).select_related('livro', 'usuario'),
+                                               ordenacao=('data_emprestimo', 'id'))
         return render(request, 'emprestimo.html', {
-            'livros': livros_disponiveis,
-            'usuarios': usuarios_ativos,
             'emprestimos_ativos': emprestimos_ativos,
+            'pagina': emprestimos_ativos,
             'current_tab': 'emprestimo',
         })
 
@@ -213,29 +272,13 @@ def realizar_emprestimo(request):
             return render_emprestimo_page(request, "Por favor, selecione um livro e um usuário.")
 
         try:
-            livro = get_object_or_404(Livro, id=livro_id)
-            usuario = get_object_or_404(Usuario, id=usuario_id)
-
-            with transaction.atomic():
-                if not livro.disponivel:
-                    return render_emprestimo_page(request, f"O livro '{livro.titulo}' não está disponível para empréstimo.")
-                
-                data_emprestimo_atual = timezone.now()
-                data_devolucao_prevista_calc = data_emprestimo_atual + timedelta(days=7)
-
-                Emprestimo.objects.create(
-                    livro=livro,
-                    usuario=usuario,
-                    data_emprestimo=data_emprestimo_atual,
-                    data_devolucao_prevista=data_devolucao_prevista_calc,
-                    devolvido=False
-                )
-                
-                livro.disponivel = False
-                livro.save()
-                messages.success(request, f"Livro '{livro.titulo}' emprestado com sucesso para '{usuario.reader_name}'. Data de devolução prevista: {data_devolucao_prevista_calc.strftime('%d/%m/%Y %H:%M')}")
-                return redirect('realizar_emprestimo') 
+            usuario = get_object_or_404(Usuario.objects, id=usuario_id)
+            emprestimo = emprestar_livro(livro_id, usuario)
+            messages.success(request, f"Livro '{emprestimo.livro.titulo}' emprestado com sucesso para '{usuario.reader_name}'. Data de devolução prevista: {emprestimo.data_devolucao_prevista.strftime('%d/%m/%Y %H:%M')}")
+            return redirect('realizar_emprestimo') 
 
+        except LivroIndisponivel as e:
+            return render_emprestimo_page(request, str(e))
         except Exception as e:
             return render_emprestimo_page(request, f"Ocorreu um erro ao realizar o empréstimo: {e}")
     
@@ -243,27 +286,20 @@ def realizar_emprestimo(request):
 
 
 @login_required 
+@orcamento_consultas(1)
+@papel_requerido(PERMISSAO_GERENCIAMENTO)
 def pesquisar_emprestimos(request):
-    if verificar_permissao(request, PERMISSAO_GERENCIAMENTO, "Não tem permissão para aceder a esta página."):
-        return verificar_permissao(request, PERMISSAO_GERENCIAMENTO, "Não tem permissão para aceder a esta página.")
-        
     query = request.GET.get('query')
-    emprestimos_ativos = Emprestimo.objects.filter(devolvido=False)
+    emprestimos_ativos = Emprestimo.objects.filter(devolvido=False).select_related('livro', 'usuario')
 
     if query:
-        emprestimos_ativos = emprestimos_ativos.filter(
-            Q(livro__titulo__icontains=query) |
-            Q(livro__autor__icontains=query) |
-            Q(usuario__reader_name__icontains=query) |
-            Q(usuario__reader_contact__icontains=query)
-        ).distinct()
+        emprestimos_ativos = emprestimos_ativos.filter(filtro_busca_emprestimos(query)).distinct()
 
-    emprestimos_ativos = emprestimos_ativos.order_by('-data_emprestimo')
+    emprestimos_ativos = paginar_por_chave(request, emprestimos_ativos, ordenacao=('-data_emprestimo', '-id'))
 
     context = {
-        'livros': Livro.objects.filter(disponivel=True),
-        'usuarios': Usuario.objects.all(),
         'emprestimos_ativos': emprestimos_ativos,
+        'pagina': emprestimos_ativos,
         'query': query,
         'current_tab': 'emprestimo'
     }
@@ -271,14 +307,11 @@ def pesquisar_emprestimos(request):
     return render(request, 'emprestimo.html', context)
 
 @login_required 
+@papel_requerido(PERMISSAO_GERENCIAMENTO)
 def devolver_emprestimo(request, emprestimo_id):
-    if verificar_permissao(request, PERMISSAO_GERENCIAMENTO, ):
-        return verificar_permissao(request, PERMISSAO_GERENCIAMENTO, )
-        
     if request.method == 'POST':
         emprestimo = get_object_or_404(Emprestimo, id=emprestimo_id)
-        if not emprestimo.devolvido:
-            emprestimo.marcar_como_devolvido() 
+        if emprestimo.marcar_como_devolvido():
             messages.success(request, f"Livro '{emprestimo.livro.titulo}' devolvido com sucesso por {emprestimo.usuario.reader_name}.")
         else:
             messages.info(request, "Este empréstimo já foi marcado como devolvido.")
@@ -286,38 +319,212 @@ def devolver_emprestimo(request, emprestimo_id):
     return redirect('devolucao_page') 
 
 @login_required 
+@orcamento_consultas(80)
+@papel_requerido(PERMISSAO_GERENCIAMENTO)
+def devolucao_em_lote(request):
+    # Formulário com os identificadores separados por linha/espaço/vírgula, ou JSON
+    # {"emprestimos": [...], "livros": [...]}, que recebe o resultado por item em JSON.
+    # As consultas crescem com os gêneros e vencimentos distintos do lote, não com o número de itens.
+    via_json = request.content_type == 'application/json'
+    contexto = {
+        'itens': None,
+        'maximo_itens': MAXIMO_DEVOLUCOES_POR_LOTE,
+        'emprestimos_informados': request.POST.get('emprestimos', ''),
+        'livros_informados': request.POST.get('livros', ''),
+        'current_tab': 'devolucao',
+    }
+    if request.method == 'POST':
+        if via_json:
+            try:
+                dados = json.loads(request.body)
+            except ValueError:
+                dados = None
+            if not isinstance(dados, dict) or not all(isinstance(dados.get(chave, []), list) for chave in ('emprestimos', 'livros')):
+                return JsonResponse({'erro': 'Envie {"emprestimos": [...], "livros": [...]}.'}, status=400)
+            emprestimos, livros = dados.get('emprestimos', []), dados.get('livros', [])
+        else:
+            emprestimos = re.split(r'[\s,;]+', contexto['emprestimos_informados'])
+            livros = re.split(r'[\s,;]+', contexto['livros_informados'])
+
+        try:
+            itens = devolver_em_lote(emprestimos, livros)
+        except LoteDevolucaoInvalido as e:
+            if via_json:
+                return JsonResponse({'erro': str(e)}, status=400)
+            messages.error(request, str(e))
+        else:
+            devolvidos = sum(item.devolvido for item in itens)
+            if via_json:
+                return JsonResponse({'devolvidos': devolvidos, 'itens': [item.como_dict() for item in itens]})
+            messages.success(request, f"{devolvidos} de {len(itens)} item(ns) devolvido(s).")
+            contexto['itens'] = itens
+
+    return render(request, 'devolucao_lote.html', contexto)
+
+@login_required 
+@orcamento_consultas(2)
+@papel_requerido(PERMISSAO_GERENCIAMENTO)
+@ler_da_replica
 def devolucao_page(request):
-    if verificar_permissao(request, PERMISSAO_GERENCIAMENTO, "Não tem permissão para aceder a esta página."):
-        return verificar_permissao(request, PERMISSAO_GERENCIAMENTO, "Não tem permissão para aceder a esta página.")
-        
     query = request.GET.get('query')
+    # O histórico arquivado só é lido quando pedido: a página padrão consulta apenas a tabela quente.
+    arquivo = request.GET.get('arquivo') == '1'
 
-    emprestimos_devolvidos = Emprestimo.objects.filter(devolvido=True).select_related('livro', 'usuario')
+    modelo = EmprestimoArquivado if arquivo else Emprestimo
+    emprestimos_devolvidos = modelo.objects.filter(devolvido=True).select_related('livro', 'usuario')
 
     if query:
-        emprestimos_devolvidos = emprestimos_devolvidos.filter(
-            Q(livro__titulo__icontains=query) |
-            Q(livro__autor__icontains=query) |
-            Q(usuario__reader_name__icontains=query) |
-            Q(usuario__reader_contact__icontains=query) 
-        ).distinct()
+        emprestimos_devolvidos = emprestimos_devolvidos.filter(filtro_busca_emprestimos(query)).distinct()
 
-    emprestimos_devolvidos = emprestimos_devolvidos.order_by('id')
+    emprestimos_devolvidos = paginar_por_chave(request, emprestimos_devolvidos, ordenacao=('id',))
 
     return render(request, 'devolucao.html', {
         'emprestimos_devolvidos': emprestimos_devolvidos,
+        'pagina': emprestimos_devolvidos,
         'query': query,
+        'arquivo': arquivo,
+        'dias_arquivo': idade_arquivo().days,
         'current_tab': 'devolucao'
     })
 
 @login_required 
+@papel_requerido(PERMISSAO_GERENCIAMENTO, "Não tem permissão para exportar empréstimos.")
+@ler_da_replica
+def exportar_emprestimos(request, devolvidos):
+    formato = request.GET.get('formato', 'csv')
+    if formato not in FORMATOS:
+        formato = 'csv'
+    query = request.GET.get('query')
+    arquivo = devolvidos and request.GET.get('arquivo') == '1'
+
+    # A resposta é consumida depois que a view retorna: fixa o banco agora.
+    modelo = EmprestimoArquivado if arquivo else Emprestimo
+    emprestimos = modelo.objects.using(banco_de_leitura()).filter(devolvido=devolvidos)
+    if query:
+        emprestimos = emprestimos.filter(filtro_busca_emprestimos(query))
+
+    nome_arquivo = 'emprestimos_arquivados' if arquivo else 'emprestimos_devolvidos' if devolvidos else 'emprestimos_ativos'
+    return exportar_queryset(emprestimos.order_by('id'), COLUNAS_EMPRESTIMO, formato, nome_arquivo,
+                             gzip=request.GET.get('gzip') == '1')
+
+def exportar_devolvidos(request):
+    return exportar_emprestimos(request, devolvidos=True)
+
+def exportar_ativos(request):
+    return exportar_emprestimos(request, devolvidos=False)
+
+LIMITE_AUTOCOMPLETAR = 20
+TEMPO_CACHE_AUTOCOMPLETAR = 60
+
+def _resposta_autocompletar(resultados):
+    resposta = JsonResponse({'resultados': resultados})
+    patch_cache_control(resposta, private=True, max_age=TEMPO_CACHE_AUTOCOMPLETAR)
+    return resposta
+
+def _limite_autocompletar(request):
+    try:
+        return max(1, min(int(request.GET.get('limite', LIMITE_AUTOCOMPLETAR)), LIMITE_AUTOCOMPLETAR))
+    except ValueError:
+        return LIMITE_AUTOCOMPLETAR
+
+@login_required 
+@papel_requerido_json(PERMISSAO_GERENCIAMENTO, "Não tem permissão para pesquisar livros.")
+def autocompletar_livros(request):
+    termo = request.GET.get('q', '').strip()
+    if not termo:
+        return _resposta_autocompletar([])
+
+    livros = Livro.objects.filter(titulo__istartswith=termo)
+    if request.GET.get('disponiveis') == '1':
+        livros = livros.disponiveis()
+    livros = livros.order_by('titulo', 'id').values_list('id', 'titulo', 'autor')[:_limite_autocompletar(request)]
+
+    return _resposta_autocompletar([
+        {'id': livro_id, 'texto': f"{titulo} ({autor})"} for livro_id, titulo, autor in livros
+    ])
+
+@login_required 
+@papel_requerido_json(PERMISSAO_GERENCIAMENTO, "Não tem permissão para pesquisar usuários.")
+def autocompletar_usuarios(request):
+    termo = request.GET.get('q', '').strip()
+    if not termo:
+        return _resposta_autocompletar([])
+
+    usuarios = (
+        Usuario.objects.filter(reader_name__istartswith=termo)
+        .order_by('reader_name', 'id')
+        .values_list('id', 'reader_name')[:_limite_autocompletar(request)]
+    )
+    return _resposta_autocompletar([
+        {'id': usuario_id, 'texto': f"{nome} (ID: {usuario_id})"} for usuario_id, nome in usuarios
+    ])
+
+ORDENACOES_VENCIDOS = {
+    'atraso': ('-dias_atraso', 'id'),
+    'multa': ('-valor_multa', 'id'),
+    'vencimento': ('data_devolucao_prevista', 'id'),
+}
+
+@login_required 
+@orcamento_consultas(4)
+@papel_requerido(PERMISSAO_GERENCIAMENTO, "Não tem permissão para listar empréstimos vencidos.")
+def emprestimos_vencidos(request):
+    query = request.GET.get('query')
+    situacao = request.GET.get('situacao', 'ativos')
+    ordem = request.GET.get('ordem', 'atraso')
+    if ordem not in ORDENACOES_VENCIDOS:
+        ordem = 'atraso'
+
+    agora = timezone.now()
+    emprestimos = Emprestimo.objects.com_multa(agora)
+    # Os ativos vêm de vencidos(), que usa o índice parcial de data_devolucao_prevista; filtrar só pela
+    # anotação dias_atraso percorreria todos os empréstimos. Devolvidos no dia do vencimento não têm atraso.
+    ativos = emprestimos.vencidos(agora)
+    devolvidos = emprestimos.filter(devolvido=True, data_devolucao__gt=F('data_devolucao_prevista'), dias_atraso__gt=0)
+    if situacao == 'ativos':
+        vencidos = ativos
+    elif situacao == 'devolvidos':
+        vencidos = devolvidos
+    else:
+        vencidos = ativos | devolvidos
+
+    if query:
+        vencidos = vencidos.filter(
+            Q(livro__titulo__icontains=query) |
+            Q(usuario__reader_name__icontains=query) |
+            Q(usuario__reader_contact__icontains=query)
+        )
+
+    totais = vencidos.aggregate(
+        total_emprestimos=Count('id'),
+        total_multa=Coalesce(Sum('valor_multa'), 0),
+    )
+    totais_por_usuario = (
+        vencidos.order_by()
+        .values('usuario_id', 'usuario__reader_name')
+        .annotate(emprestimos=Count('id'), multa=Sum('valor_multa'), maior_atraso=Max('dias_atraso'))
+        .order_by('-multa', 'usuario_id')[:50]
+    )
+    pagina = paginar_por_chave(request, vencidos.select_related('livro', 'usuario'),
+                               ordenacao=ORDENACOES_VENCIDOS[ordem])
+
+    return render(request, 'emprestimos_vencidos.html', {
+        'emprestimos_vencidos': pagina,
+        'pagina': pagina,
+        'totais': totais,
+        'totais_por_usuario': totais_por_usuario,
+        'query': query,
+        'situacao': situacao,
+        'ordem': ordem,
+        'current_tab': 'vencidos',
+    })
+
+@login_required 
+@papel_requerido(PERMISSAO_GERENCIAMENTO)
 def editar_usuario(request, usuario_id):
-    if verificar_permissao(request, PERMISSAO_GERENCIAMENTO, "Não tem permissão para aceder a esta página."):
-        return verificar_permissao(request, PERMISSAO_GERENCIAMENTO)
-    
-    usuario_obj = get_object_or_404(Usuario, id=usuario_id)
+    usuario_obj = get_object_or_404(Usuario.objects, id=usuario_id)
 
-    if request.user.tipo_usuario.lower() == 'funcionario' and usuario_obj.tipo_usuario.lower() != 'membro_comum':
+    if papel_do_usuario(request.user) == 'funcionario' and papel_do_usuario(usuario_obj) != 'membro_comum':
         messages.error(request, "Funcionários só podem editar membros comuns.")
         return redirect('usuarios_page')
 
@@ -339,11 +546,9 @@ def editar_usuario(request, usuario_id):
     })
 
 @login_required 
+@papel_requerido(PERMISSAO_ADMIN, "Apenas administradores podem excluir usuários.")
 def excluir_usuario(request, usuario_id):
-    if verificar_permissao(request, PERMISSAO_ADMIN, "Apenas administradores podem excluir usuários."):
-        return verificar_permissao(request, PERMISSAO_ADMIN, "Apenas administradores podem excluir usuários.")
-        
-    usuario_a_excluir = get_object_or_404(Usuario, id=usuario_id)
+    usuario_a_excluir = get_object_or_404(Usuario.objects, id=usuario_id)
 
     if request.user.id == usuario_a_excluir.id:
         messages.error(request, "Não pode excluir a sua própria conta de administrador.")
@@ -351,20 +556,18 @@ def excluir_usuario(request, usuario_id):
 
     if request.method == 'POST':
         try:
-            nome_usuario = usuario_a_excluir.reader_name
-            usuario_a_excluir.delete()
-            messages.success(request, f"Utilizador '{nome_usuario}' excluído com sucesso!")
+            # O histórico de empréstimos é apagado depois, pelo comando expurgar_exclusoes.
+            solicitar_exclusao(usuario_a_excluir, solicitada_por=request.user)
+            messages.success(request, f"Utilizador '{usuario_a_excluir.reader_name}' excluído com sucesso!")
         except Exception as e:
             messages.error(request, f"Ocorreu um erro ao excluir o utilizador: {e}")
     
     return redirect('usuarios_page')
 
 @login_required 
+@papel_requerido(PERMISSAO_GERENCIAMENTO)
 def editar_livro(request, livro_id):
-    if verificar_permissao(request, PERMISSAO_GERENCIAMENTO, "Não tem permissão para aceder a esta página."):
-        return verificar_permissao(request, PERMISSAO_GERENCIAMENTO)
-        
-    livro_a_editar = get_object_or_404(Livro, id=livro_id)
+    livro_a_editar = get_object_or_404(Livro.objects, id=livro_id)
 
     if request.method == 'POST':
         try:
@@ -374,42 +577,57 @@ def editar_livro(request, livro_id):
             ano_publicacao_str = request.POST.get('ano_publicacao')
             livro_a_editar.ano_publicacao = int(ano_publicacao_str) if ano_publicacao_str else None 
             livro_a_editar.genero = request.POST.get('genero')
-            livro_a_editar.disponivel = request.POST.get('disponivel') == 'True'
+            novos_exemplares = int(request.POST.get('novos_exemplares') or 0)
 
-            livro_a_editar.save()
+            # Os contadores de exemplares só mudam por UPDATE com F(); não são regravados aqui.
+            livro_a_editar.save(update_fields=['titulo', 'autor', 'ano_publicacao', 'genero'])
+            if novos_exemplares > 0:
+                Exemplar.objects.registrar(livro_a_editar, novos_exemplares)
             messages.success(request, f"Livro '{livro_a_editar.titulo}' atualizado com sucesso!")
         except ValueError:
-            messages.error(request, "Erro: O 'Ano de Publicação' deve ser um número válido.")
+            messages.error(request, "Erro: 'Ano de Publicação' e 'Novos exemplares' devem ser números válidos.")
         except Exception as e:
             messages.error(request, f"Erro inesperado ao atualizar livro: {e}")
             
         return redirect('books_page')
     
-    return render(request, 'editar_livro.html', {'livro': livro_a_editar})
+    return render(request, 'editar_livro.html', {
+        'livro': livro_a_editar,
+        'recomendacoes': recomendacoes_do_livro(livro_a_editar.id),
+    })
+
+@orcamento_consultas(4)
+@ler_da_replica
+def recomendacoes_livro(request, livro_id):
+    # Pública como a listagem de livros: é daqui que membros e visitantes veem as recomendações.
+    livro = get_object_or_404(Livro.objects, id=livro_id)
+    return render(request, 'recomendacoes_livro.html', {
+        'livro': livro,
+        'recomendacoes': recomendacoes_do_livro(livro.id),
+        'current_tab': 'books',
+    })
 
 @login_required
+@papel_requerido(PERMISSAO_ADMIN, "Apenas administradores podem excluir livros.")
 def excluir_livro(request, livro_id):
-    if verificar_permissao(request, PERMISSAO_ADMIN, "Apenas administradores podem excluir livros."):
-        return verificar_permissao(request, PERMISSAO_ADMIN, "Apenas administradores podem excluir livros.")
-        
-    livro_a_excluir = get_object_or_404(Livro, id=livro_id)
+    livro_a_excluir = get_object_or_404(Livro.objects, id=livro_id)
 
     if request.method == 'POST':
         try:
-            titulo_livro = livro_a_excluir.titulo 
-            livro_a_excluir.delete()
-            messages.success(request, f"Livro '{titulo_livro}' excluído com sucesso!")
+            solicitar_exclusao(livro_a_excluir, solicitada_por=request.user)
+            messages.success(request, f"Livro '{livro_a_excluir.titulo}' excluído com sucesso!")
+        except ExclusaoRecusada as e:
+            messages.error(request, str(e))
         except Exception as e:
             messages.error(request, f"Ocorreu um erro ao excluir o livro: {e}")
 
     return redirect('books_page') 
 
 @login_required 
+@orcamento_consultas(25)
+@papel_requerido(PERMISSAO_GERENCIAMENTO)
 def editar_emprestimo(request, emprestimo_id):
-    if verificar_permissao(request, PERMISSAO_GERENCIAMENTO, "Não tem permissão para aceder a esta página."):
-        return verificar_permissao(request, PERMISSAO_GERENCIAMENTO, "Não tem permissão para aceder a esta página.")
-        
-    emprestimo_a_editar = get_object_or_404(Emprestimo, id=emprestimo_id)
+    emprestimo_a_editar = get_object_or_404(Emprestimo.objects.select_related('livro', 'usuario'), id=emprestimo_id)
 
     if request.method == 'POST':
         try:
@@ -417,14 +635,12 @@ def editar_emprestimo(request, emprestimo_id):
             usuario_id = request.POST.get('usuario_id')
             devolvido_str = request.POST.get('devolvido')
 
-            emprestimo_a_editar.livro = get_object_or_404(Livro, id=livro_id)
-            emprestimo_a_editar.usuario = get_object_or_404(Usuario, id=usuario_id)
-            emprestimo_a_editar.devolvido = devolvido_str == 'True'
-
-            if emprestimo_a_editar.devolvido and not emprestimo_a_editar.data_devolucao:
-                emprestimo_a_editar.data_devolucao = timezone.now()
-
-            emprestimo_a_editar.save()
+            alterar_emprestimo(
+                emprestimo_a_editar,
+                livro=get_object_or_404(Livro.objects, id=livro_id),
+                usuario=get_object_or_404(Usuario.objects, id=usuario_id),
+                devolvido=devolvido_str == 'True',
+            )
             messages.success(request, f"Empréstimo (ID: {emprestimo_a_editar.id}) atualizado com sucesso!")
         except Exception as e:
             messages.error(request, f"Erro ao atualizar empréstimo: {e}")
@@ -433,8 +649,59 @@ def editar_emprestimo(request, emprestimo_id):
     
     context = {
         'emprestimo': emprestimo_a_editar,
-        'livros': Livro.objects.filter(Q(disponivel=True) | Q(id=emprestimo_a_editar.livro.id)),
-        'usuarios': Usuario.objects.all(),
         'current_tab': 'emprestimo',
     }
-    return render(request, 'editar_emprestimo.html', context)
\ No newline at end of file
+    return render(request, 'editar_emprestimo.html', context)
+
+@login_required 
+@orcamento_consultas(2)
+@papel_requerido(PERMISSAO_LEITOR)
+def reservas(request):
+    abertas = Reserva.objects.abertas().select_related('livro', 'usuario')
+    # Funcionários veem a fila de todos; membros, só as próprias reservas.
+    if papel_do_usuario(request.user) not in PERMISSAO_GERENCIAMENTO:
+        abertas = abertas.filter(usuario=request.user)
+
+    # Posição na fila: quantas reservas do mesmo livro aguardam desde antes (usa o índice da fila).
+    posicao = (
+        Reserva.objects.filter(livro_id=OuterRef('livro_id'), status=Reserva.AGUARDANDO,
+                               data_reserva__lte=OuterRef('data_reserva'))
+        .order_by().values('livro_id').annotate(total=Count('id')).values('total')
+    )
+    pagina = paginar_por_chave(request, abertas.annotate(posicao=Subquery(posicao)),
+                               ordenacao=('data_reserva', 'id'))
+
+    return render(request, 'reservas.html', {
+        'reservas': pagina,
+        'pagina': pagina,
+        'current_tab': 'reservas',
+    })
+
+@login_required 
+@papel_requerido(PERMISSAO_LEITOR, "Não tem permissão para reservar livros.")
+def reservar_livro(request, livro_id):
+    if request.method == 'POST':
+        try:
+            reserva = reservar(livro_id, request.user)
+            messages.success(request, f"Reserva de '{reserva.livro.titulo}' registrada. Acompanhe sua posição na fila em Reservas.")
+        except Livro.DoesNotExist:
+            messages.error(request, "Livro não encontrado.")
+        except ReservaInvalida as e:
+            messages.error(request, str(e))
+        return redirect('reservas_page')
+    return redirect('books_page')
+
+@login_required 
+@papel_requerido(PERMISSAO_LEITOR, "Não tem permissão para cancelar reservas.")
+def cancelar_reserva(request, reserva_id):
+    reserva = get_object_or_404(Reserva.objects.select_related('livro'), id=reserva_id)
+    if reserva.usuario_id != request.user.id and papel_do_usuario(request.user) not in PERMISSAO_GERENCIAMENTO:
+        messages.error(request, "Só é possível cancelar as próprias reservas.")
+        return redirect('reservas_page')
+
+    if request.method == 'POST':
+        if reserva.cancelar():
+            messages.success(request, f"Reserva de '{reserva.livro.titulo}' cancelada.")
+        else:
+            messages.info(request, "Esta reserva já estava encerrada.")
+    return redirect('reservas_page')
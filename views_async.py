@@ -0,0 +1,144 @@
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth import alogin
+from django.contrib.auth.decorators import login_required
+from django.db.models import Q
+from django.shortcuts import redirect, render
+
+from .arquivo import idade_padrao as idade_arquivo
+from .autenticacao_async import aautenticar, agerar_hash_senha
+from .autorizacao import PERMISSAO_GERENCIAMENTO, papel_requerido
+from .busca import buscar_livros
+from .cache_catalogo import exibir_livros, pagina_em_cache
+from .forms import UsuarioAdminForm, UsuarioLoginForm, UsuarioRegistroForm
+from .models import Emprestimo, EmprestimoArquivado, Livro, Usuario
+from .paginacao import apaginar_por_chave
+from .replicas import ler_da_replica
+from .views import filtro_busca_emprestimos
+
+
+# Versões ASGI do login, do registro e das listagens somente leitura (ligadas em urls_asgi.py).
+# Os templates leem atributos de forma preguiçosa, então a renderização roda numa thread.
+arender = sync_to_async(render)
+
+
+async def user_register(request):
+    if request.method == 'POST':
+        form = UsuarioRegistroForm(request.POST)
+        if await sync_to_async(form.is_valid)():
+            senha_hash = await agerar_hash_senha(form.cleaned_data['password'])
+            await sync_to_async(form.save)(senha_hash=senha_hash)
+            messages.success(request, 'Registo realizado com sucesso! Inicie sessão para continuar.')
+            return redirect('login_page')
+        return await arender(request, 'register.html', {'form': form, 'current_tab': 'register'})
+    form = UsuarioRegistroForm()
+    return await arender(request, 'register.html', {'form': form, 'current_tab': 'register'})
+
+
+async def user_login(request):
+    if request.method == 'POST':
+        form = UsuarioLoginForm(request.POST)
+        if form.is_valid():
+            user = await aautenticar(form.cleaned_data.get('login'), form.cleaned_data.get('password'))
+
+            if user is not None:
+                await alogin(request, user)
+                request.session['user_id'] = user.id
+                request.session['user_type'] = user.tipo_usuario
+                messages.success(request, f"Bem-vindo(a), {user.reader_name}!")
+                return redirect('home_page')
+            messages.error(request, "Nome de utilizador ou palavra-passe inválidos.")
+        else:
+            messages.error(request, "Por favor, corrija os erros no formulário de início de sessão.")
+        return await arender(request, 'user_login.html', {'form': form, 'current_tab': 'login'})
+
+    form = UsuarioLoginForm()
+    return await arender(request, 'user_login.html', {'form': form, 'current_tab': 'login'})
+
+
+@pagina_em_cache
+@ler_da_replica
+async def books(request):
+    request.user = await request.auser()
+    query = request.GET.get('query', '')
+
+    pagina = None
+    if query:
+        todos_os_livros = await sync_to_async(buscar_livros)(query)
+    else:
+        pagina = await apaginar_por_chave(request, Livro.objects.all(), ordenacao=('id',))
+        todos_os_livros = pagina
+    exibir_livros(request, todos_os_livros)
+
+    return await arender(request, "books.html", context={
+        "current_tab": "books",
+        "livros": todos_os_livros,
+        "pagina": pagina,
+        "query": query,
+    })
+
+
+@login_required
+@papel_requerido(PERMISSAO_GERENCIAMENTO)
+@ler_da_replica
+async def usuario(request):
+    query = request.GET.get('query')
+    todos_os_usuarios = Usuario.objects.all()
+    if query:
+        todos_os_usuarios = todos_os_usuarios.filter(
+            Q(reader_name__icontains=query) |
+            Q(reader_contact__icontains=query) |
+            Q(login__icontains=query) |
+            Q(email__icontains=query)
+        ).distinct()
+
+    pagina = await apaginar_por_chave(request, todos_os_usuarios, ordenacao=('id',))
+
+    return await arender(request, "usuario.html", context={
+        "current_tab": "usuario",
+        "usuarios": pagina,
+        "pagina": pagina,
+        "query": query if query else "",
+        "form": UsuarioAdminForm(request_user=request.user),
+    })
+
+
+@login_required
+@papel_requerido(PERMISSAO_GERENCIAMENTO)
+async def pesquisar_emprestimos(request):
+    query = request.GET.get('query')
+    emprestimos_ativos = Emprestimo.objects.filter(devolvido=False).select_related('livro', 'usuario')
+    if query:
+        emprestimos_ativos = emprestimos_ativos.filter(filtro_busca_emprestimos(query)).distinct()
+
+    emprestimos_ativos = await apaginar_por_chave(request, emprestimos_ativos, ordenacao=('-data_emprestimo', '-id'))
+
+    return await arender(request, 'emprestimo.html', {
+        'emprestimos_ativos': emprestimos_ativos,
+        'pagina': emprestimos_ativos,
+        'query': query,
+        'current_tab': 'emprestimo',
+    })
+
+
+@login_required
+@papel_requerido(PERMISSAO_GERENCIAMENTO)
+@ler_da_replica
+async def devolucao_page(request):
+    query = request.GET.get('query')
+    arquivo = request.GET.get('arquivo') == '1'
+    modelo = EmprestimoArquivado if arquivo else Emprestimo
+    emprestimos_devolvidos = modelo.objects.filter(devolvido=True).select_related('livro', 'usuario')
+    if query:
+        emprestimos_devolvidos = emprestimos_devolvidos.filter(filtro_busca_emprestimos(query)).distinct()
+
+    emprestimos_devolvidos = await apaginar_por_chave(request, emprestimos_devolvidos, ordenacao=('id',))
+
+    return await arender(request, 'devolucao.html', {
+        'emprestimos_devolvidos': emprestimos_devolvidos,
+        'pagina': emprestimos_devolvidos,
+        'query': query,
+        'arquivo': arquivo,
+        'dias_arquivo': idade_arquivo().days,
+        'current_tab': 'devolucao',
+    })